@@ -18,12 +18,102 @@
 
 
 import asyncio
+import hashlib
+import logging
+import time
 from telethon.tl.functions.messages import GetCommonChatsRequest
 from telethon.tl.functions.users import GetFullUserRequest
-from telethon.errors import UserPrivacyRestrictedError, FloodWaitError
+from telethon.errors import UserPrivacyRestrictedError, FloodWaitError, MessageNotModifiedError
 
 from .. import loader, utils
 
+logger = logging.getLogger(__name__)
+
+
+class ProgressEditor:
+    """Правки сообщения с прогрессом не чаще interval: отправляется последняя версия текста,
+    повторы пропускаются, после FloodWait или паузы отложенный текст досылается сам"""
+
+    def __init__(self, message, interval=2.0):
+        self.message = message
+        self.interval = interval
+        self.pending = None
+        self.sent = 0
+        self.merged = 0
+        self.skipped = 0
+        self.flood_waits = 0
+        self._digest = None
+        self._next_at = 0.0
+        self._flush_task = None
+
+    def __repr__(self):
+        return (
+            f"ProgressEditor(sent={self.sent}, merged={self.merged}, "
+            f"skipped={self.skipped}, flood_waits={self.flood_waits})"
+        )
+
+    async def update(self, text):
+        """Новый текст прогресса; если править ещё рано, он заменит отложенный и уйдёт позже"""
+        if self.pending is not None:
+            self.merged += 1
+        self.pending = text
+
+        if time.monotonic() < self._next_at:
+            self._schedule()
+            return
+        await self._send()
+
+    async def flush(self):
+        """Дожидается отправки отложенного текста — для конца этапа"""
+        if self.pending is not None:
+            self._schedule()
+        if self._flush_task is not None:
+            await self._flush_task
+
+    def close(self):
+        """Отбрасывает отложенный текст: сообщение дальше правит сама команда"""
+        self.pending = None
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+
+    def _schedule(self):
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.ensure_future(self._flush_later())
+
+    async def _flush_later(self):
+        while self.pending is not None:
+            await asyncio.sleep(max(0.0, self._next_at - time.monotonic()))
+            if time.monotonic() >= self._next_at:
+                await self._send()
+
+    async def _send(self):
+        text, self.pending = self.pending, None
+        if text is None:
+            return
+        digest = hashlib.blake2b(text.encode(), digest_size=16).digest()
+        if digest == self._digest:
+            self.skipped += 1
+            return
+
+        self._next_at = time.monotonic() + self.interval
+        try:
+            await self.message.edit(text)
+        except FloodWaitError as e:
+            self.flood_waits += 1
+            self._next_at = time.monotonic() + e.seconds
+            if self.pending is None:
+                self.pending = text
+            self._schedule()
+            return
+        except MessageNotModifiedError:
+            pass
+        except Exception:
+            return
+
+        self._digest = digest
+        self.sent += 1
+
 
 @loader.tds
 class ChatSiMod(loader.Module):
@@ -86,6 +176,7 @@ class ChatSiMod(loader.Module):
         chat_name = getattr(target_chat, 'title', f'чат {target_chat.id}')
         await message.edit(f"<b>🔍 Ищем в \"{chat_name}\" участников с {min_common}+ общими чатами...</b>")
         
+        progress = ProgressEditor(message)
         try:
             participants = await message.client.get_participants(target_chat)
             target_chat_id = target_chat.id
@@ -139,12 +230,11 @@ class ChatSiMod(loader.Module):
             for i in range(0, total_participants, batch_size):
                 batch = valid_users[i:i + batch_size]
                 
-                if i % (batch_size * 2) == 0:
-                    await message.edit(
-                        f"<b>🚀 Турбо-анализ участников...</b>\n"
-                        f"<b>📊 Прогресс: {min(i + batch_size, total_participants)}/{total_participants}</b>\n"
-                        f"<b>✅ Найдено: {len(result_users)} пользователей</b>"
-                    )
+                await progress.update(
+                    f"<b>🚀 Турбо-анализ участников...</b>\n"
+                    f"<b>📊 Прогресс: {min(i + batch_size, total_participants)}/{total_participants}</b>\n"
+                    f"<b>✅ Найдено: {len(result_users)} пользователей</b>"
+                )
                 
                 tasks = [process_user_fast(user) for user in batch]
                 try:
@@ -166,6 +256,9 @@ class ChatSiMod(loader.Module):
                 else:
                     await asyncio.sleep(0.05)
             
+            progress.close()
+            logger.debug(f"Progress edits: {progress}")
+            
             if not result_users:
                 result_text = (
                     f"<b>❌ В чате \"{chat_name}\" не найдено участников с {min_common}+ общими чатами</b>\n"
@@ -252,6 +345,7 @@ class ChatSiMod(loader.Module):
                     await message.edit(result_text)
                 
         except Exception as e:
+            progress.close()
             await message.edit(
                 f"<b>❌ Произошла ошибка:</b>\n"
                 f"<code>{str(e)}</code>\n\n"
@@ -23,14 +23,17 @@ import os
 import json
 import warnings
 import functools
+import hashlib
 import logging
 import tempfile
 import shutil
+import time
 from io import BytesIO
 
 from dataclasses import dataclass
 from urllib.parse import urljoin, urlparse
 from typing import Union, Optional, List, Dict, Any
+from telethon.errors import FloodWaitError, MessageNotModifiedError
 from .. import loader, utils
 
 try:
@@ -62,6 +65,105 @@ class PinData:
     created_at: Optional[str] = None
 
 
+class ProgressEditor:
+    """Правки сообщения с прогрессом не чаще interval: отправляется последняя версия текста,
+    повторы пропускаются, после FloodWait или паузы отложенный текст досылается сам"""
+
+    def __init__(self, message, interval=1.5):
+        self.message = message
+        self.interval = interval
+        self.pending = None
+        self.sent = 0
+        self.merged = 0
+        self.skipped = 0
+        self.flood_waits = 0
+        self._digest = None
+        self._next_at = 0.0
+        self._flush_task = None
+
+    def __repr__(self):
+        return (
+            f"ProgressEditor(sent={self.sent}, merged={self.merged}, "
+            f"skipped={self.skipped}, flood_waits={self.flood_waits})"
+        )
+
+    async def update(self, text):
+        """Новый текст прогресса; если править ещё рано, он заменит отложенный и уйдёт позже"""
+        if self.pending is not None:
+            self.merged += 1
+        self.pending = text
+
+        if time.monotonic() < self._next_at:
+            self._schedule()
+            return
+        await self._send()
+
+    async def flush(self):
+        """Дожидается отправки отложенного текста — для конца этапа"""
+        if self.pending is not None:
+            self._schedule()
+        if self._flush_task is not None:
+            await self._flush_task
+
+    def close(self):
+        """Отбрасывает отложенный текст: сообщение дальше правит сама команда"""
+        self.pending = None
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+
+    def _schedule(self):
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.ensure_future(self._flush_later())
+
+    async def _flush_later(self):
+        while self.pending is not None:
+            await asyncio.sleep(max(0.0, self._next_at - time.monotonic()))
+            if time.monotonic() >= self._next_at:
+                await self._send()
+
+    async def _send(self):
+        text, self.pending = self.pending, None
+        if text is None:
+            return
+        digest = hashlib.blake2b(text.encode(), digest_size=16).digest()
+        if digest == self._digest:
+            self.skipped += 1
+            return
+
+        self._next_at = time.monotonic() + self.interval
+        try:
+            await utils.answer(self.message, text)
+        except FloodWaitError as e:
+            self.flood_waits += 1
+            self._next_at = time.monotonic() + e.seconds
+            if self.pending is None:
+                self.pending = text
+            self._schedule()
+            return
+        except MessageNotModifiedError:
+            pass
+        except Exception:
+            return
+
+        self._digest = digest
+        self.sent += 1
+
+
+def finishes_progress(func):
+    """Этап загрузки: при выходе отбрасывает отложенный прогресс, не дожидаясь его отправки,
+    чтобы он не перезаписал сообщение, которое дальше правит команда"""
+    @functools.wraps(func)
+    async def wrapper(self, *args, **kwargs):
+        try:
+            return await func(self, *args, **kwargs)
+        finally:
+            if self.progress:
+                self.progress.close()
+
+    return wrapper
+
+
 class TikTokAPI:
     def __init__(self, host: Optional[str] = None):
         self.headers = {
@@ -77,7 +179,7 @@ class TikTokAPI:
 
         self.link = None
         self.result = None
-        self.progress_message = None
+        self.progress = None
 
         self.logger = logging.getLogger("SocialMediaDL-TikTok")
         handler = logging.StreamHandler()
@@ -105,15 +207,15 @@ class TikTokAPI:
 
     def set_progress_message(self, message):
         
-        self.progress_message = message
+        if self.progress:
+            self.progress.close()
+            self.logger.debug(f"Previous progress: {self.progress}")
+        self.progress = ProgressEditor(message) if message else None
 
     async def _update_progress(self, text: str):
         
-        if self.progress_message:
-            try:
-                await utils.answer(self.progress_message, text)
-            except:
-                pass
+        if self.progress:
+            await self.progress.update(text)
 
     async def close_session(self):
         await self.session.close()
@@ -251,6 +353,7 @@ class TikTokAPI:
                 while chunk := await response.content.read(1024):
                     file.write(chunk)
 
+    @finishes_progress
     async def download_sound(
         self,
         link: Union[str],
@@ -295,6 +398,7 @@ class TikTokAPI:
         self.logger.info(f"Sound - Downloaded and saved sound as {audio_filename}")
         return audio_filename
 
+    @finishes_progress
     async def download(
         self, link: Union[str], video_filename: Optional[str] = None, hd: bool = True
     ) -> TTData:
@@ -309,6 +413,7 @@ class TikTokAPI:
             self.logger.error("No downloadable content found in the provided link.")
             raise Exception("No downloadable content found in the provided link.")
 
+    @finishes_progress
     async def download_photos_with_sound(self, link: Union[str]) -> str:
         await self._ensure_data(link)
         
@@ -520,7 +625,7 @@ class PinterestAPI:
             headers=self.headers
         )
         
-        self.progress_message = None
+        self.progress = None
         
         self.logger = logging.getLogger("SocialMediaDL-Pinterest")
         handler = logging.StreamHandler()
@@ -532,14 +637,14 @@ class PinterestAPI:
         self.logger.setLevel(logging.INFO)
 
     def set_progress_message(self, message):
-        self.progress_message = message
+        if self.progress:
+            self.progress.close()
+            self.logger.debug(f"Previous progress: {self.progress}")
+        self.progress = ProgressEditor(message) if message else None
 
     async def _update_progress(self, text: str):
-        if self.progress_message:
-            try:
-                await utils.answer(self.progress_message, text)
-            except:
-                pass
+        if self.progress:
+            await self.progress.update(text)
 
     async def close_session(self):
         await self.session.close()
@@ -1084,6 +1189,7 @@ class PinterestAPI:
             self.logger.error(f"Error extracting from HTML elements: {e}")
             return None
 
+    @finishes_progress
     async def get_pin_data(self, url: str) -> Optional[PinData]:
         if not self._is_pinterest_url(url):
             return None
@@ -1092,6 +1198,7 @@ class PinterestAPI:
         
         return await self._extract_pin_data_from_page(full_url)
 
+    @finishes_progress
     async def download_pin(self, url: str, download_dir: Optional[str] = None) -> Optional[List[str]]:
         pin_data = await self.get_pin_data(url)
         if not pin_data:
@@ -19,27 +19,2102 @@
 # Name: Spots
 # Description: Слушай музыку в Spotify
 # meta developer: @LoLpryvet
-# requires: spotipy aiohttp pillow
+# requires: aiohttp pillow numpy
 # ---------------------------------------------------------------------------------
 
 import asyncio
 import logging
-import tempfile
 import aiohttp
 import os
 import re
+import time
+import pickle
+import sqlite3
+import hashlib
+import functools
+import shutil
+import codecs
+import threading
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from io import BytesIO
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+from urllib.parse import urlencode
+from html.parser import HTMLParser
 
-import spotipy
+import numpy as np
 from PIL import Image, ImageDraw, ImageFont, ImageStat
 import colorsys
 
 from telethon import types
+from telethon.errors import FileReferenceExpiredError, FloodWaitError, MediaEmptyError, MessageNotModifiedError
 
 from .. import loader, utils
 
 logger = logging.getLogger(__name__)
 
+
+@functools.lru_cache(maxsize=8)
+def _radial_falloff(width, height, center_x, center_y, max_distance):
+    """Карта затухания 0..1 от центра, считается один раз на размер карточки"""
+    ys, xs = np.ogrid[:height, :width]
+    distance = ((xs - center_x) ** 2 + (ys - center_y) ** 2) ** 0.5
+    falloff = np.minimum(1.0, distance / max_distance)[..., None]
+    falloff.setflags(write=False)
+    return falloff
+
+
+def render_radial_gradient(width, height, color, center, max_distance=None, darken=0.2):
+    """Радиальный градиент от color в центре до color * darken на краях"""
+    if max_distance is None:
+        max_distance = max(width, height)
+
+    falloff = _radial_falloff(width, height, center[0], center[1], max_distance)
+    base = np.array(color, dtype=np.float64)
+    pixels = base + (base * darken - base) * falloff
+
+    return Image.fromarray(
+        np.clip(pixels.astype(np.int64), 0, 255).astype(np.uint8),
+        'RGB',
+    )
+
+
+class SpotifyAPIError(Exception):
+    """Ошибка Spotify Web API"""
+
+    def __init__(self, status, message, reason=None):
+        self.status = status
+        self.message = message
+        self.reason = reason
+        super().__init__(f"http status: {status}, {message}" + (f", reason: {reason}" if reason else ""))
+
+
+class SpotifyAuthError(SpotifyAPIError):
+    """Ошибка при получении или обновлении токена"""
+
+
+@dataclass(frozen=True)
+class SpotifyTrack:
+    id: str
+    name: str
+    artist_name: str
+    album_name: str
+    album_art: Optional[str]
+    url: str
+    duration_ms: int
+
+    @classmethod
+    def from_api(cls, item: dict) -> "SpotifyTrack":
+        artists = item.get('artists') or [{}]
+        album = item.get('album') or {}
+        images = album.get('images') or []
+        return cls(
+            id=item.get('id') or '',
+            name=item.get('name', 'Unknown Track'),
+            artist_name=artists[0].get('name', 'Unknown Artist'),
+            album_name=album.get('name', 'Unknown Album'),
+            album_art=images[0]['url'] if images else None,
+            url=(item.get('external_urls') or {}).get('spotify', ''),
+            duration_ms=item.get('duration_ms', 0),
+        )
+
+
+@dataclass(frozen=True)
+class SpotifyPlayback:
+    track: Optional[SpotifyTrack]
+    progress_ms: int
+    is_playing: bool
+    device_name: str
+    device_type: str
+    context_uri: Optional[str]
+    timestamp: int
+    fetched_at: float
+
+    @classmethod
+    def from_api(cls, data: dict, fetched_at: Optional[float] = None) -> "SpotifyPlayback":
+        device = data.get('device') or {}
+        context = data.get('context') or {}
+        item = data.get('item')
+        return cls(
+            track=SpotifyTrack.from_api(item) if item else None,
+            progress_ms=data.get('progress_ms') or 0,
+            is_playing=data.get('is_playing', False),
+            device_name=device.get('name', 'Unknown Device'),
+            device_type=device.get('type', ''),
+            context_uri=context.get('uri'),
+            timestamp=data.get('timestamp') or 0,
+            fetched_at=time.monotonic() if fetched_at is None else fetched_at,
+        )
+
+
+@dataclass(frozen=True)
+class SpotifyUser:
+    id: str
+    display_name: str
+
+    @classmethod
+    def from_api(cls, data: dict) -> "SpotifyUser":
+        return cls(id=data.get('id', ''), display_name=data.get('display_name') or data.get('id', ''))
+
+
+class SpotifyClient:
+    """Асинхронный клиент Spotify Web API на одной aiohttp-сессии"""
+
+    API_URL = "https://api.spotify.com/v1"
+    AUTH_URL = "https://accounts.spotify.com/authorize"
+    TOKEN_URL = "https://accounts.spotify.com/api/token"
+    REDIRECT_URI = "https://sp.fajox.one"
+
+    def __init__(
+        self,
+        get_token: Callable[[], Awaitable[Optional[str]]],
+        refresh_token: Optional[Callable[[str], Awaitable[Optional[str]]]] = None,
+        max_retries: int = 3,
+    ):
+        self._get_token = get_token
+        self._refresh_token = refresh_token
+        self._max_retries = max_retries
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=10, keepalive_timeout=60),
+                timeout=aiohttp.ClientTimeout(total=15),
+            )
+        return self._session
+
+    async def close(self):
+        if self._session and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def _send(self, method: str, url: str, **kwargs) -> Tuple[int, Any]:
+        """Выполняет запрос, ожидая Retry-After при 429"""
+        for attempt in range(self._max_retries + 1):
+            async with self.session.request(method, url, **kwargs) as response:
+                if response.status == 429 and attempt < self._max_retries:
+                    retry_after = response.headers.get('Retry-After', '1')
+                    delay = int(retry_after) if retry_after.isdigit() else 1
+                    logger.debug(f"Spotify rate limit hit, retrying in {delay}s")
+                    await asyncio.sleep(delay)
+                    continue
+
+                if response.status == 204:
+                    return response.status, None
+
+                try:
+                    data = await response.json(content_type=None)
+                except ValueError:
+                    data = None
+
+                return response.status, data
+
+    @staticmethod
+    def _error_from(status: int, data: Any, error_cls=SpotifyAPIError) -> SpotifyAPIError:
+        error = data.get('error') if isinstance(data, dict) else None
+        if isinstance(error, dict):
+            return error_cls(status, error.get('message', ''), error.get('reason'))
+        if isinstance(data, dict) and 'error_description' in data:
+            return error_cls(status, data['error_description'], error)
+        return error_cls(status, str(error or data or 'Unknown error'))
+
+    async def request(self, method: str, path: str, **kwargs) -> Any:
+        """Запрос к API; при 401 один раз обновляет токен и повторяет запрос"""
+        token = await self._get_token()
+        if not token:
+            raise SpotifyAPIError(401, "No access token provided")
+
+        headers = kwargs.pop('headers', {})
+        status, data = await self._send(
+            method,
+            self.API_URL + path,
+            headers={**headers, 'Authorization': f"Bearer {token}"},
+            **kwargs,
+        )
+        if status == 401 and self._refresh_token:
+            fresh_token = await self._refresh_token(token)
+            if fresh_token and fresh_token != token:
+                status, data = await self._send(
+                    method,
+                    self.API_URL + path,
+                    headers={**headers, 'Authorization': f"Bearer {fresh_token}"},
+                    **kwargs,
+                )
+
+        if status >= 400:
+            raise self._error_from(status, data)
+        return data
+
+    async def current_playback(self) -> Optional[SpotifyPlayback]:
+        started = time.monotonic()
+        data = await self.request('GET', '/me/player')
+        if not data:
+            return None
+        # progress_ms снят где-то посередине запроса
+        return SpotifyPlayback.from_api(data, (started + time.monotonic()) / 2)
+
+    async def queue(self) -> List[SpotifyTrack]:
+        """Следующие треки в очереди воспроизведения (эпизоды подкастов пропускаются)"""
+        data = await self.request('GET', '/me/player/queue')
+        return [
+            SpotifyTrack.from_api(item)
+            for item in (data or {}).get('queue') or []
+            if item and item.get('type', 'track') == 'track'
+        ]
+
+    async def recently_played(self, limit: int = 50) -> List[SpotifyTrack]:
+        data = await self.request('GET', '/me/player/recently-played', params={'limit': limit})
+        return [SpotifyTrack.from_api(item['track']) for item in (data or {}).get('items') or [] if item.get('track')]
+
+    async def saved_tracks(self, limit: int = 50, offset: int = 0) -> List[SpotifyTrack]:
+        data = await self.request('GET', '/me/tracks', params={'limit': limit, 'offset': offset})
+        return [SpotifyTrack.from_api(item['track']) for item in (data or {}).get('items') or [] if item.get('track')]
+
+    async def current_user(self) -> SpotifyUser:
+        return SpotifyUser.from_api(await self.request('GET', '/me'))
+
+    @classmethod
+    def authorize_url(cls, client_id: str, scope: str) -> str:
+        return cls.AUTH_URL + "?" + urlencode({
+            'client_id': client_id,
+            'response_type': 'code',
+            'redirect_uri': cls.REDIRECT_URI,
+            'scope': scope,
+        })
+
+    async def _token_request(self, client_id: str, client_secret: str, payload: dict) -> dict:
+        status, data = await self._send(
+            'POST',
+            self.TOKEN_URL,
+            data=payload,
+            auth=aiohttp.BasicAuth(client_id, client_secret),
+        )
+        if status >= 400 or not isinstance(data, dict) or 'access_token' not in data:
+            raise self._error_from(status, data, SpotifyAuthError)
+        return data
+
+    async def exchange_code(self, client_id: str, client_secret: str, code: str) -> dict:
+        return await self._token_request(client_id, client_secret, {
+            'grant_type': 'authorization_code',
+            'code': code,
+            'redirect_uri': self.REDIRECT_URI,
+        })
+
+    async def refresh_access_token(self, client_id: str, client_secret: str, refresh_token: str) -> dict:
+        return await self._token_request(client_id, client_secret, {
+            'grant_type': 'refresh_token',
+            'refresh_token': refresh_token,
+        })
+
+
+class SpotifyTokens:
+    """Access-токен Spotify: обновляется незадолго до истечения, одним запросом на всех ждущих"""
+
+    def __init__(
+        self,
+        spotify: SpotifyClient,
+        config,
+        load_expiry: Callable[[], float],
+        save_expiry: Callable[[float], None],
+        margin: float = 120,
+    ):
+        self._spotify = spotify
+        self._config = config
+        self._load_expiry = load_expiry
+        self._save_expiry = save_expiry
+        self._margin = margin
+        self._refreshing: Optional[asyncio.Future] = None
+
+    def _can_refresh(self) -> bool:
+        return all(self._config[key] for key in ('client_id', 'client_secret', 'refresh_token'))
+
+    def expires_in(self) -> float:
+        return self._load_expiry() - time.time()
+
+    async def get(self) -> Optional[str]:
+        """Текущий токен; если он вот-вот истечёт — сначала обновляет"""
+        token = self._config['auth_token']
+        if token and self._can_refresh() and self.expires_in() <= self._margin:
+            try:
+                token = await self.refresh(token)
+            except SpotifyAuthError as e:
+                logger.debug(f"Token refresh failed: {e}")
+        return token
+
+    async def refresh(self, stale_token: Optional[str] = None) -> Optional[str]:
+        """Обновляет токен; параллельные вызовы ждут одно и то же обновление"""
+        if stale_token and self._config['auth_token'] != stale_token:
+            return self._config['auth_token']
+        if self._refreshing is None:
+            self._refreshing = asyncio.ensure_future(self._refresh())
+            self._refreshing.add_done_callback(self._refresh_done)
+        return await asyncio.shield(self._refreshing)
+
+    def _refresh_done(self, future: asyncio.Future):
+        self._refreshing = None
+        if not future.cancelled():
+            future.exception()
+
+    async def _refresh(self) -> Optional[str]:
+        if not self._can_refresh():
+            return self._config['auth_token']
+
+        refresh_token = self._config['refresh_token']
+        token_info = await self._spotify.refresh_access_token(
+            self._config['client_id'],
+            self._config['client_secret'],
+            refresh_token,
+        )
+        if self._config['refresh_token'] != refresh_token:
+            # пока шёл запрос, аккаунт переавторизовали через spcode
+            return self._config['auth_token']
+
+        self.store(token_info)
+        return token_info['access_token']
+
+    def store(self, token_info: dict):
+        """Записывает токены и срок жизни разом, без переключений между записями"""
+        expires_at = time.time() + int(token_info.get('expires_in') or 3600)
+        self._config['auth_token'] = token_info['access_token']
+        if token_info.get('refresh_token'):
+            self._config['refresh_token'] = token_info['refresh_token']
+        self._save_expiry(expires_at)
+
+    def stop(self):
+        if self._refreshing is not None:
+            self._refreshing.cancel()
+            self._refreshing = None
+
+
+class PlaybackSubscription:
+    """Подписка на снимки воспроизведения; хранит только последний снимок"""
+
+    def __init__(self, poller: "PlaybackPoller"):
+        self._poller = poller
+        self._event = asyncio.Event()
+        self._playback: Optional[SpotifyPlayback] = None
+        self._error: Optional[Exception] = None
+
+    def _publish(self, playback: Optional[SpotifyPlayback], error: Optional[Exception] = None):
+        self._playback = playback
+        self._error = error
+        self._event.set()
+
+    async def get(self, timeout: Optional[float] = None) -> Optional[SpotifyPlayback]:
+        """Ждёт следующий снимок; по таймауту возвращает последний известный"""
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return self._playback
+        self._event.clear()
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+        return self._playback
+
+    def interrupt(self):
+        """Будит ожидающего в get(), не меняя последний снимок"""
+        self._event.set()
+
+    def close(self):
+        self._poller.unsubscribe(self)
+
+
+class PlaybackPoller:
+    """Единый опрос состояния плеера на аккаунт с раздачей всем подписчикам"""
+
+    def __init__(
+        self,
+        spotify: SpotifyClient,
+        get_interval: Callable[[], float],
+        error_interval: float = 3.0,
+        min_interval: float = 1.0,
+    ):
+        self._spotify = spotify
+        self._get_interval = get_interval
+        self.error_interval = error_interval
+        self.min_interval = min_interval
+        self._subscribers = set()
+        self._task: Optional[asyncio.Task] = None
+        self._wake = asyncio.Event()
+        self.latest: Optional[SpotifyPlayback] = None
+
+    def subscribe(self) -> PlaybackSubscription:
+        subscription = PlaybackSubscription(self)
+        self._subscribers.add(subscription)
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+        elif self.latest is not None:
+            # опрос уже идёт — новый подписчик сразу получает последний снимок, а не ждёт интервал
+            subscription._publish(self.latest)
+        else:
+            self.wake()
+        return subscription
+
+    def unsubscribe(self, subscription: PlaybackSubscription):
+        self._subscribers.discard(subscription)
+        if not self._subscribers and self._task:
+            self._task.cancel()
+            self._task = None
+
+    def wake(self):
+        """Опрашивает Spotify досрочно, не дожидаясь интервала"""
+        self._wake.set()
+
+    async def _sleep(self, delay: float):
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(self._wake.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
+        self._wake.clear()
+
+        # досрочный опрос всё равно не чаще min_interval
+        remaining = self.min_interval - (time.monotonic() - started)
+        if remaining > 0:
+            await asyncio.sleep(remaining)
+
+    def stop(self):
+        self._subscribers.clear()
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while self._subscribers:
+            try:
+                playback = await self._spotify.current_playback()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.debug(f"Playback poll failed: {e}")
+                for subscription in list(self._subscribers):
+                    subscription._publish(None, e)
+                await self._sleep(self.error_interval)
+                continue
+
+            self.latest = playback
+            for subscription in list(self._subscribers):
+                subscription._publish(playback)
+
+            await self._sleep(self._get_interval())
+
+
+class PlaybackClock:
+    """Экстраполирует позицию трека между опросами Spotify по монотонным часам"""
+
+    def __init__(self, drift_threshold_ms: int = 1500):
+        self.drift_threshold_ms = drift_threshold_ms
+        self.playback: Optional[SpotifyPlayback] = None
+
+    def position_ms(self, now: Optional[float] = None) -> int:
+        playback = self.playback
+        if playback is None:
+            return 0
+        if not playback.is_playing:
+            return playback.progress_ms
+        now = time.monotonic() if now is None else now
+        return playback.progress_ms + int((now - playback.fetched_at) * 1000)
+
+    def update(self, playback: SpotifyPlayback) -> bool:
+        """Принимает снимок; True, если реальная позиция разошлась с прогнозом"""
+        if playback is self.playback:
+            return False
+
+        previous = self.playback
+        drifted = (
+            previous is not None
+            and previous.is_playing
+            and playback.is_playing
+            and previous.track == playback.track
+            and abs(self.position_ms(playback.fetched_at) - playback.progress_ms) > self.drift_threshold_ms
+        )
+        self.playback = playback
+        return drifted
+
+    def time_left(self) -> Optional[float]:
+        if self.playback is None or not self.playback.track:
+            return None
+        return max(0.0, (self.playback.track.duration_ms - self.position_ms()) / 1000)
+
+    def track_finished(self) -> bool:
+        return self.time_left() == 0.0
+
+
+_LRC_TIMESTAMP = re.compile(r'\[(\d{1,3}):(\d{1,2})(?:[.:](\d{1,3}))?\]')
+
+
+@dataclass(frozen=True)
+class LyricsTimeline:
+    """Разобранный LRC: отсортированные времена строк в array('i') и их тексты"""
+
+    times: array
+    texts: Tuple[str, ...]
+
+    @classmethod
+    def parse(cls, lrc: Optional[str]) -> Optional["LyricsTimeline"]:
+        """Разбирает LRC; строка с несколькими метками попадает в каждую из них"""
+        if not lrc:
+            return None
+
+        entries = []
+        for line in lrc.splitlines():
+            stamps, text = cls.split_line(line)
+            if text:
+                entries.extend((time_ms, text) for time_ms in stamps)
+
+        if not entries:
+            return None
+
+        entries.sort(key=lambda entry: entry[0])
+        return cls(
+            times=array('i', (time_ms for time_ms, _ in entries)),
+            texts=tuple(text for _, text in entries),
+        )
+
+    @staticmethod
+    def split_line(line: str) -> Tuple[List[int], str]:
+        """Метки времени строки LRC (в мс) и её текст"""
+        position = 0
+        stamps = []
+        while True:
+            match = _LRC_TIMESTAMP.match(line, position)
+            if not match:
+                break
+            minutes, seconds, fraction = match.groups()
+            time_ms = (int(minutes) * 60 + int(seconds)) * 1000
+            if fraction:
+                time_ms += int(fraction.ljust(3, '0'))
+            stamps.append(time_ms)
+            position = match.end()
+        return stamps, line[position:].strip()
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    def index_at(self, position_ms: int) -> int:
+        """Индекс строки, звучащей на position_ms (-1, если текст ещё не начался)"""
+        return bisect_right(self.times, position_ms) - 1
+
+    def next_time(self, index: int) -> Optional[int]:
+        """Время начала строки после index"""
+        return self.times[index + 1] if index + 1 < len(self.times) else None
+
+
+def normalize_track_field(value: Optional[str]) -> str:
+    """Исполнитель или название без пометок в скобках, регистра и лишних пробелов"""
+    value = re.sub(r'\([^)]*\)|\[[^\]]*\]', '', value or '')
+    return ' '.join(value.casefold().split())
+
+
+class LyricsCache:
+    """Кэш найденных текстов в SQLite: TTL, отдельный TTL для промахов и LRU по размеру"""
+
+    # время последнего чтения для LRU обновляется не чаще, чем раз в столько секунд
+    ACCESS_RESOLUTION = 600
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path)
+        # WAL + NORMAL: коммит не ждёт fsync, а база переживает падение процесса
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS lyrics ("
+            "key TEXT PRIMARY KEY, kind TEXT, lyrics TEXT, plain TEXT, "
+            "expires REAL NOT NULL, accessed REAL NOT NULL, size INTEGER NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS lyrics_accessed ON lyrics (accessed)")
+        self._db.commit()
+        self._size = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM lyrics").fetchone()[0]
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(artist: str, title: str, duration_ms: Optional[int] = None) -> str:
+        return f"{normalize_track_field(artist)}|{normalize_track_field(title)}|{(duration_ms or 0) // 1000}"
+
+    def get(self, key: str) -> Tuple[bool, Optional[dict]]:
+        """Возвращает (найдено, результат); результат None — закэшированный промах"""
+        now = time.time()
+        row = self._db.execute(
+            "SELECT kind, lyrics, plain, expires, accessed FROM lyrics WHERE key = ?", (key,)
+        ).fetchone()
+        if not row or row[3] < now:
+            self.misses += 1
+            return False, None
+
+        self.hits += 1
+        kind, lyrics, plain, _, accessed = row
+        if now - accessed > self.ACCESS_RESOLUTION:
+            self._db.execute("UPDATE lyrics SET accessed = ? WHERE key = ?", (now, key))
+            self._db.commit()
+
+        if kind is None:
+            return True, None
+        result = {'type': kind, 'lyrics': lyrics}
+        if plain is not None:
+            result['plain'] = plain
+        return True, result
+
+    def contains(self, key: str) -> bool:
+        """Есть ли свежая запись (в том числе промах), без учёта в статистике"""
+        row = self._db.execute("SELECT 1 FROM lyrics WHERE key = ? AND expires >= ?", (key, time.time())).fetchone()
+        return row is not None
+
+    def put(self, key: str, result: Optional[dict], ttl: float, max_bytes: int):
+        now = time.time()
+        kind = result['type'] if result else None
+        lyrics = result['lyrics'] if result else None
+        plain = result.get('plain') if result else None
+        size = len(key) + len((lyrics or '').encode()) + len((plain or '').encode())
+        old = self._db.execute("SELECT size FROM lyrics WHERE key = ?", (key,)).fetchone()
+        self._db.execute(
+            "INSERT OR REPLACE INTO lyrics VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (key, kind, lyrics, plain, now + ttl, now, size),
+        )
+        self._size += size - (old[0] if old else 0)
+        # полный пересчёт размера и чистка — только когда кэш вырос сверх лимита
+        if self._size > max_bytes:
+            self._evict(max_bytes)
+        self._db.commit()
+
+    def _evict(self, max_bytes: int):
+        self._db.execute("DELETE FROM lyrics WHERE expires < ?", (time.time(),))
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM lyrics").fetchone()[0]
+        self._size = total
+        if total <= max_bytes:
+            return
+
+        stale = []
+        for key, size in self._db.execute("SELECT key, size FROM lyrics ORDER BY accessed"):
+            if total <= max_bytes:
+                break
+            stale.append((key,))
+            total -= size
+        self._db.executemany("DELETE FROM lyrics WHERE key = ?", stale)
+        self._size = total
+
+    def stats(self) -> dict:
+        entries, negative, size = self._db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(kind IS NULL), 0), COALESCE(SUM(size), 0) FROM lyrics"
+        ).fetchone()
+        return {
+            'entries': entries,
+            'negative': negative,
+            'size': size,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+    def purge(self):
+        self._db.execute("DELETE FROM lyrics")
+        self._db.commit()
+        self._db.execute("VACUUM")
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def close(self):
+        self._db.close()
+
+
+_LRC_TAG = re.compile(r'^\s*\[(ar|ti):([^\]]*)\]', re.IGNORECASE | re.MULTILINE)
+
+
+class LrcLibrary:
+    """Индекс локальной папки с .lrc по исполнителю и названию; хранится в SQLite и обновляется по mtime"""
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path)
+        self._db.execute("CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, mtime INTEGER NOT NULL, key TEXT)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+        self._db.commit()
+
+        row = self._db.execute("SELECT value FROM meta WHERE name = 'root'").fetchone()
+        self.root: Optional[str] = row[0] if row else None
+        self._files = {path: (mtime, key) for path, mtime, key in self._db.execute("SELECT path, mtime, key FROM files")}
+        self._paths = {key: path for path, (_, key) in self._files.items() if key}
+        self._refreshing: Optional[asyncio.Future] = None
+
+    def __len__(self) -> int:
+        return len(self._paths)
+
+    @staticmethod
+    def make_key(artist: str, title: str) -> str:
+        return f"{normalize_track_field(artist)}|{normalize_track_field(title)}"
+
+    @classmethod
+    def _read_key(cls, path: str) -> Optional[str]:
+        """Ключ файла по тегам [ar:]/[ti:], а если их нет — по имени «Исполнитель - Название.lrc»"""
+        with open(path, encoding='utf-8', errors='replace') as f:
+            head = f.read(4096)
+        tags = {name.lower(): value.strip() for name, value in _LRC_TAG.findall(head)}
+        artist, title = tags.get('ar'), tags.get('ti')
+
+        if not (artist and title):
+            stem = os.path.splitext(os.path.basename(path))[0]
+            if ' - ' not in stem:
+                return None
+            file_artist, file_title = stem.split(' - ', 1)
+            artist, title = artist or file_artist, title or file_title
+
+        return cls.make_key(artist, title)
+
+    @classmethod
+    def _scan(cls, root: str, known: dict) -> Tuple[List[Tuple[str, int, Optional[str]]], List[str]]:
+        """Обходит папку и перечитывает только новые и изменившиеся файлы"""
+        changed, seen = [], set()
+        for directory, _, names in os.walk(root):
+            for name in names:
+                if not name.lower().endswith('.lrc'):
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    mtime = os.stat(path).st_mtime_ns
+                    seen.add(path)
+                    if path in known and known[path][0] == mtime:
+                        continue
+                    changed.append((path, mtime, cls._read_key(path)))
+                except OSError:
+                    seen.discard(path)
+        removed = [path for path in known if path not in seen]
+        return changed, removed
+
+    async def refresh(self, root: Optional[str]):
+        """Догоняет индекс до состояния папки; одновременные вызовы ждут один проход"""
+        if self._refreshing is None or self._refreshing.done():
+            self._refreshing = asyncio.ensure_future(self._refresh(root))
+        await asyncio.shield(self._refreshing)
+
+    async def _refresh(self, root: Optional[str]):
+        if root != self.root:
+            self._files.clear()
+            self._paths.clear()
+            self._db.execute("DELETE FROM files")
+            self._db.execute("INSERT OR REPLACE INTO meta VALUES ('root', ?)", (root,))
+            self._db.commit()
+            self.root = root
+        if not root or not os.path.isdir(root):
+            return
+
+        changed, removed = await asyncio.to_thread(self._scan, root, dict(self._files))
+
+        for path in removed:
+            _, key = self._files.pop(path)
+            if key and self._paths.get(key) == path:
+                del self._paths[key]
+                # тот же трек мог лежать ещё в одном файле
+                for other, (_, other_key) in self._files.items():
+                    if other_key == key:
+                        self._paths[key] = other
+                        break
+        for path, mtime, key in changed:
+            previous = self._files.get(path)
+            if previous and previous[1] and self._paths.get(previous[1]) == path:
+                del self._paths[previous[1]]
+            self._files[path] = (mtime, key)
+            if key:
+                self._paths[key] = path
+
+        self._db.executemany("DELETE FROM files WHERE path = ?", [(path,) for path in removed])
+        self._db.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?)", changed)
+        self._db.commit()
+        if changed or removed:
+            logger.debug(f"LRC library: {len(changed)} updated, {len(removed)} removed, {len(self)} indexed")
+
+    def find_path(self, artist: str, title: str) -> Optional[str]:
+        return self._paths.get(self.make_key(artist, title))
+
+    async def find(self, artist: str, title: str) -> Optional[dict]:
+        path = self.find_path(artist, title)
+        if not path:
+            return None
+        try:
+            text = await asyncio.to_thread(self._read, path)
+        except OSError:
+            return None
+        if LyricsTimeline.parse(text):
+            return {'type': 'synced', 'lyrics': text}
+        text = _LRC_TAG.sub('', text).strip()
+        return {'type': 'plain', 'lyrics': text} if text else None
+
+    @staticmethod
+    def _read(path: str) -> str:
+        with open(path, encoding='utf-8', errors='replace') as f:
+            return f.read()
+
+    def close(self):
+        if self._refreshing is not None:
+            self._refreshing.cancel()
+        self._db.close()
+
+
+class GeniusLyricsParser(HTMLParser):
+    """Потоковый разбор страницы Genius: собирает все блоки текста и замечает конец секции"""
+
+    VOID_TAGS = frozenset(("area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "wbr"))
+    MARKERS = ('id="lyrics-root"', 'data-lyrics-container="true"', 'class="lyrics"')
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts: List[List[str]] = []
+        self.done = False
+        self._depth = 0
+        self._root_depth = 0
+        self._skip_depth = 0
+
+    @staticmethod
+    def _is_container(attrs: dict) -> bool:
+        return attrs.get('data-lyrics-container') == 'true' or 'lyrics' in (attrs.get('class') or '').split()
+
+    def handle_starttag(self, tag, attrs):
+        # после конца секции парсер дочитывает текущую порцию — её не собираем
+        if self.done:
+            return
+        if tag in self.VOID_TAGS:
+            if tag == 'br' and self._depth and not self._skip_depth:
+                self.parts[-1].append('\n')
+            return
+
+        attrs = dict(attrs)
+        if self._depth:
+            self._depth += 1
+            if self._skip_depth:
+                self._skip_depth += 1
+            elif attrs.get('data-exclude-from-selection') == 'true':
+                self._skip_depth = 1
+        elif self._root_depth:
+            self._root_depth += 1
+        elif attrs.get('id') == 'lyrics-root':
+            self._root_depth = 1
+
+        if not self._depth and tag == 'div' and self._is_container(attrs):
+            self._depth = 1
+            self.parts.append([])
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in self.VOID_TAGS:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag in self.VOID_TAGS:
+            return
+        if self._depth:
+            self._depth -= 1
+            if self._skip_depth:
+                self._skip_depth -= 1
+            if self._depth:
+                return
+        if self._root_depth:
+            self._root_depth -= 1
+            if not self._root_depth and self.parts:
+                self.done = True
+
+    def handle_data(self, data):
+        if self._depth and not self._skip_depth:
+            self.parts[-1].append(data)
+
+    @property
+    def lyrics(self) -> Optional[str]:
+        blocks = [''.join(part).strip() for part in self.parts]
+        text = '\n\n'.join(block for block in blocks if block)
+        return re.sub(r'\n{3,}', '\n\n', text) or None
+
+
+async def scrape_genius_lyrics(response: aiohttp.ClientResponse, max_bytes: int = 3 * 1024 * 1024) -> Optional[str]:
+    """Читает страницу по кускам и останавливается, как только секция текста закончилась"""
+    parser = GeniusLyricsParser()
+    decoder = codecs.getincrementaldecoder(response.charset or 'utf-8')(errors='replace')
+    received = 0
+    # до начала текста HTML не разбираем — только ищем маркер секции
+    head = ''
+
+    async for chunk in response.content.iter_chunked(64 * 1024):
+        received += len(chunk)
+        text = decoder.decode(chunk)
+        if head is not None:
+            head += text
+            start = _genius_lyrics_start(head)
+            if start is None:
+                head = head[-4096:]
+            else:
+                text, head = head[start:], None
+
+        if head is None:
+            # небольшими порциями, чтобы не разбирать хвост страницы после конца текста
+            for offset in range(0, len(text), 4096):
+                parser.feed(text[offset:offset + 4096])
+                if parser.done:
+                    break
+            if parser.done:
+                break
+        if received >= max_bytes:
+            logger.debug(f"Genius page exceeded {max_bytes} bytes, parsed what was read")
+            break
+    else:
+        parser.feed(decoder.decode(b'', final=True))
+        parser.close()
+
+    return parser.lyrics
+
+
+def _genius_lyrics_start(html: str) -> Optional[int]:
+    """Позиция тега, с которого начинается секция текста, или None"""
+    positions = [
+        position
+        for position in (html.find(marker) for marker in GeniusLyricsParser.MARKERS)
+        if position != -1
+    ]
+    if not positions:
+        return None
+    start = html.rfind('<', 0, min(positions))
+    return start if start != -1 else None
+
+
+def raise_for_transient_status(response):
+    """429 и 5xx — сбой источника, а не ответ «текста нет»"""
+    if response.status == 429 or response.status >= 500:
+        response.raise_for_status()
+
+
+@dataclass
+class LyricsProviderStats:
+    calls: int = 0
+    hits: int = 0
+    timeouts: int = 0
+    errors: int = 0
+    cancelled: int = 0
+    total_ms: float = 0.0
+
+    @property
+    def avg_ms(self) -> float:
+        finished = self.calls - self.cancelled
+        return self.total_ms / finished if finished else 0.0
+
+
+@dataclass
+class LyricsProvider:
+    name: str
+    fetch: Callable[[str, str, Optional[int]], Awaitable[Optional[dict]]]
+    synced: bool = False
+    timeout: Optional[float] = None
+    enabled: Callable[[], bool] = lambda: True
+    stats: LyricsProviderStats = field(default_factory=LyricsProviderStats)
+    failed_at: float = 0.0
+
+
+@dataclass
+class LyricsLookup:
+    """Итог поиска: complete — все источники ответили без ошибок и таймаутов; queried — сколько их опрошено"""
+    lyrics: Optional[dict]
+    complete: bool
+    queried: int = 0
+
+
+class LyricsProviders:
+    """Опрашивает источники текстов параллельно и отдаёт лучший результат как можно раньше"""
+
+    # сколько фоновый поиск не трогает источник после ошибки или таймаута
+    FAILURE_COOLDOWN = 600
+
+    def __init__(self, get_timeout: Callable[[], float]):
+        self._get_timeout = get_timeout
+        self.providers: List[LyricsProvider] = []
+
+    def register(self, name: str, fetch, synced: bool = False, timeout: Optional[float] = None, enabled=None):
+        """Добавляет источник; порядок регистрации — приоритет среди равных по типу"""
+        provider = LyricsProvider(name, fetch, synced, timeout)
+        if enabled is not None:
+            provider.enabled = enabled
+        self.providers.append(provider)
+        return provider
+
+    @staticmethod
+    def _rank(result: Optional[dict], order: int) -> Tuple[int, int]:
+        if not result:
+            return 2, order
+        return (0 if result['type'] == 'synced' else 1), order
+
+    async def _run(self, provider: LyricsProvider, artist: str, title: str, duration_ms: Optional[int]):
+        """(результат, ответил ли источник): таймаут и ошибка — не то же самое, что «текста нет»"""
+        provider.stats.calls += 1
+        started = time.perf_counter()
+        answered = True
+        try:
+            result = await asyncio.wait_for(
+                provider.fetch(artist, title, duration_ms),
+                provider.timeout or self._get_timeout(),
+            )
+        except asyncio.TimeoutError:
+            provider.stats.timeouts += 1
+            result, answered = None, False
+        except asyncio.CancelledError:
+            provider.stats.cancelled += 1
+            raise
+        except Exception as e:
+            logger.debug(f"Lyrics provider {provider.name} failed: {e}")
+            provider.stats.errors += 1
+            result, answered = None, False
+
+        provider.stats.total_ms += (time.perf_counter() - started) * 1000
+        if not answered:
+            provider.failed_at = time.monotonic()
+        if result:
+            provider.stats.hits += 1
+        return result, answered
+
+    async def find(self, artist: str, title: str, duration_ms: Optional[int] = None) -> LyricsLookup:
+        pending = {
+            asyncio.ensure_future(self._run(provider, artist, title, duration_ms)): (order, provider)
+            for order, provider in enumerate(self.providers)
+            if provider.enabled()
+        }
+        queried = len(pending)
+        best, best_rank = None, self._rank(None, len(self.providers))
+        complete = True
+
+        try:
+            while pending:
+                # лучшее, что ещё может прийти от незавершённых источников
+                possible = min(
+                    (0 if provider.synced else 1, order)
+                    for order, provider in pending.values()
+                )
+                if best_rank <= possible:
+                    break
+
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    order, _ = pending.pop(task)
+                    result, answered = task.result()
+                    complete = complete and answered
+                    rank = self._rank(result, order)
+                    if rank < best_rank:
+                        best, best_rank = result, rank
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+        return LyricsLookup(best, complete and not pending, queried)
+
+    async def find_sequential(self, artist: str, title: str, duration_ms: Optional[int] = None) -> LyricsLookup:
+        """Фоновый поиск: источники по одному в порядке приоритета, недавно сбоившие пропускаются"""
+        candidates = sorted(
+            (
+                (0 if provider.synced else 1, order, provider)
+                for order, provider in enumerate(self.providers)
+                if provider.enabled()
+            ),
+            key=lambda candidate: candidate[:2],
+        )
+        best, best_rank = None, self._rank(None, len(self.providers))
+        complete = True
+        queried = 0
+
+        for kind, order, provider in candidates:
+            if best_rank <= (kind, order):
+                break
+            if provider.failed_at and time.monotonic() - provider.failed_at < self.FAILURE_COOLDOWN:
+                complete = False
+                continue
+            queried += 1
+            result, answered = await self._run(provider, artist, title, duration_ms)
+            complete = complete and answered
+            rank = self._rank(result, order)
+            if rank < best_rank:
+                best, best_rank = result, rank
+
+        return LyricsLookup(best, complete, queried)
+
+
+def get_dominant_color(image):
+    """Получает доминирующий цвет изображения"""
+    small_image = image.convert('RGB').resize((50, 50))
+    stat = ImageStat.Stat(small_image)
+    r, g, b = stat.mean
+    return int(r), int(g), int(b)
+
+
+def create_darker_variant(r, g, b, factor=0.4):
+    """Создает более темный вариант цвета"""
+    h, s, v = colorsys.rgb_to_hsv(r/255, g/255, b/255)
+    v = max(0.15, v * factor)
+    s = min(1.0, s * 1.1)
+    r, g, b = colorsys.hsv_to_rgb(h, s, v)
+    return int(r * 255), int(g * 255), int(b * 255)
+
+
+def rounded_thumbnail(image, size, radius=20):
+    """Квадратная обложка size x size со скруглёнными углами"""
+    thumbnail = image.resize((size, size), Image.Resampling.LANCZOS)
+    mask = Image.new('L', (size, size), 0)
+    ImageDraw.Draw(mask).rounded_rectangle([0, 0, size, size], radius=radius, fill=255)
+    thumbnail.putalpha(mask)
+    return thumbnail
+
+
+class AlbumArt:
+    """Обложка альбома с лениво посчитанными цветами и миниатюрами"""
+
+    def __init__(self, url: str, data: bytes):
+        self.url = url
+        self.data = data
+        self._image = None
+        self._dominant_color = None
+        self._thumbnails = {}
+        # ленивые поля заполняют потоки пула рендера — одна и та же обложка может рисоваться параллельно
+        self._lock = threading.RLock()
+
+    @property
+    def image(self):
+        if self._image is None:
+            with self._lock:
+                if self._image is None:
+                    image = Image.open(BytesIO(self.data))
+                    image.load()
+                    self._image = image
+        return self._image
+
+    @property
+    def dominant_color(self) -> Tuple[int, int, int]:
+        if self._dominant_color is None:
+            with self._lock:
+                if self._dominant_color is None:
+                    self._dominant_color = get_dominant_color(self.image)
+        return self._dominant_color
+
+    @property
+    def background_color(self) -> Tuple[int, int, int]:
+        return create_darker_variant(*self.dominant_color)
+
+    def thumbnail(self, size: int):
+        """Миниатюра с маской скругления; не изменять — объект общий для всех карточек"""
+        thumbnail = self._thumbnails.get(size)
+        if thumbnail is None:
+            with self._lock:
+                thumbnail = self._thumbnails.get(size)
+                if thumbnail is None:
+                    thumbnail = self._thumbnails[size] = rounded_thumbnail(self.image, size)
+        return thumbnail
+
+    @property
+    def memory_size(self) -> int:
+        size = len(self.data) + sum(w * h * 4 for w, h in (t.size for t in list(self._thumbnails.values())))
+        if self._image is not None:
+            size += self._image.width * self._image.height * len(self._image.getbands())
+        return size
+
+
+class AlbumArtCache:
+    """Кэш обложек по URL: LRU в памяти поверх LRU на диске"""
+
+    def __init__(self, directory: str, get_memory_limit: Callable[[], int], get_disk_limit: Callable[[], int]):
+        self._directory = directory
+        self._get_memory_limit = get_memory_limit
+        self._get_disk_limit = get_disk_limit
+        self._memory: "OrderedDict[str, AlbumArt]" = OrderedDict()
+        self._loading = {}
+        self._session: Optional[aiohttp.ClientSession] = None
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, url: str) -> str:
+        return os.path.join(self._directory, hashlib.sha1(url.encode()).hexdigest())
+
+    async def get(self, url: str) -> AlbumArt:
+        if url in self._memory:
+            self._memory.move_to_end(url)
+            return self._memory[url]
+
+        art = await self._fetch(url)
+        self.remember(art)
+        return art
+
+    def cached(self, url: str) -> bool:
+        return url in self._memory or os.path.exists(self._path(url))
+
+    async def warm(self, url: str) -> bool:
+        """Скачивает обложку на диск, не занимая память; False — она уже была в кэше"""
+        if self.cached(url):
+            return False
+        await self._fetch(url)
+        return True
+
+    async def _fetch(self, url: str) -> AlbumArt:
+        # одновременные запросы одной обложки качают её один раз
+        if url not in self._loading:
+            self._loading[url] = asyncio.ensure_future(self._load(url))
+        try:
+            return await asyncio.shield(self._loading[url])
+        finally:
+            if url in self._loading and self._loading[url].done():
+                del self._loading[url]
+
+    async def _load(self, url: str) -> AlbumArt:
+        path = self._path(url)
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+            return AlbumArt(url, data)
+
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=20))
+        async with self._session.get(url) as response:
+            response.raise_for_status()
+            data = await response.read()
+
+        with open(path, 'wb') as f:
+            f.write(data)
+        self._trim_disk()
+        return AlbumArt(url, data)
+
+    def remember(self, art: AlbumArt):
+        """Кладёт обложку в память и вытесняет самые старые при превышении лимита"""
+        self._memory[art.url] = art
+        self._memory.move_to_end(art.url)
+        self.trim_memory()
+
+    def trim_memory(self):
+        limit = self._get_memory_limit()
+        total = sum(art.memory_size for art in self._memory.values())
+        while total > limit and len(self._memory) > 1:
+            _, art = self._memory.popitem(last=False)
+            total -= art.memory_size
+
+    def _trim_disk(self):
+        files = []
+        for name in os.listdir(self._directory):
+            path = os.path.join(self._directory, name)
+            stat = os.stat(path)
+            files.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in files)
+        limit = self._get_disk_limit()
+        for _, size, path in sorted(files):
+            if total <= limit:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
+    async def close(self):
+        if self._session and not self._session.closed:
+            await self._session.close()
+
+
+class AudioCache:
+    """Скачанные треки по id Spotify: LRU на диске и ссылки на уже загруженные в Telegram документы"""
+
+    MAX_DOCUMENTS = 1000
+
+    def __init__(
+        self,
+        directory: str,
+        get_disk_limit: Callable[[], int],
+        load_documents: Callable[[], dict],
+        save_documents: Callable[[dict], None],
+    ):
+        self._directory = directory
+        self._get_disk_limit = get_disk_limit
+        self._save_documents = save_documents
+        self._documents: "OrderedDict[str, list]" = OrderedDict(load_documents() or {})
+        self._loading = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def document(self, track_id: str) -> Optional[types.InputDocument]:
+        """Документ, который уже загружали в Telegram, — его можно отправить без загрузки"""
+        ref = self._documents.get(track_id)
+        if not ref:
+            return None
+        document_id, access_hash, file_reference = ref
+        return types.InputDocument(
+            id=document_id,
+            access_hash=access_hash,
+            file_reference=bytes.fromhex(file_reference),
+        )
+
+    def remember_document(self, track_id: str, message):
+        document = getattr(message, 'document', None)
+        if document is None:
+            return
+        self._documents[track_id] = [document.id, document.access_hash, document.file_reference.hex()]
+        self._documents.move_to_end(track_id)
+        while len(self._documents) > self.MAX_DOCUMENTS:
+            self._documents.popitem(last=False)
+        self._save_documents(dict(self._documents))
+
+    def forget_document(self, track_id: str):
+        if self._documents.pop(track_id, None) is not None:
+            self._save_documents(dict(self._documents))
+
+    def _find(self, track_id: str) -> Optional[str]:
+        prefix = track_id + "."
+        for name in os.listdir(self._directory):
+            if name.startswith(prefix):
+                path = os.path.join(self._directory, name)
+                os.utime(path)
+                return path
+        return None
+
+    async def fetch(self, track_id: str, download: Callable[[], Awaitable[Any]]) -> Any:
+        """Путь к файлу трека: из кэша или после скачивания (одного на все одновременные запросы).
+        Если загрузчик вернул не путь, а уже готовый документ Telegram, он отдаётся как есть"""
+        path = self._find(track_id)
+        if path:
+            return path
+
+        if track_id not in self._loading:
+            self._loading[track_id] = asyncio.ensure_future(self._download(track_id, download))
+        try:
+            return await asyncio.shield(self._loading[track_id])
+        finally:
+            if track_id in self._loading and self._loading[track_id].done():
+                del self._loading[track_id]
+
+    async def _download(self, track_id: str, download: Callable[[], Awaitable[Any]]) -> Any:
+        source = await download()
+        # musicdl.dl(only_document=True) отдаёт документ Telegram, на диск класть нечего
+        if not isinstance(source, (str, os.PathLike)) or not os.path.isfile(source):
+            return source
+
+        extension = os.path.splitext(source)[1] or ".mp3"
+        path = os.path.join(self._directory, track_id + extension)
+        await asyncio.to_thread(shutil.move, source, path)
+        self._trim_disk(keep=path)
+        return path
+
+    def _trim_disk(self, keep: str):
+        files = []
+        for name in os.listdir(self._directory):
+            path = os.path.join(self._directory, name)
+            if path == keep:
+                continue
+            stat = os.stat(path)
+            files.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in files) + os.path.getsize(keep)
+        limit = self._get_disk_limit()
+        for _, size, path in sorted(files):
+            if total <= limit:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
+
+SONG_CARD_WIDTH = 800
+SONG_CARD_HEIGHT = 300
+SONG_CARD_ALBUM_SIZE = 240
+SONG_CARD_TEXT_X = 30 + SONG_CARD_ALBUM_SIZE + 30
+
+_song_card_bases = OrderedDict()
+_song_card_bases_lock = threading.Lock()
+
+
+@functools.lru_cache(maxsize=1)
+def _song_card_fonts():
+    try:
+
+        title_font = ImageFont.truetype("/System/Library/Fonts/Helvetica-Bold.ttc", 42)
+        artist_font = ImageFont.truetype("/System/Library/Fonts/Helvetica.ttc", 28)
+        time_font = ImageFont.truetype("/System/Library/Fonts/Helvetica.ttc", 20)
+    except:
+        try:
+            title_font = ImageFont.truetype("arial.ttf", 42)
+            artist_font = ImageFont.truetype("arial.ttf", 28)
+            time_font = ImageFont.truetype("arial.ttf", 20)
+        except:
+            try:
+                title_font = ImageFont.truetype("DejaVuSans-Bold.ttf", 42)
+                artist_font = ImageFont.truetype("DejaVuSans.ttf", 28)
+                time_font = ImageFont.truetype("DejaVuSans.ttf", 20)
+            except:
+                title_font = ImageFont.load_default()
+                artist_font = ImageFont.load_default()
+                time_font = ImageFont.load_default()
+    return title_font, artist_font, time_font
+
+
+def render_song_card_base(track_info, album_art):
+    """Статичные слои карточки: фон, обложка, название и исполнитель"""
+    card_width = SONG_CARD_WIDTH
+    card_height = SONG_CARD_HEIGHT
+
+
+    bg_r, bg_g, bg_b = album_art.background_color
+
+
+    card = render_radial_gradient(
+        card_width,
+        card_height,
+        (bg_r, bg_g, bg_b),
+        center=(150, card_height // 2),
+    )
+    draw = ImageDraw.Draw(card)
+
+
+    album_size = SONG_CARD_ALBUM_SIZE
+    thumbnail = album_art.thumbnail(album_size)
+
+
+    art_x = 30
+    art_y = int((card_height - album_size) // 2)  
+    card.paste(thumbnail, (art_x, art_y), thumbnail)
+
+
+    title_font, artist_font, _ = _song_card_fonts()
+
+
+    text_x = SONG_CARD_TEXT_X
+
+
+    track_name = track_info['track_name']
+    if len(track_name) > 20:
+        track_name = track_name[:20] + "..."
+    draw.text((text_x, 60), track_name, font=title_font, fill='white')
+
+
+    artist_name = track_info['artist_name']
+    if len(artist_name) > 25:
+        artist_name = artist_name[:25] + "..."
+    draw.text((text_x, 110), artist_name, font=artist_font, fill='#A0A0A0')
+
+    return card
+
+
+def cached_song_card_base(track_info, album_art):
+    """Статичные слои из кэша; рисуются один раз на трек (в каждом воркере свой кэш)"""
+    key = (track_info.get('track_id'), track_info['track_name'], track_info['artist_name'], album_art.url)
+    with _song_card_bases_lock:
+        base = _song_card_bases.get(key)
+        if base is not None:
+            _song_card_bases.move_to_end(key)
+            return base
+
+    base = render_song_card_base(track_info, album_art)
+    with _song_card_bases_lock:
+        _song_card_bases[key] = base
+        while len(_song_card_bases) > 4:
+            _song_card_bases.popitem(last=False)
+    return base
+
+
+def draw_song_card_progress(card, track_info):
+    """Дорисовывает полосу прогресса и время поверх статичных слоёв"""
+    draw = ImageDraw.Draw(card)
+    _, _, time_font = _song_card_fonts()
+
+
+    text_x = SONG_CARD_TEXT_X
+    progress_y = 220
+    progress_width = SONG_CARD_WIDTH - text_x - 30  
+    progress_height = 6
+    progress_x = text_x
+
+
+    draw.rounded_rectangle([progress_x, progress_y, progress_x + progress_width, progress_y + progress_height], 
+                         radius=3, fill='#555555')
+
+
+    current_time_str = track_info.get('current_time', '00:17')
+    duration_str = track_info['duration']
+
+
+    try:
+        current_parts = current_time_str.split(':')
+        current_seconds = int(current_parts[0]) * 60 + int(current_parts[1])
+
+        duration_parts = duration_str.split(':')
+        duration_seconds = int(duration_parts[0]) * 60 + int(duration_parts[1])
+
+        if duration_seconds > 0:
+            progress_ratio = current_seconds / duration_seconds
+        else:
+            progress_ratio = 0.1
+    except:
+        progress_ratio = 0.1
+
+    progress_fill = int(progress_width * progress_ratio)
+    draw.rounded_rectangle([progress_x, progress_y, progress_x + progress_fill, progress_y + progress_height], 
+                         radius=3, fill='white')
+
+
+    current_time = track_info.get('current_time', '00:17')
+    total_time = track_info['duration']
+
+
+    draw.text((progress_x, progress_y + 20), current_time, font=time_font, fill='#A0A0A0')
+
+
+    time_bbox = draw.textbbox((0, 0), total_time, font=time_font)
+    time_width = time_bbox[2] - time_bbox[0]
+    draw.text((progress_x + progress_width - time_width, progress_y + 20), total_time, 
+             font=time_font, fill='#A0A0A0')
+
+    return card
+
+
+def render_song_card(track_info, album_art):
+    """Рисует карточку трека с прогрессом; чистая функция от данных трека и обложки"""
+    return draw_song_card_progress(cached_song_card_base(track_info, album_art).copy(), track_info)
+
+
+def render_song_card_no_time(track_info, album_art):
+    """Рисует карточку трека без времени для live-режима"""
+    card_width = 800
+    card_height = 250  
+
+
+    bg_r, bg_g, bg_b = album_art.background_color
+
+
+    card = render_radial_gradient(
+        card_width,
+        card_height,
+        (bg_r, bg_g, bg_b),
+        center=(125, card_height // 2),
+    )
+    draw = ImageDraw.Draw(card)
+
+
+    album_size = 200  
+    thumbnail = album_art.thumbnail(album_size)
+
+
+    art_x = 25
+    art_y = int((card_height - album_size) // 2)  
+    card.paste(thumbnail, (art_x, art_y), thumbnail)
+
+
+    title_font, artist_font, _ = _song_card_fonts()
+
+
+    text_x = art_x + album_size + 30
+
+
+    track_name = track_info['track_name']
+    if len(track_name) > 20:
+        track_name = track_name[:20] + "..."
+
+
+    title_y = card_height // 2 - 30
+    artist_y = card_height // 2 + 10
+
+    draw.text((text_x, title_y), track_name, font=title_font, fill='white')
+
+
+    artist_name = track_info['artist_name']
+    if len(artist_name) > 25:
+        artist_name = artist_name[:25] + "..."
+    draw.text((text_x, artist_y), artist_name, font=artist_font, fill='#A0A0A0')
+
+
+    live_indicator_x = card_width - 80
+    live_indicator_y = 20
+
+
+    draw.ellipse([live_indicator_x, live_indicator_y, live_indicator_x + 12, live_indicator_y + 12], fill='#FF0000')
+    draw.text((live_indicator_x + 20, live_indicator_y - 3), "LIVE", font=artist_font, fill='#FF0000')
+
+    return card
+
+
+
+CARD_FORMATS = {
+    "jpeg": ("JPEG", "jpg"),
+    "webp": ("WEBP", "webp"),
+    "png": ("PNG", "png"),
+}
+
+# Telegram всё равно пережимает фото в JPEG: он кодируется за ~1-2 мс
+# против 10-60 мс у PNG и весит вдвое меньше. WebP ещё меньше, но
+# уходит документом, а не фото.
+AUTO_CARD_FORMATS = {
+    "now": "jpeg",
+    "playnow": "jpeg",
+}
+
+
+@dataclass(frozen=True)
+class CardEncoding:
+    format: str = "jpeg"
+    quality: int = 90
+    compress_level: int = 6
+
+    @property
+    def extension(self) -> str:
+        return CARD_FORMATS[self.format][1]
+
+    def save(self, image) -> bytes:
+        buffer = BytesIO()
+        pil_format = CARD_FORMATS[self.format][0]
+        if self.format == "png":
+            image.save(buffer, pil_format, compress_level=self.compress_level)
+        elif self.format == "webp":
+            image.save(buffer, pil_format, quality=self.quality, method=0)
+        else:
+            image.save(buffer, pil_format, quality=self.quality, optimize=True)
+        return buffer.getvalue()
+
+
+def encode_card(render, track_info, album_art, encoding: CardEncoding = CardEncoding()):
+    """Рендер и кодирование карточки целиком — то, что уходит в пул"""
+    return encoding.save(render(track_info, album_art))
+
+
+_worker_art = OrderedDict()
+
+
+def _encode_card_in_process(render, track_info, art_url, art_data, encoding):
+    """Точка входа для процессного пула: обложка приходит байтами и кэшируется в воркере"""
+    album_art = _worker_art.get(art_url)
+    if album_art is None:
+        album_art = _worker_art[art_url] = AlbumArt(art_url, art_data)
+        while len(_worker_art) > 8:
+            _worker_art.popitem(last=False)
+    return encode_card(render, track_info, album_art, encoding)
+
+
+def benchmark_card_encodings(track_info, album_art, quality, compress_level, rounds=5):
+    """Замеряет время кодирования и размер карточек каждого типа во всех форматах"""
+    results = []
+    for card_type, render in (("now", render_song_card), ("playnow", render_song_card_no_time)):
+        image = render(track_info, album_art)
+        for card_format in CARD_FORMATS:
+            encoding = CardEncoding(card_format, quality, compress_level)
+            started = time.perf_counter()
+            for _ in range(rounds):
+                data = encoding.save(image)
+            elapsed_ms = (time.perf_counter() - started) * 1000 / rounds
+            results.append((card_type, card_format, elapsed_ms, len(data) / 1024))
+    return results
+
+
+class RenderPool:
+    """Выносит рендер карточек из event loop в пул потоков или процессов с ограниченной очередью"""
+
+    def __init__(self, get_mode: Callable[[], str], get_workers: Callable[[], int], queue_size: int = 4):
+        self._get_mode = get_mode
+        self._get_workers = get_workers
+        self._slots = asyncio.Semaphore(queue_size)
+        self._executor = None
+        self._executor_key = None
+        self._process_unavailable = False
+
+    def _get_executor(self):
+        mode = "thread" if self._process_unavailable else self._get_mode()
+        key = (mode, self._get_workers())
+        if self._executor is None or key != self._executor_key:
+            self.shutdown()
+            mode, workers = key
+            executor_cls = ProcessPoolExecutor if mode == "process" else ThreadPoolExecutor
+            self._executor = executor_cls(max_workers=workers)
+            self._executor_key = key
+        return self._executor
+
+    async def render(self, render, track_info, album_art: AlbumArt, encoding: CardEncoding) -> bytes:
+        """Рендерит и кодирует карточку; при заполненной очереди ждёт освобождения места"""
+        async with self._slots:
+            executor = self._get_executor()
+            loop = asyncio.get_running_loop()
+            if isinstance(executor, ProcessPoolExecutor):
+                try:
+                    return await loop.run_in_executor(
+                        executor, _encode_card_in_process, render, track_info, album_art.url, album_art.data, encoding
+                    )
+                except (pickle.PicklingError, AttributeError, BrokenProcessPool) as e:
+                    # модуль загружен не через обычный import — процессам его не передать
+                    logger.warning(f"Process render unavailable, switching to threads: {e}")
+                    self._process_unavailable = True
+                    executor = self._get_executor()
+
+            return await loop.run_in_executor(executor, encode_card, render, track_info, album_art, encoding)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+@dataclass
+class PrefetchedTrack:
+    card: Optional[BytesIO]
+    lyrics: Optional[LyricsTimeline]
+
+    @property
+    def size(self) -> int:
+        size = len(self.card.getbuffer()) if self.card else 0
+        if self.lyrics:
+            size += len(self.lyrics.times) * 4 + sum(len(text.encode()) for text in self.lyrics.texts)
+        return size
+
+
+class TrackPrefetcher:
+    """Заранее готовит карточку и текст следующих треков из очереди Spotify"""
+
+    def __init__(self, get_depth: Callable[[], int], get_budget: Callable[[], int]):
+        self._get_depth = get_depth
+        self._get_budget = get_budget
+        self._items: "OrderedDict[str, PrefetchedTrack]" = OrderedDict()
+        self._task: Optional[asyncio.Task] = None
+
+    def pop(self, track_id: str) -> Optional[PrefetchedTrack]:
+        return self._items.pop(track_id, None)
+
+    def schedule(self, load_queue, prepare):
+        """Запускает фоновую подготовку, если она ещё не идёт"""
+        if self._get_depth() <= 0 or (self._task and not self._task.done()):
+            return
+        self._task = asyncio.ensure_future(self._run(load_queue, prepare))
+
+    async def _run(self, load_queue, prepare):
+        try:
+            upcoming = (await load_queue())[:self._get_depth()]
+            wanted = {track.id for track in upcoming}
+            for track_id in list(self._items):
+                if track_id not in wanted:
+                    del self._items[track_id]
+
+            for track in upcoming:
+                if track.id in self._items:
+                    continue
+                card, lyrics = await prepare(track)
+                self._store(track.id, PrefetchedTrack(card, lyrics))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.debug(f"Prefetch failed: {e}")
+
+    def _store(self, track_id: str, item: PrefetchedTrack):
+        budget = self._get_budget()
+        if item.size > budget:
+            return
+        self._items[track_id] = item
+        total = sum(entry.size for entry in self._items.values())
+        while total > budget:
+            _, evicted = self._items.popitem(last=False)
+            total -= evicted.size
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        self._items.clear()
+
+
+class CachePrewarmer:
+    """Прогревает кэши текстов и обложек по недавно прослушанным и сохранённым трекам, пока бот простаивает"""
+
+    def __init__(
+        self,
+        load_tracks: Callable[[], Awaitable[List[SpotifyTrack]]],
+        warm_track: Callable[[SpotifyTrack], Awaitable[int]],
+        is_enabled: Callable[[], bool],
+        is_idle: Callable[[], bool],
+        get_budget: Callable[[], int],
+        get_delay: Callable[[], float],
+        load_usage: Callable[[], dict],
+        save_usage: Callable[[dict], None],
+        check_interval: float = 60,
+        max_interval: float = 6 * 3600,
+        list_ttl: float = 3600,
+    ):
+        self._load_tracks = load_tracks
+        self._warm_track = warm_track
+        self._is_enabled = is_enabled
+        self._is_idle = is_idle
+        self._get_budget = get_budget
+        self._get_delay = get_delay
+        self._load_usage = load_usage
+        self._save_usage = save_usage
+        self._check_interval = check_interval
+        self._max_interval = max_interval
+        self._list_ttl = list_ttl
+        self._task: Optional[asyncio.Task] = None
+        self.paused = False
+        self.tracks: List[SpotifyTrack] = []
+        self.listed_at = 0.0
+        self.warmed = 0
+
+    @property
+    def used_today(self) -> int:
+        usage = self._load_usage() or {}
+        return usage.get('used', 0) if usage.get('day') == time.strftime('%Y-%m-%d') else 0
+
+    def _spend(self, requests: int):
+        if requests:
+            self._save_usage({'day': time.strftime('%Y-%m-%d'), 'used': self.used_today + requests})
+
+    def _can_work(self) -> bool:
+        return (
+            self._is_enabled()
+            and not self.paused
+            and self._is_idle()
+            and self.used_today < self._get_budget()
+        )
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        interval = self._check_interval
+        while True:
+            await asyncio.sleep(interval)
+            if not self._can_work():
+                continue
+            spent = 0
+            try:
+                # выборка стоит два запроса — повторяем её не чаще list_ttl
+                if not self.listed_at or time.monotonic() - self.listed_at >= self._list_ttl:
+                    self._spend(2)
+                    self.tracks = await self._load_tracks()
+                    self.listed_at = time.monotonic()
+                for track in self.tracks:
+                    if not self._can_work():
+                        break
+                    requests = await self._warm_track(track)
+                    if requests:
+                        self._spend(requests)
+                        spent += requests
+                        self.warmed += 1
+                        # низкий приоритет: одна дорожка за раз и пауза между ними
+                        await asyncio.sleep(self._get_delay())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.debug(f"Cache prewarm failed: {e}")
+            # всё уже прогрето — проверяем всё реже, пока не появится работа
+            interval = self._check_interval if spent else min(interval * 2, self._max_interval)
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+class LiveSessions:
+    """Реестр live-сеансов (rlyrics, playnow) по чатам и сообщениям"""
+
+    def __init__(self, get_limit: Callable[[], int]):
+        self._get_limit = get_limit
+        self._sessions: "OrderedDict[Tuple[str, int, int], dict]" = OrderedDict()
+        self._reserved = {}
+
+    def _active(self) -> List[Tuple[Tuple[str, int, int], dict]]:
+        return [(key, data) for key, data in self._sessions.items() if data['active']]
+
+    def __len__(self) -> int:
+        return len(self._active())
+
+    def find(self, kind: str, chat_id: Optional[int] = None) -> List[dict]:
+        return [
+            data
+            for (session_kind, session_chat, _), data in self._active()
+            if session_kind == kind and (chat_id is None or session_chat == chat_id)
+        ]
+
+    def reserve(self, kind: str, chat_id: int) -> Optional[object]:
+        """Занимает место под сеанс ещё до первого await; None — лимит исчерпан.
+        Сеанс того же типа в этом чате будет заменён, поэтому отдельного места не требует"""
+        occupied = {(session_kind, session_chat) for (session_kind, session_chat, _), _ in self._active()}
+        occupied.update(self._reserved.values())
+        if (kind, chat_id) not in occupied and len(occupied) >= self._get_limit():
+            return None
+        reservation = object()
+        self._reserved[reservation] = (kind, chat_id)
+        return reservation
+
+    def release(self, reservation: Optional[object]):
+        self._reserved.pop(reservation, None)
+
+    def start(
+        self,
+        kind: str,
+        data: dict,
+        loop: Callable[[dict], Awaitable[None]],
+        reservation: Optional[object] = None,
+    ) -> dict:
+        """Запускает сеанс, останавливая прежний сеанс того же типа в этом чате"""
+        self.release(reservation)
+        self.stop(kind, data['chat_id'])
+        key = (kind, data['chat_id'], data['message_id'])
+        data['active'] = True
+        self._sessions[key] = data
+        data['task'] = asyncio.ensure_future(self._run(key, data, loop))
+        return data
+
+    async def _run(self, key, data: dict, loop: Callable[[dict], Awaitable[None]]):
+        try:
+            await loop(data)
+        finally:
+            data['active'] = False
+            if self._sessions.get(key) is data:
+                del self._sessions[key]
+
+    def stop(self, kind: str, chat_id: Optional[int] = None) -> int:
+        """Мягко завершает сеансы: цикл сам допишет финальное сообщение"""
+        sessions = self.find(kind, chat_id)
+        for data in sessions:
+            data['active'] = False
+            subscription = data.get('subscription')
+            if subscription:
+                subscription.interrupt()
+        return len(sessions)
+
+    def stop_all(self):
+        for data in self._sessions.values():
+            data['active'] = False
+            data['task'].cancel()
+        self._sessions.clear()
+
+
+@dataclass
+class EditCoalescerStats:
+    sent: int = 0
+    merged: int = 0
+    skipped: int = 0
+    flood_waits: int = 0
+    failed: int = 0
+
+
+class _PendingEdit:
+    __slots__ = ("text", "file", "digest", "worker", "failures", "error")
+
+    def __init__(self):
+        self.text: Optional[str] = None
+        self.file: Optional[BytesIO] = None
+        self.digest: Optional[bytes] = None
+        self.worker: Optional[asyncio.Task] = None
+        self.failures = 0
+        self.error: Optional[Exception] = None
+
+
+class EditCoalescer:
+    """Правки сообщений с живым содержимым: только последняя версия, не чаще интервала на чат, FloodWait откладывает правку"""
+
+    def __init__(
+        self,
+        edit: Callable[[int, int, str, Optional[BytesIO]], Awaitable[Any]],
+        get_interval: Callable[[], float],
+        max_failures: int = 3,
+    ):
+        self._edit = edit
+        self._get_interval = get_interval
+        self._max_failures = max_failures
+        self._messages: "dict[Tuple[int, int], _PendingEdit]" = {}
+        self._chat_locks: "dict[int, asyncio.Lock]" = {}
+        self._chat_ready: "dict[int, float]" = {}
+        self.stats = EditCoalescerStats()
+
+    @staticmethod
+    def _digest(text: str, file: Optional[BytesIO]) -> bytes:
+        digest = hashlib.blake2b(text.encode(), digest_size=16)
+        if file is not None:
+            digest.update(file.getbuffer())
+        return digest.digest()
+
+    def submit(self, chat_id: int, message_id: int, text: str, file: Optional[BytesIO] = None):
+        """Ставит новый текст (и медиа) сообщения; неотправленная прежняя версия заменяется целиком"""
+        state = self._messages.setdefault((chat_id, message_id), _PendingEdit())
+        if state.error is not None:
+            return
+        if state.text is not None:
+            self.stats.merged += 1
+        state.text = text
+        state.file = file
+        if state.worker is None or state.worker.done():
+            state.worker = asyncio.ensure_future(self._run(chat_id, message_id, state))
+
+    async def flush(self, chat_id: int, message_id: int) -> Optional[Exception]:
+        """Дожидается отправки последней версии; возвращает ошибку, если сообщение больше не правится"""
+        state = self._messages.get((chat_id, message_id))
+        if state is None:
+            return None
+        if state.worker is not None:
+            await asyncio.shield(state.worker)
+        return state.error
+
+    async def edit(self, chat_id: int, message_id: int, text: str, file: Optional[BytesIO] = None) -> Optional[Exception]:
+        self.submit(chat_id, message_id, text, file)
+        return await self.flush(chat_id, message_id)
+
+    def failed(self, chat_id: int, message_id: int) -> Optional[Exception]:
+        state = self._messages.get((chat_id, message_id))
+        return state.error if state else None
+
+    def forget(self, chat_id: int, message_id: int):
+        """Отбрасывает неотправленные правки сообщения (например, удалённого)"""
+        state = self._messages.pop((chat_id, message_id), None)
+        if state and state.worker is not None:
+            state.worker.cancel()
+
+    async def _run(self, chat_id: int, message_id: int, state: _PendingEdit):
+        lock = self._chat_locks.setdefault(chat_id, asyncio.Lock())
+        while state.text is not None:
+            async with lock:
+                delay = self._chat_ready.get(chat_id, 0) - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+                text, state.text = state.text, None
+                file, state.file = state.file, None
+                digest = self._digest(text, file)
+                if digest == state.digest:
+                    self.stats.skipped += 1
+                    continue
+
+                self._chat_ready[chat_id] = time.monotonic() + self._get_interval()
+                try:
+                    if file is not None:
+                        file.seek(0)
+                    await self._edit(chat_id, message_id, text, file)
+                except FloodWaitError as e:
+                    self.stats.flood_waits += 1
+                    self._chat_ready[chat_id] = time.monotonic() + e.seconds
+                    if state.text is None:
+                        state.text, state.file = text, file
+                    continue
+                except MessageNotModifiedError:
+                    pass
+                except Exception as e:
+                    state.failures += 1
+                    if state.failures >= self._max_failures:
+                        self.stats.failed += 1
+                        state.error = e
+                        state.text = None
+                        return
+                    logger.debug(f"Edit failed, will retry: {e}")
+                    if state.text is None:
+                        state.text, state.file = text, file
+                    continue
+
+                state.digest = digest
+                state.failures = 0
+                self.stats.sent += 1
+
+    def close(self):
+        for state in self._messages.values():
+            if state.worker is not None:
+                state.worker.cancel()
+        self._messages.clear()
+
+
 @loader.tds
 class Spots(loader.Module):
     """Слушай музыку в Spotify"""
@@ -93,8 +2168,41 @@ class Spots(loader.Module):
             "<a href=\"{track_url}\">{artist} — {title}</a> не найден!</b>\n\n"
             "<i>Попробуйте команду <code>{prefix}lyrics</code> для поиска обычного текста.</i>"
         ),
+        "lyrics_cache_stats": (
+            "<emoji document_id=5956561916573782596>📜</emoji> <b>Кэш текстов</b>\n\n"
+            "<b>Записей:</b> <code>{entries}</code> (из них промахов: <code>{negative}</code>)\n"
+            "<b>Размер:</b> <code>{size:.1f} KB</code>\n"
+            "<b>Попадания / промахи:</b> <code>{hits} / {misses}</code> (<code>{ratio:.0f}%</code>)\n\n"
+            "<b>Источники:</b>\n{providers}\n\n"
+            "<b>Локальная библиотека .lrc:</b> <code>{local}</code> треков\n\n"
+            "<i>Очистить: <code>{prefix}lyricscache purge</code></i>"
+        ),
+        "card_bench": (
+            "<emoji document_id=5334768819548200731>💻</emoji> <b>Кодирование карточек</b> "
+            "(<code>{artist} — {title}</code>)\n\n{results}\n\n"
+            "<i>Сейчас используется: now — <code>{now}</code>, playnow — <code>{playnow}</code></i>"
+        ),
+        "lyrics_cache_purged": "✅ <b>Кэш текстов очищен</b>",
+        "prewarm_status": (
+            "<emoji document_id=5334768819548200731>💻</emoji> <b>Прогрев кэшей</b>: {state}\n\n"
+            "<b>Треков в выборке:</b> <code>{tracks}</code> (прогрето за сеанс: <code>{warmed}</code>)\n"
+            "<b>Тексты в кэше:</b> <code>{lyrics}/{tracks}</code> (<code>{lyrics_ratio:.0f}%</code>)\n"
+            "<b>Обложки в кэше:</b> <code>{art}/{tracks}</code> (<code>{art_ratio:.0f}%</code>)\n"
+            "<b>Запросов сегодня:</b> <code>{used}/{budget}</code>\n\n"
+            "<i><code>{prefix}prewarm pause</code> / <code>{prefix}prewarm resume</code></i>"
+        ),
         "realtime_stopped": "✅ <b>Обновление текста в реальном времени остановлено</b>",
         "no_realtime_active": "❌ <b>Сеанс синхронизации не активен</b>",
+        "playnow_stopped": "✅ <b>Live-отображение трека остановлено</b>",
+        "now_live_stopped": "✅ <b>Обновление live-карточки остановлено</b>",
+        "no_now_live_active": "❌ <b>Live-карточка не запущена</b>",
+        "no_playnow_active": "❌ <b>Сеанс live-отображения не активен</b>",
+        "live_sessions_stopped": "✅ <b>Остановлено сеансов:</b> <code>{}</code>",
+        "live_sessions_limit": (
+            "<emoji document_id=5854929766146118183>❌</emoji> <b>Уже запущено максимум live-сеансов "
+            "(<code>{limit}</code>)</b>\n\n"
+            "<i>Останови лишние через <code>{prefix}stoplyrics all</code> или <code>{prefix}stopplaynow all</code>.</i>"
+        ),
     }
 
     def __init__(self):
@@ -112,39 +2220,246 @@ class Spots(loader.Module):
                 validator=loader.validators.Hidden(loader.validators.String()),
             ),
             loader.ConfigValue(
-                "auth_token",
-                None,
-                lambda: "Токен для авторизации",
-                validator=loader.validators.Hidden(loader.validators.String()),
+                "auth_token",
+                None,
+                lambda: "Токен для авторизации",
+                validator=loader.validators.Hidden(loader.validators.String()),
+            ),
+            loader.ConfigValue(
+                "refresh_token",
+                None,
+                lambda: "Токен для обновления",
+                validator=loader.validators.Hidden(loader.validators.String()),
+            ),
+            loader.ConfigValue(
+                "scopes",
+                "user-read-playback-state user-read-currently-playing user-read-recently-played user-library-read",
+                lambda: "Список разрешений",
+            ),
+            loader.ConfigValue(
+                "genius_token",
+                None,
+                lambda: "Токен Genius API для получения текстов (получить: https://genius.com/api-clients)",
+                validator=loader.validators.Hidden(loader.validators.String()),
+            ),
+            loader.ConfigValue(
+                "lrc_directory",
+                None,
+                lambda: "Папка с локальными .lrc файлами — они проверяются раньше любых онлайн-источников",
+                validator=loader.validators.String(),
+            ),
+            loader.ConfigValue(
+                "lyrics_timeout",
+                8,
+                lambda: "Сколько секунд ждать ответа от каждого источника текстов",
+                validator=loader.validators.Integer(minimum=1),
+            ),
+            loader.ConfigValue(
+                "lyrics_cache_ttl",
+                30,
+                lambda: "Сколько дней хранить найденные тексты в кэше",
+                validator=loader.validators.Integer(minimum=1),
+            ),
+            loader.ConfigValue(
+                "lyrics_cache_negative_ttl",
+                6,
+                lambda: "Сколько часов помнить, что текст для трека не найден",
+                validator=loader.validators.Integer(minimum=0),
+            ),
+            loader.ConfigValue(
+                "lyrics_cache_size",
+                20,
+                lambda: "Максимальный размер кэша текстов в МБ",
+                validator=loader.validators.Integer(minimum=1),
+            ),
+            loader.ConfigValue(
+                "art_cache_memory",
+                32,
+                lambda: "Сколько МБ памяти держать под обложки и их миниатюры",
+                validator=loader.validators.Integer(minimum=1),
+            ),
+            loader.ConfigValue(
+                "art_cache_disk",
+                100,
+                lambda: "Сколько МБ на диске держать под скачанные обложки",
+                validator=loader.validators.Integer(minimum=1),
+            ),
+            loader.ConfigValue(
+                "audio_cache_disk",
+                300,
+                lambda: "Сколько МБ на диске держать под скачанные треки для spnow (0 — только последний трек)",
+                validator=loader.validators.Integer(minimum=0),
+            ),
+            loader.ConfigValue(
+                "render_executor",
+                "thread",
+                lambda: "Где рисовать карточки: thread — пул потоков, process — пул процессов",
+                validator=loader.validators.Choice(["thread", "process"]),
+            ),
+            loader.ConfigValue(
+                "render_workers",
+                2,
+                lambda: "Сколько воркеров рисуют карточки одновременно",
+                validator=loader.validators.Integer(minimum=1, maximum=8),
+            ),
+            loader.ConfigValue(
+                "card_format",
+                "auto",
+                lambda: "Формат карточек: auto — выбирать по типу карточки, jpeg, webp (уходит документом) или png",
+                validator=loader.validators.Choice(["auto", "jpeg", "webp", "png"]),
+            ),
+            loader.ConfigValue(
+                "card_quality",
+                90,
+                lambda: "Качество JPEG/WebP карточек (1-100)",
+                validator=loader.validators.Integer(minimum=1, maximum=100),
+            ),
+            loader.ConfigValue(
+                "png_compress_level",
+                6,
+                lambda: "Уровень сжатия PNG карточек (0 — быстрее, 9 — меньше)",
+                validator=loader.validators.Integer(minimum=0, maximum=9),
+            ),
+            loader.ConfigValue(
+                "prefetch_depth",
+                1,
+                lambda: "Сколько следующих треков из очереди заранее готовить для playnow (0 — выключить)",
+                validator=loader.validators.Integer(minimum=0, maximum=5),
+            ),
+            loader.ConfigValue(
+                "prefetch_memory",
+                8,
+                lambda: "Сколько МБ памяти можно занять заранее подготовленными треками",
+                validator=loader.validators.Integer(minimum=1),
+            ),
+            loader.ConfigValue(
+                "resync_interval",
+                10,
+                lambda: "Как часто (в секундах) сверять позицию трека со Spotify в live-режимах",
+                validator=loader.validators.Integer(minimum=1),
+            ),
+            loader.ConfigValue(
+                "prewarm",
+                False,
+                lambda: "Прогревать кэши текстов и обложек по недавно прослушанным и сохранённым трекам в фоне",
+                validator=loader.validators.Boolean(),
+            ),
+            loader.ConfigValue(
+                "prewarm_daily_budget",
+                300,
+                lambda: "Сколько сетевых запросов в сутки можно потратить на прогрев",
+                validator=loader.validators.Integer(minimum=0),
+            ),
+            loader.ConfigValue(
+                "prewarm_delay",
+                5,
+                lambda: "Пауза (в секундах) между прогревом соседних треков",
+                validator=loader.validators.Integer(minimum=1),
             ),
             loader.ConfigValue(
-                "refresh_token",
-                None,
-                lambda: "Токен для обновления",
-                validator=loader.validators.Hidden(loader.validators.String()),
+                "edit_interval",
+                1.0,
+                lambda: "Минимальный интервал (в секундах) между правками live-сообщений в одном чате",
+                validator=loader.validators.Float(minimum=0.3, maximum=10.0),
             ),
             loader.ConfigValue(
-                "scopes",
-                "user-read-playback-state user-library-read",
-                lambda: "Список разрешений",
+                "now_live_interval",
+                5,
+                lambda: "Как часто (в секундах) обновлять прогресс на карточке .now live",
+                validator=loader.validators.Integer(minimum=3, maximum=60),
             ),
             loader.ConfigValue(
-                "genius_token",
-                None,
-                lambda: "Токен Genius API для получения текстов (получить: https://genius.com/api-clients)",
-                validator=loader.validators.Hidden(loader.validators.String()),
+                "max_live_sessions",
+                5,
+                lambda: "Сколько live-сеансов (rlyrics, playnow, now live) может работать одновременно во всех чатах",
+                validator=loader.validators.Integer(minimum=1, maximum=50),
             ),
         )
 
     async def client_ready(self, client, db):
         self.db = db
         self._client = client
+        self.spotify = SpotifyClient(
+            lambda: self.tokens.get(),
+            lambda stale_token: self.tokens.refresh(stale_token),
+        )
+        self.tokens = SpotifyTokens(
+            self.spotify,
+            self.config,
+            lambda: self.get("token_expires_at", 0),
+            lambda expires_at: self.set("token_expires_at", expires_at),
+        )
+        self.playback = PlaybackPoller(self.spotify, lambda: self.config['resync_interval'])
+        self.lyrics_cache = LyricsCache(os.path.join(utils.get_base_dir(), "spots_cache", "lyrics.db"))
+        self.lrc_library = LrcLibrary(os.path.join(utils.get_base_dir(), "spots_cache", "lrc_index.db"))
+        self.album_art = AlbumArtCache(
+            os.path.join(utils.get_base_dir(), "spots_cache", "art"),
+            lambda: self.config['art_cache_memory'] * 1024 * 1024,
+            lambda: self.config['art_cache_disk'] * 1024 * 1024,
+        )
+        self.audio_cache = AudioCache(
+            os.path.join(utils.get_base_dir(), "spots_cache", "audio"),
+            lambda: self.config['audio_cache_disk'] * 1024 * 1024,
+            lambda: self.get("audio_documents", {}),
+            lambda documents: self.set("audio_documents", documents),
+        )
+
+        self.render_pool = RenderPool(
+            lambda: self.config['render_executor'],
+            lambda: self.config['render_workers'],
+        )
+
+        self.prefetcher = TrackPrefetcher(
+            lambda: self.config['prefetch_depth'],
+            lambda: self.config['prefetch_memory'] * 1024 * 1024,
+        )
+
+        self.live_sessions = LiveSessions(lambda: self.config['max_live_sessions'])
+        self.prewarmer = CachePrewarmer(
+            self._load_prewarm_tracks,
+            self._prewarm_track,
+            lambda: self.config['prewarm'] and bool(self.config['auth_token']),
+            lambda: not len(self.live_sessions),
+            lambda: self.config['prewarm_daily_budget'],
+            lambda: self.config['prewarm_delay'],
+            lambda: self.get("prewarm_usage", {}),
+            lambda usage: self.set("prewarm_usage", usage),
+        )
+        self.prewarmer.start()
+        self.editor = EditCoalescer(
+            lambda chat_id, message_id, text, file: self._client.edit_message(
+                chat_id, message_id, text, parse_mode='html', file=file
+            ),
+            lambda: self.config['edit_interval'],
+        )
+
+        self.lyrics_providers = LyricsProviders(lambda: self.config['lyrics_timeout'])
+        self.lyrics_providers.register("LRCLib", self._get_lyrics_from_lrclib, synced=True)
+        self.lyrics_providers.register(
+            "Genius",
+            self._get_lyrics_from_genius,
+            enabled=lambda: bool(self.config['genius_token']),
+        )
+        self.lyrics_providers.register("lyrics.ovh", self._get_lyrics_from_api)
 
         self.musicdl = await self.import_lib(
             "https://famods.fajox.one/assets/musicdl.py",
             suspend_on_error=True,
         )
 
+    async def on_unload(self):
+        self.live_sessions.stop_all()
+        self.prewarmer.stop()
+        self.editor.close()
+        self.tokens.stop()
+        self.playback.stop()
+        self.prefetcher.stop()
+        self.render_pool.shutdown()
+        self.lyrics_cache.close()
+        self.lrc_library.close()
+        await self.album_art.close()
+        await self.spotify.close()
+
     async def _get_lyrics_from_lrclib(self, artist, title, duration_ms=None):
         """Получает синхронизированный текст песни через LRCLib API"""
         try:
@@ -166,6 +2481,7 @@ class Spots(loader.Module):
             
             async with aiohttp.ClientSession() as session:
                 async with session.get(url, params=params) as response:
+                    raise_for_transient_status(response)
                     if response.status == 200:
                         data = await response.json()
                         if data and len(data) > 0:
@@ -194,9 +2510,9 @@ class Spots(loader.Module):
                     
         except Exception as e:
             logger.error(f"Error getting lyrics from LRCLib: {e}")
-            return None
+            raise
 
-    async def _get_lyrics_from_genius(self, artist, title):
+    async def _get_lyrics_from_genius(self, artist, title, duration_ms=None):
         """Получает текст песни через Genius API"""
         if not self.config['genius_token']:
             return None
@@ -213,6 +2529,7 @@ class Spots(loader.Module):
             
             async with aiohttp.ClientSession() as session:
                 async with session.get(search_url, headers=headers, params=params) as response:
+                    raise_for_transient_status(response)
                     if response.status != 200:
                         return None
                     
@@ -241,63 +2558,36 @@ class Spots(loader.Module):
                         return None
                     
                     
-                    return await self._scrape_genius_lyrics(song_url)
+                    lyrics = await self._scrape_genius_lyrics(song_url)
+                    return {'type': 'plain', 'lyrics': lyrics} if lyrics else None
                     
         except Exception as e:
             logger.error(f"Error getting lyrics from Genius: {e}")
-            return None
+            raise
 
     async def _scrape_genius_lyrics(self, url):
         """Парсит текст с веб-страницы Genius"""
         try:
             async with aiohttp.ClientSession() as session:
                 async with session.get(url) as response:
+                    raise_for_transient_status(response)
                     if response.status != 200:
                         return None
                     
-                    html = await response.text()
-                    
-                    
-                    import re
-                    
-                    
-                    lyrics_pattern = r'<div[^>]*data-lyrics-container="true"[^>]*>(.*?)</div>'
-                    matches = re.findall(lyrics_pattern, html, re.DOTALL | re.IGNORECASE)
-                    
-                    if not matches:
-                        
-                        lyrics_pattern = r'<div[^>]*class="[^"]*lyrics[^"]*"[^>]*>(.*?)</div>'
-                        matches = re.findall(lyrics_pattern, html, re.DOTALL | re.IGNORECASE)
-                    
-                    if matches:
-                        
-                        lyrics = matches[0]
-                        lyrics = re.sub(r'<br[^>]*>', '\n', lyrics)
-                        lyrics = re.sub(r'<[^>]+>', '', lyrics)
-                        lyrics = lyrics.strip()
-                        
-                        
-                        lyrics = lyrics.replace('&amp;', '&')
-                        lyrics = lyrics.replace('&lt;', '<')
-                        lyrics = lyrics.replace('&gt;', '>')
-                        lyrics = lyrics.replace('&quot;', '"')
-                        lyrics = lyrics.replace('&#x27;', "'")
-                        
-                        return lyrics if lyrics else None
-                    
-                    return None
+                    return await scrape_genius_lyrics(response)
                     
         except Exception as e:
             logger.error(f"Error scraping Genius lyrics: {e}")
-            return None
+            raise
 
-    async def _get_lyrics_from_api(self, artist, title):
+    async def _get_lyrics_from_api(self, artist, title, duration_ms=None):
         """Получает текст песни через бесплатный API lyrics.ovh"""
         try:
             url = f"https://api.lyrics.ovh/v1/{artist}/{title}"
             
             async with aiohttp.ClientSession() as session:
                 async with session.get(url) as response:
+                    raise_for_transient_status(response)
                     if response.status == 200:
                         data = await response.json()
                         lyrics = data.get('lyrics')
@@ -310,150 +2600,107 @@ class Spots(loader.Module):
                     
         except Exception as e:
             logger.error(f"Error getting lyrics from lyrics.ovh: {e}")
-            return None
+            raise
 
     def _format_synced_lyrics(self, synced_lyrics, current_progress_ms=None):
         """Форматирует синхронизированные тексты для отображения"""
-        if not synced_lyrics:
+        timeline = LyricsTimeline.parse(synced_lyrics)
+        if not timeline:
             return None
             
-        lines = synced_lyrics.strip().split('\n')
-        formatted_lines = []
-        current_line_found = False
+        current_index = timeline.index_at(current_progress_ms) if current_progress_ms else -1
+        current = (timeline.times[current_index], timeline.texts[current_index]) if current_index >= 0 else None
         
-        for line in lines:
-            
-            time_match = re.match(r'\[(\d{2}):(\d{2})\.(\d{2})\](.*)', line)
-            if time_match:
-                minutes = int(time_match.group(1))
-                seconds = int(time_match.group(2))
-                centiseconds = int(time_match.group(3))
-                text = time_match.group(4).strip()
-                
-                
-                line_time_ms = (minutes * 60 + seconds) * 1000 + centiseconds * 10
-                
-                
-                if current_progress_ms and not current_line_found:
-                    if line_time_ms <= current_progress_ms:
-                        
-                        next_line_time = None
-                        line_index = lines.index(line)
-                        if line_index + 1 < len(lines):
-                            next_match = re.match(r'\[(\d{2}):(\d{2})\.(\d{2})\]', lines[line_index + 1])
-                            if next_match:
-                                next_minutes = int(next_match.group(1))
-                                next_seconds = int(next_match.group(2))
-                                next_centiseconds = int(next_match.group(3))
-                                next_line_time = (next_minutes * 60 + next_seconds) * 1000 + next_centiseconds * 10
-                        
-                        if next_line_time is None or current_progress_ms < next_line_time:
-                            
-                            formatted_lines.append(f"<b>→ {text}</b>")
-                            current_line_found = True
-                        else:
-                            formatted_lines.append(text)
-                    else:
-                        formatted_lines.append(text)
-                else:
+        
+        formatted_lines = []
+        for line in synced_lyrics.strip().splitlines():
+            stamps, text = LyricsTimeline.split_line(line)
+            if not stamps:
+                if text:
                     formatted_lines.append(text)
+            elif current and text == current[1] and current[0] in stamps:
+                formatted_lines.append(f"<b>→ {text}</b>")
+                current = None
             else:
-                
-                if line.strip():
-                    formatted_lines.append(line.strip())
+                formatted_lines.append(text)
         
         return '\n'.join(formatted_lines)
 
-    async def _get_synced_lyrics_data(self, artist, title, duration_ms=None):
-        """Получает синхронизированные данные текста песни с временными метками"""
-        try:
-            
-            clean_title = re.sub(r'\([^)]*\)', '', title).strip()
-            clean_artist = re.sub(r'\([^)]*\)', '', artist).strip()
-            
-            
-            params = {
-                'artist_name': clean_artist,
-                'track_name': clean_title
-            }
-            
-            
-            if duration_ms:
-                params['duration'] = duration_ms // 1000
-            
-            url = "https://lrclib.net/api/search"
-            
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, params=params) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        if data and len(data) > 0:
-                            track_data = data[0]
-                            synced_lyrics = track_data.get('syncedLyrics')
-                            
-                            if synced_lyrics:
-                                
-                                return self._parse_synced_lyrics(synced_lyrics)
-                    
-                    return None
-                    
-        except Exception as e:
-            logger.error(f"Error getting synced lyrics from LRCLib: {e}")
-            return None
-
-    def _parse_synced_lyrics(self, synced_lyrics):
-        """Парсит синхронизированные тексты в список с временными метками"""
-        if not synced_lyrics:
-            return None
-            
-        lines = synced_lyrics.strip().split('\n')
-        parsed_lines = []
+    async def _find_lyrics(self, artist, title, duration_ms=None):
+        """Ищет текст через все источники (сначала синхронизированный), с кэшем"""
+        lyrics_data, _ = await self._lookup_lyrics(artist, title, duration_ms)
+        return lyrics_data
+
+    async def _lookup_lyrics(self, artist, title, duration_ms=None, low_priority=False):
+        """Текст и число опрошенных источников; low_priority — источники по одному, для прогрева"""
+        if self.lrc_library.root != self.config['lrc_directory']:
+            await self.lrc_library.refresh(self.config['lrc_directory'])
+        local = await self.lrc_library.find(artist, title)
+        if local and local['type'] == 'synced':
+            return local, 0
+
+        key = LyricsCache.make_key(artist, title, duration_ms)
+        found, lyrics_data = self.lyrics_cache.get(key)
+        if found:
+            # закэшированный промах не должен прятать локальный plain .lrc
+            return lyrics_data or local, 0
         
-        for line in lines:
-            
-            time_match = re.match(r'\[(\d{2}):(\d{2})\.(\d{2})\](.*)', line)
-            if time_match:
-                minutes = int(time_match.group(1))
-                seconds = int(time_match.group(2))
-                centiseconds = int(time_match.group(3))
-                text = time_match.group(4).strip()
-                
-                
-                time_ms = (minutes * 60 + seconds) * 1000 + centiseconds * 10
-                
-                if text:  
-                    parsed_lines.append({
-                        'time_ms': time_ms,
-                        'text': text,
-                        'timestamp': f"{minutes:02d}:{seconds:02d}.{centiseconds:02d}"
-                    })
+        find = self.lyrics_providers.find_sequential if low_priority else self.lyrics_providers.find
+        lookup = await find(artist, title, duration_ms)
+        lyrics_data = lookup.lyrics or local
+
+        # промах кэшируем, только если все источники честно ответили «нет»
+        if lyrics_data:
+            ttl = self.config['lyrics_cache_ttl'] * 86400
+        elif lookup.complete:
+            ttl = self.config['lyrics_cache_negative_ttl'] * 3600
+        else:
+            ttl = 0
+        if ttl:
+            self.lyrics_cache.put(key, lyrics_data, ttl, self.config['lyrics_cache_size'] * 1024 * 1024)
         
-        return parsed_lines
+        return lyrics_data, lookup.queried
+
+    async def _load_prewarm_tracks(self):
+        """Недавно прослушанные и сохранённые треки без повторов"""
+        recent, saved = await asyncio.gather(self.spotify.recently_played(), self.spotify.saved_tracks())
+        tracks = {}
+        for track in recent + saved:
+            if track.id and track.id not in tracks:
+                tracks[track.id] = track
+        return list(tracks.values())
+
+    def _lyrics_cached(self, track):
+        key = LyricsCache.make_key(track.artist_name, track.name, track.duration_ms)
+        return self.lyrics_cache.contains(key) or self.lrc_library.find_path(track.artist_name, track.name) is not None
+
+    async def _prewarm_track(self, track):
+        """Прогревает кэши для трека; возвращает, сколько сетевых запросов на это ушло"""
+        requests = 0
+        if track.album_art and await self.album_art.warm(track.album_art):
+            requests += 1
+        if not self._lyrics_cached(track):
+            _, queried = await self._lookup_lyrics(track.artist_name, track.name, track.duration_ms, low_priority=True)
+            requests += queried
+        return requests
+
+    async def _get_synced_lyrics_data(self, artist, title, duration_ms=None):
+        """Получает синхронизированные данные текста песни с временными метками"""
+        lyrics_data = await self._find_lyrics(artist, title, duration_ms)
+        if lyrics_data and lyrics_data['type'] == 'synced':
+            return LyricsTimeline.parse(lyrics_data['lyrics'])
+        return None
 
     def _get_current_lyric_line(self, lyrics_data, current_progress_ms):
         """Находит текущую строку текста на основе прогресса воспроизведения"""
         if not lyrics_data:
             return None, -1
             
-        current_line = None
-        current_index = -1
-        
-        for i, line in enumerate(lyrics_data):
-            if line['time_ms'] <= current_progress_ms:
-                
-                if i + 1 < len(lyrics_data):
-                    next_line = lyrics_data[i + 1]
-                    if current_progress_ms < next_line['time_ms']:
-                        current_line = line
-                        current_index = i
-                        break
-                else:
-                    
-                    current_line = line
-                    current_index = i
-                    break
+        current_index = lyrics_data.index_at(current_progress_ms)
+        if current_index == -1:
+            return None, -1
         
-        return current_line, current_index
+        return lyrics_data.texts[current_index], current_index
 
     def _format_realtime_lyrics(self, lyrics_data, current_index, context_lines=2):
         """Форматирует текст для отображения с выделением текущей строки"""
@@ -467,502 +2714,319 @@ class Spots(loader.Module):
         end_index = min(len(lyrics_data), current_index + context_lines + 1)
         
         for i in range(start_index, end_index):
-            line = lyrics_data[i]
+            text = lyrics_data.texts[i]
             if i == current_index:
                 
-                formatted_lines.append(f"<b>▶️ {line['text']}</b>")
+                formatted_lines.append(f"<b>▶️ {text}</b>")
             elif i < current_index:
                 
-                formatted_lines.append(f"<i>{line['text']}</i>")
-            else:
-                
-                formatted_lines.append(line['text'])
-        
-        return '\n'.join(formatted_lines)
-
-    async def _realtime_lyrics_loop(self):
-        """Цикл обновления текста в реальном времени"""
-        if not hasattr(self, '_realtime_lyrics_data') or not self._realtime_lyrics_data['active']:
-            return
-            
-        try:
-            data = self._realtime_lyrics_data
-            update_count = 0
-            max_updates = 600  
-            pause_count = 0  
-            max_pause_time = 120  
-            last_pause_message_count = -1  
-            
-            while data['active'] and update_count < max_updates:
-                try:
-                    
-                    sp = spotipy.Spotify(auth=self.config['auth_token'])
-                    current_playback = sp.current_playback()
-                    
-                    if not current_playback or not current_playback.get('item'):
-                        
-                        pause_count += 1
-                        if pause_count > 30:  
-                            break
-                        
-                        await asyncio.sleep(1)
-                        update_count += 1
-                        continue
-                    
-                    current_track_id = current_playback['item'].get('id', '')
-                    if current_track_id != data['track_id']:
-                        
-                        break
-                    
-                    progress_ms = current_playback.get('progress_ms', 0)
-                    is_playing = current_playback.get('is_playing', False)
-                    
-                    if not is_playing:
-                        
-                        pause_count += 1
-                        
-                        
-                        if pause_count >= max_pause_time:
-                            new_text = data['header'] + "⏸️ <i>Сеанс завершен из-за длительной паузы</i>"
-                            try:
-                                await self._client.edit_message(
-                                    data['chat_id'],
-                                    data['message_id'],
-                                    new_text,
-                                    parse_mode='html'
-                                )
-                            except:
-                                pass
-                            break
-                        
-                       
-                        if last_pause_message_count == -1 or pause_count - last_pause_message_count >= 10:
-                            new_text = data['header'] + "⏸️ <i>Воспроизведение приостановлено</i>"
-                            try:
-                                await self._client.edit_message(
-                                    data['chat_id'],
-                                    data['message_id'],
-                                    new_text,
-                                    parse_mode='html'
-                                )
-                                last_pause_message_count = pause_count
-                            except Exception as edit_error:
-                                logger.debug(f"Failed to edit pause message: {edit_error}")
-                        
-                        
-                        await asyncio.sleep(1)
-                        update_count += 1
-                        continue
-                        
-                    else:
-                        
-                        if pause_count > 0:
-                            pause_count = 0
-                            last_pause_message_count = -1
-                        
-                        
-                        current_line, current_index = self._get_current_lyric_line(data['lyrics_data'], progress_ms)
-                        
-                        
-                        if current_index != data['last_line_index']:
-                            formatted_lyrics = self._format_realtime_lyrics(data['lyrics_data'], current_index)
-                            new_text = data['header'] + formatted_lyrics
-                            data['last_line_index'] = current_index
-                            
-                            
-                            try:
-                                await self._client.edit_message(
-                                    data['chat_id'],
-                                    data['message_id'],
-                                    new_text,
-                                    parse_mode='html'
-                                )
-                            except Exception as edit_error:
-                                
-                                logger.debug(f"Failed to edit message: {edit_error}")
-                                break
-                    
-                    
-                    await asyncio.sleep(1)
-                    update_count += 1
-                    
-                except spotipy.exceptions.SpotifyException as e:
-                    
-                    logger.debug(f"Spotify API error: {e}")
-                    await asyncio.sleep(3)
-                    update_count += 1
-                    continue
-                except Exception as e:
-                    logger.error(f"Error in realtime lyrics loop: {e}")
-                    await asyncio.sleep(2)  
-                    update_count += 1
-            
-            
-            data['active'] = False
-            
-            
-            try:
-                final_text = data['header'] + "✅ <i>Сеанс синхронизации завершен</i>"
-                await self._client.edit_message(
-                    data['chat_id'],
-                    data['message_id'],
-                    final_text,
-                    parse_mode='html'
-                )
-            except:
-                pass
-                
-        except Exception as e:
-            logger.error(f"Critical error in realtime lyrics loop: {e}")
-            if hasattr(self, '_realtime_lyrics_data'):
-                self._realtime_lyrics_data['active'] = False
-
-    async def _create_song_card(self, track_info):
-        """Создаёт красивую карточку с песней с адаптивным цветом фона"""
-        try:
-            
-            card_width = 800
-            card_height = 300
-            
-            
-            album_art_url = track_info['album_art']
-            async with aiohttp.ClientSession() as session:
-                async with session.get(album_art_url) as response:
-                    art_data = await response.read()
-                    album_art_original = Image.open(BytesIO(art_data))
-            
-            def get_dominant_color(image):
-                """Получает доминирующий цвет изображения"""
-                
-                small_image = image.resize((50, 50))
-                stat = ImageStat.Stat(small_image)
-                # Получаем средние значения RGB
-                r, g, b = stat.mean
-                return int(r), int(g), int(b)
-            
-            def create_darker_variant(r, g, b, factor=0.4):
-                """Создает более темный вариант цвета"""
-                
-                h, s, v = colorsys.rgb_to_hsv(r/255, g/255, b/255)
-                
-                v = max(0.15, v * factor)
-                s = min(1.0, s * 1.1)
-                
-                r, g, b = colorsys.hsv_to_rgb(h, s, v)
-                return int(r * 255), int(g * 255), int(b * 255)
-            
-            
-            dominant_r, dominant_g, dominant_b = get_dominant_color(album_art_original)
-            
-            
-            bg_r, bg_g, bg_b = create_darker_variant(dominant_r, dominant_g, dominant_b)
-            
-            
-            card = Image.new('RGB', (card_width, card_height), color=(bg_r, bg_g, bg_b))
-            draw = ImageDraw.Draw(card)
-            
-            
-            center_x = 150  
-            center_y = card_height // 2
-            max_distance = max(card_width, card_height)
-            
-            for x in range(card_width):
-                for y in range(card_height):
-                    
-                    distance = ((x - center_x) ** 2 + (y - center_y) ** 2) ** 0.5
-                    
-                    factor = min(1.0, distance / max_distance)
-                    
-                    
-                    final_r = int(bg_r + (bg_r * 0.2 - bg_r) * factor)
-                    final_g = int(bg_g + (bg_g * 0.2 - bg_g) * factor)
-                    final_b = int(bg_b + (bg_b * 0.2 - bg_b) * factor)
-                    
-                    
-                    final_r = max(0, min(255, final_r))
-                    final_g = max(0, min(255, final_g))
-                    final_b = max(0, min(255, final_b))
-                    
-                    
-                    card.putpixel((x, y), (final_r, final_g, final_b))
-            
-            
-            album_size = 240
-            album_art = album_art_original.resize((album_size, album_size), Image.Resampling.LANCZOS)
-            
-            
-            mask = Image.new('L', (album_size, album_size), 0)
-            mask_draw = ImageDraw.Draw(mask)
-            mask_draw.rounded_rectangle([0, 0, album_size, album_size], radius=20, fill=255)
-            
-            
-            album_art.putalpha(mask)
-            
-            
-            art_x = 30
-            art_y = int((card_height - album_size) // 2)  
-            card.paste(album_art, (art_x, art_y), album_art)
-            
-            
-            try:
-                
-                title_font = ImageFont.truetype("/System/Library/Fonts/Helvetica-Bold.ttc", 42)
-                artist_font = ImageFont.truetype("/System/Library/Fonts/Helvetica.ttc", 28)
-                time_font = ImageFont.truetype("/System/Library/Fonts/Helvetica.ttc", 20)
-            except:
-                try:
-                    title_font = ImageFont.truetype("arial.ttf", 42)
-                    artist_font = ImageFont.truetype("arial.ttf", 28)
-                    time_font = ImageFont.truetype("arial.ttf", 20)
-                except:
-                    try:
-                        title_font = ImageFont.truetype("DejaVuSans-Bold.ttf", 42)
-                        artist_font = ImageFont.truetype("DejaVuSans.ttf", 28)
-                        time_font = ImageFont.truetype("DejaVuSans.ttf", 20)
-                    except:
-                        title_font = ImageFont.load_default()
-                        artist_font = ImageFont.load_default()
-                        time_font = ImageFont.load_default()
-            
-            
-            text_x = art_x + album_size + 30
-            
-            
-            track_name = track_info['track_name']
-            if len(track_name) > 20:
-                track_name = track_name[:20] + "..."
-            draw.text((text_x, 60), track_name, font=title_font, fill='white')
-            
-            
-            artist_name = track_info['artist_name']
-            if len(artist_name) > 25:
-                artist_name = artist_name[:25] + "..."
-            draw.text((text_x, 110), artist_name, font=artist_font, fill='#A0A0A0')
-            
-            
-            progress_y = 220
-            progress_width = card_width - text_x - 30  
-            progress_height = 6
-            progress_x = text_x
-            
-            
-            draw.rounded_rectangle([progress_x, progress_y, progress_x + progress_width, progress_y + progress_height], 
-                                 radius=3, fill='#555555')
-            
-            
-            current_time_str = track_info.get('current_time', '00:17')
-            duration_str = track_info['duration']
-            
-            
-            try:
-                current_parts = current_time_str.split(':')
-                current_seconds = int(current_parts[0]) * 60 + int(current_parts[1])
-                
-                duration_parts = duration_str.split(':')
-                duration_seconds = int(duration_parts[0]) * 60 + int(duration_parts[1])
-                
-                if duration_seconds > 0:
-                    progress_ratio = current_seconds / duration_seconds
-                else:
-                    progress_ratio = 0.1
-            except:
-                progress_ratio = 0.1
-            
-            progress_fill = int(progress_width * progress_ratio)
-            draw.rounded_rectangle([progress_x, progress_y, progress_x + progress_fill, progress_y + progress_height], 
-                                 radius=3, fill='white')
-            
-            
-            current_time = track_info.get('current_time', '00:17')
-            total_time = track_info['duration']
-            
-            
-            draw.text((progress_x, progress_y + 20), current_time, font=time_font, fill='#A0A0A0')
-            
-            
-            time_bbox = draw.textbbox((0, 0), total_time, font=time_font)
-            time_width = time_bbox[2] - time_bbox[0]
-            draw.text((progress_x + progress_width - time_width, progress_y + 20), total_time, 
-                     font=time_font, fill='#A0A0A0')
-            
-            
-            card_path = os.path.join(tempfile.gettempdir(), f"spots_card_{track_info['track_id']}.png")
-            card.save(card_path, "PNG")
-            
-            return card_path
-            
-        except Exception as e:
-            logger.error(f"Error creating song card: {e}")
+                formatted_lines.append(f"<i>{text}</i>")
+            else:
+                
+                formatted_lines.append(text)
+        
+        return '\n'.join(formatted_lines)
+
+    def _next_lyric_delay(self, lyrics_data, current_index, clock):
+        """Сколько секунд ждать до следующей строки текста (None — строк больше нет)"""
+        next_time = lyrics_data.next_time(current_index) if lyrics_data else None
+        if next_time is None:
             return None
+        return max(0.0, (next_time - clock.position_ms()) / 1000)
 
-    async def _create_song_card_no_time(self, track_info):
-        """Создаёт красивую карточку с песней без отображения времени"""
+    async def _realtime_lyrics_loop(self, data):
+        """Цикл обновления текста в реальном времени"""
+        subscription = data['subscription'] = self.playback.subscribe()
         try:
+            clock = PlaybackClock()
+            started_at = time.monotonic()
+            max_duration = 600  
+            max_idle_time = 30  
+            max_pause_time = 120  
+            idle_since = None
+            pause_since = None
+            wait = None
             
-            card_width = 800
-            card_height = 250  
-            
-            
-            album_art_url = track_info['album_art']
-            async with aiohttp.ClientSession() as session:
-                async with session.get(album_art_url) as response:
-                    art_data = await response.read()
-                    album_art_original = Image.open(BytesIO(art_data))
-            
-            
-            def get_dominant_color(image):
-                """Получает доминирующий цвет изображения"""
-                small_image = image.resize((50, 50))
-                stat = ImageStat.Stat(small_image)
-                r, g, b = stat.mean
-                return int(r), int(g), int(b)
-            
-            def create_darker_variant(r, g, b, factor=0.4):
-                """Создает более темный вариант цвета"""
-                h, s, v = colorsys.rgb_to_hsv(r/255, g/255, b/255)
-                v = max(0.15, v * factor)
-                s = min(1.0, s * 1.1)
-                r, g, b = colorsys.hsv_to_rgb(h, s, v)
-                return int(r * 255), int(g * 255), int(b * 255)
-            
-            
-            dominant_r, dominant_g, dominant_b = get_dominant_color(album_art_original)
-            
-            
-            bg_r, bg_g, bg_b = create_darker_variant(dominant_r, dominant_g, dominant_b)
-            
-            
-            card = Image.new('RGB', (card_width, card_height), color=(bg_r, bg_g, bg_b))
-            draw = ImageDraw.Draw(card)
-            
-            
-            center_x = 125  
-            center_y = card_height // 2
-            max_distance = max(card_width, card_height)
-            
-            for x in range(card_width):
-                for y in range(card_height):
+            while data['active'] and time.monotonic() - started_at < max_duration:
+                try:
+                    
+                    current_playback = await subscription.get(timeout=wait)
+                    wait = None
+                    if not data['active']:
+                        break
+                    
+                    edit_error = self.editor.failed(data['chat_id'], data['message_id'])
+                    if edit_error:
+                        
+                        logger.debug(f"Live lyrics message is no longer editable: {edit_error}")
+                        break
+                    
+                    if not current_playback or not current_playback.track:
+                        
+                        idle_since = idle_since or time.monotonic()
+                        if time.monotonic() - idle_since > max_idle_time:  
+                            break
+                        continue
                     
-                    distance = ((x - center_x) ** 2 + (y - center_y) ** 2) ** 0.5
+                    idle_since = None
                     
-                    factor = min(1.0, distance / max_distance)
+                    current_track_id = current_playback.track.id
+                    if current_track_id != data['track_id']:
+                        
+                        break
                     
+                    if clock.update(current_playback):
+                        logger.debug("Playback position drift detected, resynced")
                     
-                    final_r = int(bg_r + (bg_r * 0.2 - bg_r) * factor)
-                    final_g = int(bg_g + (bg_g * 0.2 - bg_g) * factor)
-                    final_b = int(bg_b + (bg_b * 0.2 - bg_b) * factor)
+                    if not current_playback.is_playing:
+                        
+                        if pause_since is None:
+                            pause_since = time.monotonic()
+                            self.editor.submit(
+                                data['chat_id'],
+                                data['message_id'],
+                                data['header'] + "⏸️ <i>Воспроизведение приостановлено</i>",
+                            )
+                        
+                        elif time.monotonic() - pause_since >= max_pause_time:
+                            self.editor.submit(
+                                data['chat_id'],
+                                data['message_id'],
+                                data['header'] + "⏸️ <i>Сеанс завершен из-за длительной паузы</i>",
+                            )
+                            break
+                        
+                        continue
                     
+                    if pause_since is not None:
+                        pause_since = None
+                        data['last_line_index'] = -1
                     
-                    final_r = max(0, min(255, final_r))
-                    final_g = max(0, min(255, final_g))
-                    final_b = max(0, min(255, final_b))
                     
+                    current_line, current_index = self._get_current_lyric_line(data['lyrics_data'], clock.position_ms())
                     
-                    card.putpixel((x, y), (final_r, final_g, final_b))
-            
-            
-            album_size = 200  
-            album_art = album_art_original.resize((album_size, album_size), Image.Resampling.LANCZOS)
-            
-            
-            mask = Image.new('L', (album_size, album_size), 0)
-            mask_draw = ImageDraw.Draw(mask)
-            mask_draw.rounded_rectangle([0, 0, album_size, album_size], radius=20, fill=255)
-            
-            
-            album_art.putalpha(mask)
+                    
+                    if current_index != data['last_line_index']:
+                        formatted_lyrics = self._format_realtime_lyrics(data['lyrics_data'], current_index)
+                        data['last_line_index'] = current_index
+                        
+                        
+                        self.editor.submit(data['chat_id'], data['message_id'], data['header'] + formatted_lyrics)
+                    
+                    
+                    wait = self._next_lyric_delay(data['lyrics_data'], current_index, clock)
+                    if clock.track_finished():
+                        self.playback.wake()
+                    elif wait is None:
+                        wait = clock.time_left()
+                    
+                except SpotifyAPIError as e:
+                    
+                    logger.debug(f"Spotify API error: {e}")
+                    continue
+                except Exception as e:
+                    logger.error(f"Error in realtime lyrics loop: {e}")
+                    await asyncio.sleep(2)  
             
             
-            art_x = 25
-            art_y = int((card_height - album_size) // 2)  
-            card.paste(album_art, (art_x, art_y), album_art)
+            data['active'] = False
             
             
-            try:
-                title_font = ImageFont.truetype("/System/Library/Fonts/Helvetica-Bold.ttc", 42)
-                artist_font = ImageFont.truetype("/System/Library/Fonts/Helvetica.ttc", 28)
-            except:
+            if pause_since is None or time.monotonic() - pause_since < max_pause_time:
+                self.editor.submit(
+                    data['chat_id'],
+                    data['message_id'],
+                    data['header'] + "✅ <i>Сеанс синхронизации завершен</i>",
+                )
+            await self.editor.flush(data['chat_id'], data['message_id'])
+                
+        except Exception as e:
+            logger.error(f"Critical error in realtime lyrics loop: {e}")
+            data['active'] = False
+        finally:
+            subscription.close()
+            self.editor.forget(data['chat_id'], data['message_id'])
+            logger.debug(f"Live edits: {self.editor.stats}")
+
+    def _now_track_info(self, track, progress_ms):
+        """Данные для карточки .now; прогресс не выходит за длительность трека"""
+        duration_min, duration_sec = divmod(track.duration_ms // 1000, 60)
+        progress_min, progress_sec = divmod(min(progress_ms, track.duration_ms) // 1000, 60)
+        return {
+            'track_name': track.name,
+            'artist_name': track.artist_name,
+            'album_name': track.album_name,
+            'duration': f"{duration_min}:{duration_sec:02d}",
+            'current_time': f"{progress_min}:{progress_sec:02d}",
+            'album_art': track.album_art,
+            'track_id': track.id
+        }
+
+    def _now_caption(self, track):
+        return f"🎵 | <a href='{track.url}'>Spotify</a> • <a href='https://song.link/s/{track.id}'>song.link</a>"
+
+    async def _now_live_loop(self, data):
+        """Цикл обновления прогресса на карточке .now; статичные слои рисуются один раз на трек"""
+        subscription = data['subscription'] = self.playback.subscribe()
+        try:
+            clock = PlaybackClock()
+            started_at = time.monotonic()
+            max_duration = 1200
+            max_idle_time = 30
+            max_pause_time = 120
+            idle_since = None
+            pause_since = None
+            next_render = time.monotonic() + self.config['now_live_interval']
+            wait = None
+
+            while data['active'] and time.monotonic() - started_at < max_duration:
                 try:
-                    title_font = ImageFont.truetype("arial.ttf", 42)
-                    artist_font = ImageFont.truetype("arial.ttf", 28)
-                except:
-                    try:
-                        title_font = ImageFont.truetype("DejaVuSans-Bold.ttf", 42)
-                        artist_font = ImageFont.truetype("DejaVuSans.ttf", 28)
-                    except:
-                        title_font = ImageFont.load_default()
-                        artist_font = ImageFont.load_default()
-            
-            
-            text_x = art_x + album_size + 30
-            
-            
-            track_name = track_info['track_name']
-            if len(track_name) > 20:
-                track_name = track_name[:20] + "..."
-            
-            
-            title_y = card_height // 2 - 30
-            artist_y = card_height // 2 + 10
-            
-            draw.text((text_x, title_y), track_name, font=title_font, fill='white')
+                    current_playback = await subscription.get(timeout=wait)
+                    wait = None
+                    if not data['active']:
+                        break
+
+                    edit_error = self.editor.failed(data['chat_id'], data['message_id'])
+                    if edit_error:
+                        logger.debug(f"Live card message is no longer editable: {edit_error}")
+                        break
+
+                    if not current_playback or not current_playback.track:
+                        idle_since = idle_since or time.monotonic()
+                        if time.monotonic() - idle_since > max_idle_time:
+                            break
+                        continue
+
+                    idle_since = None
+                    clock.update(current_playback)
+
+                    if not current_playback.is_playing:
+                        pause_since = pause_since or time.monotonic()
+                        if time.monotonic() - pause_since >= max_pause_time:
+                            break
+                        continue
+
+                    pause_since = None
+                    track_changed = current_playback.track.id != data['track'].id
+                    data['track'] = current_playback.track
+
+                    if track_changed or time.monotonic() >= next_render:
+                        next_render = time.monotonic() + self.config['now_live_interval']
+                        card_file = await self._create_song_card(
+                            self._now_track_info(data['track'], clock.position_ms())
+                        )
+                        if card_file:
+                            self.editor.submit(
+                                data['chat_id'],
+                                data['message_id'],
+                                self._now_caption(data['track']),
+                                card_file,
+                            )
+
+                    # трек кончился или длительность неизвестна — ждём следующий снимок без таймаута
+                    time_left = clock.time_left()
+                    if clock.track_finished():
+                        self.playback.wake()
+                    elif time_left:
+                        wait = max(0.0, min(next_render - time.monotonic(), time_left))
+
+                except SpotifyAPIError as e:
+                    logger.debug(f"Spotify API error: {e}")
+                    continue
+                except Exception as e:
+                    logger.error(f"Error in live card loop: {e}")
+                    await asyncio.sleep(2)
+
+            data['active'] = False
+            await self.editor.flush(data['chat_id'], data['message_id'])
+
+        except Exception as e:
+            logger.error(f"Critical error in live card loop: {e}")
+            data['active'] = False
+        finally:
+            subscription.close()
+            self.editor.forget(data['chat_id'], data['message_id'])
+
+    def _card_encoding(self, card_type):
+        """Формат карточки из конфига; auto — лучший для этого типа карточек"""
+        card_format = self.config['card_format']
+        if card_format == "auto":
+            card_format = AUTO_CARD_FORMATS[card_type]
+        return CardEncoding(card_format, self.config['card_quality'], self.config['png_compress_level'])
+
+    async def _create_song_card(self, track_info):
+        """Создаёт красивую карточку с песней с адаптивным цветом фона"""
+        try:
             
+            album_art = await self.album_art.get(track_info['album_art'])
+            encoding = self._card_encoding("now")
+            card_data = await self.render_pool.render(render_song_card, track_info, album_art, encoding)
             
-            artist_name = track_info['artist_name']
-            if len(artist_name) > 25:
-                artist_name = artist_name[:25] + "..."
-            draw.text((text_x, artist_y), artist_name, font=artist_font, fill='#A0A0A0')
             
+            card_file = BytesIO(card_data)
+            card_file.name = f"spots_card_{track_info['track_id']}.{encoding.extension}"
             
-            live_indicator_x = card_width - 80
-            live_indicator_y = 20
+            return card_file
             
+        except Exception as e:
+            logger.error(f"Error creating song card: {e}")
+            return None
+
+    async def _create_song_card_no_time(self, track_info):
+        """Создаёт красивую карточку с песней без отображения времени"""
+        try:
             
-            draw.ellipse([live_indicator_x, live_indicator_y, live_indicator_x + 12, live_indicator_y + 12], fill='#FF0000')
-            draw.text((live_indicator_x + 20, live_indicator_y - 3), "LIVE", font=artist_font, fill='#FF0000')
+            album_art = await self.album_art.get(track_info['album_art'])
+            encoding = self._card_encoding("playnow")
+            card_data = await self.render_pool.render(render_song_card_no_time, track_info, album_art, encoding)
             
             
-            card_path = os.path.join(tempfile.gettempdir(), f"playnow_card_{track_info['track_id']}.png")
-            card.save(card_path, "PNG")
+            card_file = BytesIO(card_data)
+            card_file.name = f"playnow_card_{track_info['track_id']}.{encoding.extension}"
             
-            return card_path
+            return card_file
             
         except Exception as e:
             logger.error(f"Error creating song card without time: {e}")
             return None
 
-    async def _playnow_loop(self):
+    async def _playnow_loop(self, data):
         """Цикл обновления карточки и текста в реальном времени"""
-        if not hasattr(self, '_playnow_data') or not self._playnow_data['active']:
-            return
-            
+        subscription = data['subscription'] = self.playback.subscribe()
         try:
-            data = self._playnow_data
-            update_count = 0
-            max_updates = 1200  
-            pause_count = 0
+            clock = PlaybackClock()
+            started_at = time.monotonic()
+            max_duration = 1200  
+            max_idle_time = 30  
             max_pause_time = 120  
-            last_pause_message_count = -1
+            idle_since = None
+            pause_since = None
+            wait = None
             current_track_id = data.get('current_track_id')
+            self._schedule_prefetch()
             
-            while data['active'] and update_count < max_updates:
+            while data['active'] and time.monotonic() - started_at < max_duration:
                 try:
                     
-                    sp = spotipy.Spotify(auth=self.config['auth_token'])
-                    current_playback = sp.current_playback()
+                    current_playback = await subscription.get(timeout=wait)
+                    wait = None
+                    if not data['active']:
+                        break
+                    
+                    edit_error = self.editor.failed(data['chat_id'], data['message_id'])
+                    if edit_error:
+                        logger.debug(f"Playnow message is no longer editable: {edit_error}")
+                        break
                     
-                    if not current_playback or not current_playback.get('item'):
+                    if not current_playback or not current_playback.track:
                         
-                        pause_count += 1
-                        if pause_count > 30: 
+                        idle_since = idle_since or time.monotonic()
+                        if time.monotonic() - idle_since > max_idle_time: 
                             break
-                        await asyncio.sleep(1)
-                        update_count += 1
                         continue
                     
-                    new_track_id = current_playback['item'].get('id', '')
-                    progress_ms = current_playback.get('progress_ms', 0)
-                    is_playing = current_playback.get('is_playing', False)
+                    idle_since = None
+                    new_track_id = current_playback.track.id
                     
                     
                     track_changed = new_track_id != current_track_id
@@ -972,123 +3036,113 @@ class Spots(loader.Module):
                         await self._update_playnow_for_new_track(data, current_playback)
                         current_track_id = new_track_id
                         data['current_track_id'] = new_track_id
-                        pause_count = 0
-                        last_pause_message_count = -1
+                        pause_since = None
+                        self.playback.wake()
+                        self._schedule_prefetch()
                         continue
                     
-                    if not is_playing:
+                    clock.update(current_playback)
+                    
+                    if not current_playback.is_playing:
                         
-                        pause_count += 1
+                        if pause_since is None:
+                            pause_since = time.monotonic()
+                            self.editor.submit(
+                                data['chat_id'],
+                                data['message_id'],
+                                "⏸️ <i>Воспроизведение приостановлено</i>",
+                            )
                         
-                        if pause_count >= max_pause_time:
-                            new_text = "⏸️ <i>Сеанс завершен из-за длительной паузы</i>"
-                            try:
-                                await self._client.edit_message(
-                                    data['chat_id'],
-                                    data['message_id'],
-                                    new_text,
-                                    parse_mode='html'
-                                )
-                            except:
-                                pass
+                        elif time.monotonic() - pause_since >= max_pause_time:
+                            self.editor.submit(
+                                data['chat_id'],
+                                data['message_id'],
+                                "⏸️ <i>Сеанс завершен из-за длительной паузы</i>",
+                            )
                             break
                         
-                        if last_pause_message_count == -1 or pause_count - last_pause_message_count >= 10:
-                            formatted_lyrics = "⏸️ <i>Воспроизведение приостановлено</i>"
-                            try:
-                                await self._client.edit_message(
-                                    data['chat_id'],
-                                    data['message_id'],
-                                    formatted_lyrics,
-                                    parse_mode='html'
-                                )
-                                last_pause_message_count = pause_count
-                            except Exception as edit_error:
-                                logger.debug(f"Failed to edit pause message: {edit_error}")
-                            
-                        await asyncio.sleep(1)
-                        update_count += 1
                         continue
+                    
+                    if pause_since is not None:
+                        pause_since = None
+                        data['last_line_index'] = -1
+                    
+                    
+                    if data.get('lyrics_data'):
+                        current_line, current_index = self._get_current_lyric_line(data['lyrics_data'], clock.position_ms())
                         
-                    else:
-                        
-                        if pause_count > 0:
-                            pause_count = 0
-                            last_pause_message_count = -1
-                        
-                        
-                        if data.get('lyrics_data'):
-                            current_line, current_index = self._get_current_lyric_line(data['lyrics_data'], progress_ms)
+                        if current_index != data.get('last_line_index', -1):
+                            formatted_lyrics = self._format_realtime_lyrics(data['lyrics_data'], current_index)
+                            data['last_line_index'] = current_index
                             
-                            if current_index != data.get('last_line_index', -1):
-                                formatted_lyrics = self._format_realtime_lyrics(data['lyrics_data'], current_index)
-                                data['last_line_index'] = current_index
-                                
-                                try:
-                                    await self._client.edit_message(
-                                        data['chat_id'],
-                                        data['message_id'],
-                                        formatted_lyrics,
-                                        parse_mode='html'
-                                    )
-                                except Exception as edit_error:
-                                    logger.debug(f"Failed to edit message: {edit_error}")
-                                    break
+                            self.editor.submit(data['chat_id'], data['message_id'], formatted_lyrics)
+                        
+                        wait = self._next_lyric_delay(data['lyrics_data'], current_index, clock)
                     
-                    await asyncio.sleep(1)
-                    update_count += 1
+                    if clock.track_finished():
+                        self.playback.wake()
+                    elif wait is None:
+                        wait = clock.time_left()
                     
-                except spotipy.exceptions.SpotifyException as e:
+                except SpotifyAPIError as e:
                     logger.debug(f"Spotify API error: {e}")
-                    await asyncio.sleep(3)
-                    update_count += 1
                     continue
                 except Exception as e:
                     logger.error(f"Error in playnow loop: {e}")
                     await asyncio.sleep(2)
-                    update_count += 1
             
             
             data['active'] = False
             
-            try:
-                final_text = "✅ <i>Сеанс live-отображения завершен</i>"
-                await self._client.edit_message(
+            if pause_since is None or time.monotonic() - pause_since < max_pause_time:
+                self.editor.submit(
                     data['chat_id'],
                     data['message_id'],
-                    final_text,
-                    parse_mode='html'
+                    "✅ <i>Сеанс live-отображения завершен</i>",
                 )
-            except:
-                pass
+            await self.editor.flush(data['chat_id'], data['message_id'])
                 
         except Exception as e:
             logger.error(f"Critical error in playnow loop: {e}")
-            if hasattr(self, '_playnow_data'):
-                self._playnow_data['active'] = False
+            data['active'] = False
+        finally:
+            subscription.close()
+            self.editor.forget(data['chat_id'], data['message_id'])
+            logger.debug(f"Live edits: {self.editor.stats}")
+
+    async def _prepare_playnow_track(self, track):
+        """Параллельно готовит live-карточку и синхронизированный текст трека"""
+        track_info = {
+            'track_name': track.name,
+            'artist_name': track.artist_name,
+            'album_art': track.album_art,
+            'track_id': track.id
+        }
+        
+        return await asyncio.gather(
+            self._create_song_card_no_time(track_info),
+            self._get_synced_lyrics_data(track.artist_name, track.name, track.duration_ms),
+        )
+
+    def _schedule_prefetch(self):
+        """Готовит следующие треки очереди в фоне, пока играет текущий"""
+        self.prefetcher.schedule(self.spotify.queue, self._prepare_playnow_track)
 
     async def _update_playnow_for_new_track(self, data, current_playback):
         """Обновляет карточку и текст для нового трека"""
         try:
-            track = current_playback['item']
-            track_name = track.get('name', 'Unknown Track')
-            artist_name = track['artists'][0].get('name', 'Unknown Artist')
-            track_url = track['external_urls']['spotify']
-            duration_ms = track.get('duration_ms', 0)
-            track_id = track.get('id', '')
-
-            
-            track_info = {
-                'track_name': track_name,
-                'artist_name': artist_name,
-                'album_art': track['album']['images'][0]['url'],
-                'track_id': track_id
-            }
+            track = current_playback.track
+            track_name = track.name
+            artist_name = track.artist_name
+            track_url = track.url
+            track_id = track.id
 
-            card_path = await self._create_song_card_no_time(track_info)
-            
             
-            lyrics_data = await self._get_synced_lyrics_data(artist_name, track_name, duration_ms)
+            prefetched = self.prefetcher.pop(track_id)
+            if prefetched:
+                card_file, lyrics_data = prefetched.card, prefetched.lyrics
+            else:
+                card_file, lyrics_data = await self._prepare_playnow_track(track)
             
             if lyrics_data:
                 initial_lyrics = "🎵 Ожидание синхронизации..."
@@ -1098,8 +3152,9 @@ class Spots(loader.Module):
                 initial_lyrics = f"❌ <i>Синхронизированный текст для трека не найден</i>\n\n<a href='{track_url}'>{artist_name} — {track_name}</a>"
                 data['lyrics_data'] = None
 
-            if card_path:
+            if card_file:
                 
+                self.editor.forget(data['chat_id'], data['message_id'])
                 try:
                     
                     await self._client.delete_messages(data['chat_id'], data['message_id'])
@@ -1109,19 +3164,13 @@ class Spots(loader.Module):
                 
                 new_message = await self._client.send_file(
                     data['chat_id'],
-                    card_path,
+                    card_file,
                     caption=initial_lyrics,
                     parse_mode='html'
                 )
                 
                 
                 data['message_id'] = new_message.id
-                
-                
-                try:
-                    os.remove(card_path)
-                except:
-                    pass
             
         except Exception as e:
             logger.error(f"Error updating playnow for new track: {e}")
@@ -1133,39 +3182,22 @@ class Spots(loader.Module):
             return await utils.answer(message, self.strings['no_auth_token'].format(self.get_prefix()))
 
         try:
-            sp = spotipy.Spotify(auth=self.config['auth_token'])
-            current_playback = sp.current_playback()
+            current_playback = await self.spotify.current_playback()
 
-            if not current_playback or not current_playback.get('item'):
+            if not current_playback or not current_playback.track:
                 return await utils.answer(message, self.strings['no_song_playing'])
 
             await utils.answer(message, self.strings['lyrics_loading'])
 
-            track = current_playback['item']
-            track_name = track.get('name', 'Unknown Track')
-            artist_name = track['artists'][0].get('name', 'Unknown Artist')
-            track_url = track['external_urls']['spotify']
-            duration_ms = track.get('duration_ms', 0)
-            progress_ms = current_playback.get('progress_ms', 0)
+            track = current_playback.track
+            track_name = track.name
+            artist_name = track.artist_name
+            track_url = track.url
+            duration_ms = track.duration_ms
+            progress_ms = current_playback.progress_ms
 
             
-            lyrics_data = None
-            
-            
-            lyrics_data = await self._get_lyrics_from_lrclib(artist_name, track_name, duration_ms)
-            
-            
-            if not lyrics_data and self.config['genius_token']:
-                genius_lyrics = await self._get_lyrics_from_genius(artist_name, track_name)
-                if genius_lyrics:
-                    lyrics_data = {
-                        'type': 'plain',
-                        'lyrics': genius_lyrics
-                    }
-            
-            
-            if not lyrics_data:
-                lyrics_data = await self._get_lyrics_from_api(artist_name, track_name)
+            lyrics_data = await self._find_lyrics(artist_name, track_name, duration_ms)
 
             if lyrics_data:
                 if lyrics_data['type'] == 'synced':
@@ -1202,29 +3234,87 @@ class Spots(loader.Module):
                     )
                 )
 
-        except spotipy.oauth2.SpotifyOauthError as e:
+        except SpotifyAuthError as e:
             return await utils.answer(message, self.strings['auth_error'].format(str(e)))
-        except spotipy.exceptions.SpotifyException as e:
-            if "The access token expired" in str(e):
+        except SpotifyAPIError as e:
+            if e.status == 401:
                 return await utils.answer(message, self.strings['no_auth_token'].format(self.get_prefix()))
-            if "NO_ACTIVE_DEVICE" in str(e):
+            if e.reason == "NO_ACTIVE_DEVICE":
                 return await utils.answer(message, self.strings['no_song_playing'])
             return await utils.answer(message, self.strings['unexpected_error'].format(str(e)))
 
+    @loader.command()
+    async def lyricscache(self, message):
+        """[purge] - Статистика кэша текстов или его очистка"""
+        if utils.get_args_raw(message).strip().lower() == "purge":
+            self.lyrics_cache.purge()
+            return await utils.answer(message, self.strings['lyrics_cache_purged'])
+
+        stats = self.lyrics_cache.stats()
+        requests_total = stats['hits'] + stats['misses']
+        providers = "\n".join(
+            f"• <b>{provider.name}</b>: <code>{provider.stats.hits}/{provider.stats.calls}</code> найдено, "
+            f"<code>{provider.stats.avg_ms:.0f} ms</code> в среднем, "
+            f"таймаутов <code>{provider.stats.timeouts}</code>, отменено <code>{provider.stats.cancelled}</code>"
+            for provider in self.lyrics_providers.providers
+        )
+        await utils.answer(
+            message,
+            self.strings['lyrics_cache_stats'].format(
+                entries=stats['entries'],
+                negative=stats['negative'],
+                size=stats['size'] / 1024,
+                hits=stats['hits'],
+                misses=stats['misses'],
+                ratio=stats['hits'] / requests_total * 100 if requests_total else 0,
+                providers=providers,
+                local=len(self.lrc_library),
+                prefix=self.get_prefix(),
+            )
+        )
+
+    @loader.command()
+    async def prewarm(self, message):
+        """[pause|resume] - Состояние фонового прогрева кэшей, пауза или продолжение"""
+        args = utils.get_args_raw(message).strip().lower()
+        if args == "pause":
+            self.prewarmer.paused = True
+        elif args == "resume":
+            self.prewarmer.paused = False
+
+        if not self.config['prewarm']:
+            state = "выключен в конфиге"
+        elif self.prewarmer.paused:
+            state = "на паузе"
+        else:
+            state = "включен"
+
+        tracks = self.prewarmer.tracks
+        lyrics = sum(1 for track in tracks if self._lyrics_cached(track))
+        art = sum(1 for track in tracks if track.album_art and self.album_art.cached(track.album_art))
+        await utils.answer(
+            message,
+            self.strings['prewarm_status'].format(
+                state=state,
+                tracks=len(tracks),
+                warmed=self.prewarmer.warmed,
+                lyrics=lyrics,
+                lyrics_ratio=lyrics / len(tracks) * 100 if tracks else 0,
+                art=art,
+                art_ratio=art / len(tracks) * 100 if tracks else 0,
+                used=self.prewarmer.used_today,
+                budget=self.config['prewarm_daily_budget'],
+                prefix=self.get_prefix(),
+            )
+        )
+
     @loader.command()
     async def spauth(self, message):
         """Войти в свой аккаунт"""
         if not self.config['client_id'] or not self.config['client_secret']:
             return await utils.answer(message, self.strings['need_client_tokens'].format(self.get_prefix(), self.get_prefix()))
 
-        sp_oauth = spotipy.oauth2.SpotifyOAuth(
-            client_id=self.config['client_id'],
-            client_secret=self.config['client_secret'],
-            redirect_uri="https://sp.fajox.one",
-            scope=self.config['scopes']
-        )
-
-        auth_url = sp_oauth.get_authorize_url()
+        auth_url = SpotifyClient.authorize_url(self.config['client_id'], self.config['scopes'])
 
         await utils.answer(message, self.strings['go_auth_link'].format(auth_url, self.get_prefix()))
 
@@ -1237,22 +3327,17 @@ class Spots(loader.Module):
         if not code:
             return await utils.answer(message, self.strings['no_code'].format(self.get_prefix()))
 
-        sp_oauth = spotipy.oauth2.SpotifyOAuth(
-            client_id=self.config['client_id'],
-            client_secret=self.config['client_secret'],
-            redirect_uri="https://sp.fajox.one",
-            scope=self.config['scopes']
-        )
         try:
-            token_info = sp_oauth.get_access_token(code)
-            self.config['auth_token'] = token_info['access_token']
-            self.config['refresh_token'] = token_info['refresh_token']
-
-            sp = spotipy.Spotify(auth=token_info['access_token'])
-            current_playback = sp.current_playback()
+            token_info = await self.spotify.exchange_code(
+                self.config['client_id'],
+                self.config['client_secret'],
+                code,
+            )
+            self.tokens.store(token_info)
+            await self.spotify.current_user()
             
             await utils.answer(message, self.strings['code_installed'])
-        except spotipy.oauth2.SpotifyOauthError as e:
+        except SpotifyAuthError as e:
             return await utils.answer(message, self.strings['auth_error'].format(str(e)))
         except Exception as e:
             return await utils.answer(message, self.strings['unexpected_error'].format(str(e)))
@@ -1264,34 +3349,33 @@ class Spots(loader.Module):
             return await utils.answer(message, self.strings['no_auth_token'].format(self.get_prefix()))
 
         try:
-            sp = spotipy.Spotify(auth=self.config['auth_token'])
-            current_playback = sp.current_playback()
+            current_playback = await self.spotify.current_playback()
 
-            if not current_playback or not current_playback.get('item'):
+            if not current_playback or not current_playback.track:
                 return await utils.answer(message, self.strings['no_song_playing'])
 
             await utils.answer(message, self.strings['track_loading'])
 
-            track = current_playback['item']
-            track_name = track.get('name', 'Unknown Track')
-            artist_name = track['artists'][0].get('name', 'Unknown Artist')
-            album_name = track['album'].get('name', 'Unknown Album')
-            duration_ms = track.get('duration_ms', 0)
-            progress_ms = current_playback.get('progress_ms', 0)
-            is_playing = current_playback.get('is_playing', False)
+            track = current_playback.track
+            track_name = track.name
+            artist_name = track.artist_name
+            album_name = track.album_name
+            duration_ms = track.duration_ms
+            progress_ms = current_playback.progress_ms
+            is_playing = current_playback.is_playing
 
             duration_min, duration_sec = divmod(duration_ms // 1000, 60)
             progress_min, progress_sec = divmod(progress_ms // 1000, 60)
 
-            playlist = current_playback.get('context', {}).get('uri', '').split(':')[-1] if current_playback.get('context') else None
-            device_name = current_playback.get('device', {}).get('name', 'Unknown Device')+" "+current_playback.get('device', {}).get('type', '')
-            device_type = current_playback.get('device', {}).get('type', 'unknown')
+            playlist = current_playback.context_uri.split(':')[-1] if current_playback.context_uri else None
+            device_name = current_playback.device_name+" "+current_playback.device_type
+            device_type = current_playback.device_type or 'unknown'
 
-            user_profile = sp.current_user()
-            user_name = user_profile['display_name']
-            user_id = user_profile['id']
+            user_profile = await self.spotify.current_user()
+            user_name = user_profile.display_name
+            user_id = user_profile.id
 
-            track_url = track['external_urls']['spotify']
+            track_url = track.url
             user_url = f"https://open.spotify.com/user/{user_id}"
             playlist_url = f"https://open.spotify.com/playlist/{playlist}" if playlist else None
 
@@ -1305,126 +3389,191 @@ class Spots(loader.Module):
                 + f"\n<b><emoji document_id=5902449142575141204>🔗</emoji> Track URL:</b> <a href='{track_url}'>Open in Spotify</a>"
             )
 
-            with tempfile.TemporaryDirectory() as temp_dir:
-                audio_path = await self.musicdl.dl(f"{artist_name} - {track_name}", only_document=True)
-
-                album_art_url = track['album']['images'][0]['url']
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(album_art_url) as response:
-                        art_path = os.path.join(temp_dir, "cover.jpg")
-                        with open(art_path, "wb") as f:
-                            f.write(await response.read())
-
-            await self._client.send_file(
-                message.chat_id,
-                audio_path,
-                caption=track_info,
-                attributes=[
-                    types.DocumentAttributeAudio(
-                        duration=duration_ms//1000,
-                        title=track_name,
-                        performer=artist_name
+            reply_to = message.reply_to_msg_id if message.is_reply else getattr(message, "top_id", None)
+            sent = None
+
+            
+            document = self.audio_cache.document(track.id)
+            if document:
+                try:
+                    sent = await self._client.send_file(
+                        message.chat_id,
+                        document,
+                        caption=track_info,
+                        reply_to=reply_to
                     )
-                ],
-                thumb=art_path,
-                reply_to=message.reply_to_msg_id if message.is_reply else getattr(message, "top_id", None)
-            )
+                except (FileReferenceExpiredError, MediaEmptyError) as e:
+                    logger.debug(f"Cached audio document is no longer valid: {e}")
+                    self.audio_cache.forget_document(track.id)
+
+            if sent is None:
+                audio_path = await self.audio_cache.fetch(
+                    track.id,
+                    lambda: self.musicdl.dl(f"{artist_name} - {track_name}", only_document=True),
+                )
+                album_art = await self.album_art.get(track.album_art)
+
+                sent = await self._client.send_file(
+                    message.chat_id,
+                    audio_path,
+                    caption=track_info,
+                    attributes=[
+                        types.DocumentAttributeAudio(
+                            duration=duration_ms//1000,
+                            title=track_name,
+                            performer=artist_name
+                        )
+                    ],
+                    thumb=album_art.data,
+                    reply_to=reply_to
+                )
+                self.audio_cache.remember_document(track.id, sent)
 
             await message.delete()
 
-        except spotipy.oauth2.SpotifyOauthError as e:
+        except SpotifyAuthError as e:
             return await utils.answer(message, self.strings['auth_error'].format(str(e)))
-        except spotipy.exceptions.SpotifyException as e:
-            if "The access token expired" in str(e):
+        except SpotifyAPIError as e:
+            if e.status == 401:
                 return await utils.answer(message, self.strings['no_auth_token'].format(self.get_prefix()))
-            if "NO_ACTIVE_DEVICE" in str(e):
+            if e.reason == "NO_ACTIVE_DEVICE":
                 return await utils.answer(message, self.strings['no_song_playing'])
             return await utils.answer(message, self.strings['unexpected_error'].format(str(e)))
 
     @loader.command()
     async def now(self, message):
-        """Красивая карточка с текущим треком"""
+        """[live] - Красивая карточка с текущим треком; live — с обновляемым прогрессом"""
         if not self.config['auth_token']:
             return await utils.answer(message, self.strings['no_auth_token'].format(self.get_prefix()))
 
+        live = utils.get_args_raw(message).strip().lower() == "live"
+
+        reservation = self.live_sessions.reserve("now", message.chat_id) if live else None
+        if live and reservation is None:
+            return await utils.answer(message, self._live_sessions_limit())
+
         try:
-            sp = spotipy.Spotify(auth=self.config['auth_token'])
-            current_playback = sp.current_playback()
+            current_playback = await self.spotify.current_playback()
 
-            if not current_playback or not current_playback.get('item'):
+            if not current_playback or not current_playback.track:
                 return await utils.answer(message, self.strings['no_song_playing'])
 
             await utils.answer(message, self.strings['track_loading'])
 
-            track = current_playback['item']
-            track_name = track.get('name', 'Unknown Track')
-            artist_name = track['artists'][0].get('name', 'Unknown Artist')
-            album_name = track['album'].get('name', 'Unknown Album')
-            duration_ms = track.get('duration_ms', 0)
-            progress_ms = current_playback.get('progress_ms', 0)
-            track_id = track.get('id', '')
-
-            duration_min, duration_sec = divmod(duration_ms // 1000, 60)
-            duration_str = f"{duration_min}:{duration_sec:02d}"
-            
-            progress_min, progress_sec = divmod(progress_ms // 1000, 60)
-            progress_str = f"{progress_min}:{progress_sec:02d}"
-
-            track_url = track['external_urls']['spotify']
-            song_link_url = f"https://song.link/s/{track_id}"
+            track = current_playback.track
+            track_name = track.name
+            artist_name = track.artist_name
+            album_name = track.album_name
 
             
-            track_info = {
-                'track_name': track_name,
-                'artist_name': artist_name,
-                'album_name': album_name,
-                'duration': duration_str,
-                'current_time': progress_str,
-                'album_art': track['album']['images'][0]['url'],
-                'track_id': track_id
-            }
+            track_info = self._now_track_info(track, current_playback.progress_ms)
 
             
-            card_path = await self._create_song_card(track_info)
+            card_file = await self._create_song_card(track_info)
             
             
-            caption = f"🎵 | <a href='{track_url}'>Spotify</a> • <a href='{song_link_url}'>song.link</a>"
+            caption = self._now_caption(track)
 
-            if card_path:
-                await self._client.send_file(
+            if card_file:
+                sent_message = await self._client.send_file(
                     message.chat_id,
-                    card_path,
+                    card_file,
                     caption=caption,
                     reply_to=message.reply_to_msg_id if message.is_reply else getattr(message, "top_id", None)
                 )
-                
-                
-                try:
-                    os.remove(card_path)
-                except:
-                    pass
+
+                if live:
+                    self.live_sessions.start("now", {
+                        'message_id': sent_message.id,
+                        'chat_id': message.chat_id,
+                        'track': track,
+                    }, self._now_live_loop, reservation)
             else:
                 
-                album_art_url = track['album']['images'][0]['url']
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(album_art_url) as response:
-                        art_data = await response.read()
+                album_art = await self.album_art.get(track.album_art)
                         
                 await self._client.send_file(
                     message.chat_id,
-                    art_data,
+                    album_art.data,
                     caption=f"<b>🎧 {track_name}</b>\n<b>👤 {artist_name}</b>\n<b>💿 {album_name}</b>\n\n" + caption,
                     reply_to=message.reply_to_msg_id if message.is_reply else getattr(message, "top_id", None)
                 )
 
             await message.delete()
 
-        except spotipy.oauth2.SpotifyOauthError as e:
+        except SpotifyAuthError as e:
+            return await utils.answer(message, self.strings['auth_error'].format(str(e)))
+        except SpotifyAPIError as e:
+            if e.status == 401:
+                return await utils.answer(message, self.strings['no_auth_token'].format(self.get_prefix()))
+            if e.reason == "NO_ACTIVE_DEVICE":
+                return await utils.answer(message, self.strings['no_song_playing'])
+            return await utils.answer(message, self.strings['unexpected_error'].format(str(e)))
+        finally:
+            self.live_sessions.release(reservation)
+
+    @loader.command()
+    async def stopnow(self, message):
+        """[all] - Остановить обновление live-карточки в этом чате или во всех"""
+        await self._stop_live_sessions(message, "now", "now_live_stopped", "no_now_live_active")
+
+    @loader.command()
+    async def cardbench(self, message):
+        """Замерить скорость и размер карточек текущего трека во всех форматах"""
+        if not self.config['auth_token']:
+            return await utils.answer(message, self.strings['no_auth_token'].format(self.get_prefix()))
+
+        try:
+            current_playback = await self.spotify.current_playback()
+
+            if not current_playback or not current_playback.track:
+                return await utils.answer(message, self.strings['no_song_playing'])
+
+            await utils.answer(message, self.strings['track_loading'])
+
+            track = current_playback.track
+            duration_min, duration_sec = divmod(track.duration_ms // 1000, 60)
+            progress_min, progress_sec = divmod(current_playback.progress_ms // 1000, 60)
+            track_info = {
+                'track_name': track.name,
+                'artist_name': track.artist_name,
+                'duration': f"{duration_min}:{duration_sec:02d}",
+                'current_time': f"{progress_min}:{progress_sec:02d}",
+                'album_art': track.album_art,
+                'track_id': track.id
+            }
+
+            album_art = await self.album_art.get(track.album_art)
+            results = await asyncio.get_running_loop().run_in_executor(
+                None,
+                benchmark_card_encodings,
+                track_info,
+                album_art,
+                self.config['card_quality'],
+                self.config['png_compress_level'],
+            )
+
+            await utils.answer(
+                message,
+                self.strings['card_bench'].format(
+                    artist=track.artist_name,
+                    title=track.name,
+                    results="\n".join(
+                        f"• <b>{card_type}</b> {card_format.upper()}: "
+                        f"<code>{elapsed_ms:.1f} ms</code>, <code>{size_kb:.1f} KB</code>"
+                        for card_type, card_format, elapsed_ms, size_kb in results
+                    ),
+                    now=self._card_encoding("now").format,
+                    playnow=self._card_encoding("playnow").format,
+                )
+            )
+
+        except SpotifyAuthError as e:
             return await utils.answer(message, self.strings['auth_error'].format(str(e)))
-        except spotipy.exceptions.SpotifyException as e:
-            if "The access token expired" in str(e):
+        except SpotifyAPIError as e:
+            if e.status == 401:
                 return await utils.answer(message, self.strings['no_auth_token'].format(self.get_prefix()))
-            if "NO_ACTIVE_DEVICE" in str(e):
+            if e.reason == "NO_ACTIVE_DEVICE":
                 return await utils.answer(message, self.strings['no_song_playing'])
             return await utils.answer(message, self.strings['unexpected_error'].format(str(e)))
 
@@ -1434,21 +3583,24 @@ class Spots(loader.Module):
         if not self.config['auth_token']:
             return await utils.answer(message, self.strings['no_auth_token'].format(self.get_prefix()))
 
+        reservation = self.live_sessions.reserve("rlyrics", message.chat_id)
+        if reservation is None:
+            return await utils.answer(message, self._live_sessions_limit())
+
         try:
-            sp = spotipy.Spotify(auth=self.config['auth_token'])
-            current_playback = sp.current_playback()
+            current_playback = await self.spotify.current_playback()
 
-            if not current_playback or not current_playback.get('item'):
+            if not current_playback or not current_playback.track:
                 return await utils.answer(message, self.strings['no_song_playing'])
 
             await utils.answer(message, self.strings['lyrics_loading'])
 
-            track = current_playback['item']
-            track_name = track.get('name', 'Unknown Track')
-            artist_name = track['artists'][0].get('name', 'Unknown Artist')
-            track_url = track['external_urls']['spotify']
-            duration_ms = track.get('duration_ms', 0)
-            track_id = track.get('id', '')
+            track = current_playback.track
+            track_name = track.name
+            artist_name = track.artist_name
+            track_url = track.url
+            duration_ms = track.duration_ms
+            track_id = track.id
 
             
             lyrics_data = await self._get_synced_lyrics_data(artist_name, track_name, duration_ms)
@@ -1474,36 +3626,46 @@ class Spots(loader.Module):
             sent_message = await utils.answer(message, initial_text)
             
             
-            self._realtime_lyrics_data = {
+            self.live_sessions.start("rlyrics", {
                 'message_id': sent_message.id,
                 'chat_id': message.chat_id,
                 'lyrics_data': lyrics_data,
                 'track_id': track_id,
                 'header': header,
                 'last_line_index': -1,
-                'active': True
-            }
-            
-            
-            asyncio.create_task(self._realtime_lyrics_loop())
+            }, self._realtime_lyrics_loop, reservation)
 
-        except spotipy.oauth2.SpotifyOauthError as e:
+        except SpotifyAuthError as e:
             return await utils.answer(message, self.strings['auth_error'].format(str(e)))
-        except spotipy.exceptions.SpotifyException as e:
-            if "The access token expired" in str(e):
+        except SpotifyAPIError as e:
+            if e.status == 401:
                 return await utils.answer(message, self.strings['no_auth_token'].format(self.get_prefix()))
-            if "NO_ACTIVE_DEVICE" in str(e):
+            if e.reason == "NO_ACTIVE_DEVICE":
                 return await utils.answer(message, self.strings['no_song_playing'])
             return await utils.answer(message, self.strings['unexpected_error'].format(str(e)))
+        finally:
+            self.live_sessions.release(reservation)
+
+    def _live_sessions_limit(self):
+        return self.strings['live_sessions_limit'].format(
+            limit=self.config['max_live_sessions'],
+            prefix=self.get_prefix(),
+        )
+
+    async def _stop_live_sessions(self, message, kind, stopped_string, none_string):
+        """Останавливает сеансы в текущем чате или, с аргументом all, во всех чатах"""
+        everywhere = utils.get_args_raw(message).strip().lower() == "all"
+        stopped = self.live_sessions.stop(kind, None if everywhere else message.chat_id)
+        if not stopped:
+            return await utils.answer(message, self.strings[none_string])
+        if everywhere:
+            return await utils.answer(message, self.strings['live_sessions_stopped'].format(stopped))
+        await utils.answer(message, self.strings[stopped_string])
 
     @loader.command()
     async def stoplyrics(self, message):
-        """Остановить обновление текста в реальном времени"""
-        if hasattr(self, '_realtime_lyrics_data') and self._realtime_lyrics_data.get('active'):
-            self._realtime_lyrics_data['active'] = False
-            await utils.answer(message, self.strings["realtime_stopped"])
-        else:
-            await utils.answer(message, self.strings["no_realtime_active"])
+        """[all] - Остановить обновление текста в реальном времени в этом чате или во всех"""
+        await self._stop_live_sessions(message, "rlyrics", "realtime_stopped", "no_realtime_active")
 
     @loader.command()
     async def playnow(self, message):
@@ -1511,113 +3673,87 @@ class Spots(loader.Module):
         if not self.config['auth_token']:
             return await utils.answer(message, self.strings['no_auth_token'].format(self.get_prefix()))
 
+        reservation = self.live_sessions.reserve("playnow", message.chat_id)
+        if reservation is None:
+            return await utils.answer(message, self._live_sessions_limit())
+
         try:
-            sp = spotipy.Spotify(auth=self.config['auth_token'])
-            current_playback = sp.current_playback()
+            current_playback = await self.spotify.current_playback()
 
-            if not current_playback or not current_playback.get('item'):
+            if not current_playback or not current_playback.track:
                 return await utils.answer(message, self.strings['no_song_playing'])
 
             await utils.answer(message, self.strings['track_loading'])
 
-            track = current_playback['item']
-            track_name = track.get('name', 'Unknown Track')
-            artist_name = track['artists'][0].get('name', 'Unknown Artist')
-            track_url = track['external_urls']['spotify']
-            duration_ms = track.get('duration_ms', 0)
-            track_id = track.get('id', '')
-
-            
-            track_info = {
-                'track_name': track_name,
-                'artist_name': artist_name,
-                'album_art': track['album']['images'][0]['url'],
-                'track_id': track_id
-            }
+            track = current_playback.track
+            track_name = track.name
+            artist_name = track.artist_name
+            track_url = track.url
+            track_id = track.id
 
-            card_path = await self._create_song_card_no_time(track_info)
             
-            
-            lyrics_data = await self._get_synced_lyrics_data(artist_name, track_name, duration_ms)
+            card_file, lyrics_data = await self._prepare_playnow_track(track)
             
             if lyrics_data:
                 initial_caption = "🎵 Ожидание синхронизации..."
             else:
                 initial_caption = f"❌ <i>Синхронизированный текст для трека не найден</i>\n\n<a href='{track_url}'>{artist_name} — {track_name}</a>"
 
-            if card_path:
+            if card_file:
                 
                 sent_message = await self._client.send_file(
                     message.chat_id,
-                    card_path,
+                    card_file,
                     caption=initial_caption,
                     parse_mode='html',
                     reply_to=message.reply_to_msg_id if message.is_reply else getattr(message, "top_id", None)
                 )
-                
-                
-                try:
-                    os.remove(card_path)
-                except:
-                    pass
             else:
                 
                 sent_message = await utils.answer(message, initial_caption)
 
             
-            if hasattr(self, '_playnow_data') and self._playnow_data.get('active'):
-                self._playnow_data['active'] = False
-
-            
-            self._playnow_data = {
+            self.live_sessions.start("playnow", {
                 'message_id': sent_message.id,
                 'chat_id': message.chat_id,
                 'lyrics_data': lyrics_data,
                 'current_track_id': track_id,
                 'last_line_index': -1,
-                'active': True
-            }
+            }, self._playnow_loop, reservation)
             
             await message.delete()
-            
-            
-            asyncio.create_task(self._playnow_loop())
 
-        except spotipy.oauth2.SpotifyOauthError as e:
+        except SpotifyAuthError as e:
             return await utils.answer(message, self.strings['auth_error'].format(str(e)))
-        except spotipy.exceptions.SpotifyException as e:
-            if "The access token expired" in str(e):
+        except SpotifyAPIError as e:
+            if e.status == 401:
                 return await utils.answer(message, self.strings['no_auth_token'].format(self.get_prefix()))
-            if "NO_ACTIVE_DEVICE" in str(e):
+            if e.reason == "NO_ACTIVE_DEVICE":
                 return await utils.answer(message, self.strings['no_song_playing'])
             return await utils.answer(message, self.strings['unexpected_error'].format(str(e)))
+        finally:
+            self.live_sessions.release(reservation)
 
     @loader.command()
     async def stopplaynow(self, message):
-        """Остановить live-отображение трека"""
-        if hasattr(self, '_playnow_data') and self._playnow_data.get('active'):
-            self._playnow_data['active'] = False
-            await utils.answer(message, "✅ <b>Live-отображение трека остановлено</b>")
-        else:
-            await utils.answer(message, "❌ <b>Сеанс live-отображения не активен</b>")
+        """[all] - Остановить live-отображение трека в этом чате или во всех"""
+        await self._stop_live_sessions(message, "playnow", "playnow_stopped", "no_playnow_active")
+
+    @loader.loop(interval=60*15, autostart=True)
+    async def loop_lrc_library(self):
+        """Обновление индекса локальных .lrc файлов"""
+        try:
+            await self.lrc_library.refresh(self.config['lrc_directory'])
+        except Exception as e:
+            logger.debug(f"LRC library refresh failed: {str(e)}")
 
-    @loader.loop(interval=60*40, autostart=True)
+    @loader.loop(interval=60, autostart=True)
     async def loop_token(self):
-        """Автоматическое обновление токена"""
+        """Обновление токена незадолго до истечения срока"""
         if not self.config['auth_token'] or not self.config['refresh_token']:
             return
 
         try:
-            sp_oauth = spotipy.oauth2.SpotifyOAuth(
-                client_id=self.config['client_id'],
-                client_secret=self.config['client_secret'],
-                redirect_uri="https://sp.fajox.one",
-                scope=self.config['scopes']
-            )
-
-            token_info = sp_oauth.refresh_access_token(self.config['refresh_token'])
-            self.config['auth_token'] = token_info['access_token']
-            if 'refresh_token' in token_info:
-                self.config['refresh_token'] = token_info['refresh_token']
+            await self.tokens.get()
         except Exception as e:
             logger.debug(f"Token refresh failed: {str(e)}")
\ No newline at end of file
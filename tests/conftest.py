@@ -0,0 +1,66 @@
+import importlib.util
+import sys
+import types
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+FIXTURES = Path(__file__).resolve().parent / "fixtures"
+
+# Модули грузятся внутри пакета юзербота (`from .. import loader, utils`).
+# Для тестов хватает заглушки с декораторами, которые используются при импорте.
+PACKAGE = "_hikka_stub"
+
+
+def _stub_package():
+    if PACKAGE in sys.modules:
+        return
+
+    def decorator_factory(*args, **kwargs):
+        return lambda func: func
+
+    loader = types.ModuleType(f"{PACKAGE}.loader")
+    loader.Module = type("Module", (), {})
+    loader.tds = lambda cls: cls
+    loader.command = decorator_factory
+    loader.loop = decorator_factory
+    utils = types.ModuleType(f"{PACKAGE}.utils")
+
+    package = types.ModuleType(PACKAGE)
+    package.__path__ = []
+    package.loader, package.utils = loader, utils
+    modules = types.ModuleType(f"{PACKAGE}.modules")
+    modules.__path__ = []
+
+    sys.modules.update({
+        PACKAGE: package,
+        f"{PACKAGE}.loader": loader,
+        f"{PACKAGE}.utils": utils,
+        f"{PACKAGE}.modules": modules,
+    })
+
+
+def load_module(name, *requires):
+    """Импортирует модуль репозитория; без нужных библиотек тест пропускается"""
+    for requirement in requires:
+        pytest.importorskip(requirement)
+    _stub_package()
+
+    qualified = f"{PACKAGE}.modules.{name}"
+    if qualified not in sys.modules:
+        spec = importlib.util.spec_from_file_location(qualified, ROOT / f"{name}.py")
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[qualified] = module
+        spec.loader.exec_module(module)
+    return sys.modules[qualified]
+
+
+@pytest.fixture(scope="session")
+def spots():
+    return load_module("Spots", "aiohttp", "numpy", "PIL", "telethon")
+
+
+@pytest.fixture(scope="session")
+def yamusic_share():
+    return load_module("yamusic_share", "aiohttp", "PIL", "telethon", "yandex_music")
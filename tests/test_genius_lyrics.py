@@ -0,0 +1,90 @@
+import asyncio
+
+from conftest import FIXTURES
+
+EXPECTED = (
+    "[Verse 1]\nFirst line & more\nSecond line\nThird line"
+    "\n\n"
+    "[Chorus]\nChorus line\n\nLast line"
+)
+
+
+def read_page():
+    return (FIXTURES / "genius_page.html").read_text(encoding="utf-8")
+
+
+def normalize(text):
+    return "\n".join(line.strip() for line in text.splitlines())
+
+
+class FakeContent:
+    def __init__(self, data, chunk_size):
+        self._data = data
+        self._chunk_size = chunk_size
+        self.read = 0
+
+    async def iter_chunked(self, _):
+        for offset in range(0, len(self._data), self._chunk_size):
+            chunk = self._data[offset:offset + self._chunk_size]
+            self.read += len(chunk)
+            yield chunk
+
+
+class FakeResponse:
+    def __init__(self, data, chunk_size=512, charset="utf-8"):
+        self.charset = charset
+        self.content = FakeContent(data, chunk_size)
+
+
+def scrape(spots, response, **kwargs):
+    return asyncio.run(spots.scrape_genius_lyrics(response, **kwargs))
+
+
+def test_parser_joins_containers_and_skips_headers(spots):
+    page = read_page()
+    parser = spots.GeniusLyricsParser()
+    parser.feed(page[:page.index('<div class="SongComments">')])
+
+    assert parser.done
+    assert len(parser.parts) == 2
+    assert normalize(parser.lyrics) == EXPECTED
+    assert "Contributors" not in parser.lyrics
+    assert "Advertisement" not in parser.lyrics
+
+
+def test_scrape_matches_parser_for_any_chunking(spots):
+    data = read_page().encode()
+    for chunk_size in (1, 7, 64, 4096):
+        lyrics = scrape(spots, FakeResponse(data, chunk_size))
+        assert normalize(lyrics) == EXPECTED, chunk_size
+
+
+def test_scrape_splits_multibyte_characters(spots):
+    data = read_page().replace("First line", "Первая строка").encode()
+    lyrics = scrape(spots, FakeResponse(data, chunk_size=3))
+    assert "Первая строка & more" in lyrics
+
+
+def test_scrape_stops_after_lyrics_section(spots):
+    page = read_page()
+    tail = "<div>" + "filler " * 200 + "</div>\n"
+    data = page.replace("</main>", tail * 500 + "</main>").encode()
+    response = FakeResponse(data, chunk_size=1024)
+
+    lyrics = scrape(spots, response)
+
+    assert normalize(lyrics) == EXPECTED
+    assert response.content.read < len(data) // 10
+
+
+def test_scrape_respects_max_bytes(spots):
+    data = ("<html><body>" + "<p>no lyrics here</p>" * 5000 + "</body></html>").encode()
+    response = FakeResponse(data, chunk_size=1024)
+
+    assert scrape(spots, response, max_bytes=8 * 1024) is None
+    assert response.content.read <= 8 * 1024
+
+
+def test_scrape_without_lyrics_returns_none(spots):
+    data = b"<html><body><div class='Header'>Genius</div></body></html>"
+    assert scrape(spots, FakeResponse(data)) is None
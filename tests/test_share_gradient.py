@@ -0,0 +1,42 @@
+import colorsys
+
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+
+
+def reference_gradient(width, height, base_color):
+    """Исходная попиксельная отрисовка фона, с которой сверяется быстрая версия"""
+    r, g, b = base_color
+    h, s, v = colorsys.rgb_to_hsv(r / 255, g / 255, b / 255)
+    v = max(0.1, v * 0.3)
+    s = min(1.0, s * 1.2)
+    dark_r, dark_g, dark_b = colorsys.hsv_to_rgb(h, s, v)
+    dark_r, dark_g, dark_b = int(dark_r * 255), int(dark_g * 255), int(dark_b * 255)
+
+    img = Image.new('RGB', (width, height))
+    for y in range(height):
+        factor = 1 - (y / height) * 0.8
+        final_r = max(0, min(255, int(r * factor + dark_r * (1 - factor))))
+        final_g = max(0, min(255, int(g * factor + dark_g * (1 - factor))))
+        final_b = max(0, min(255, int(b * factor + dark_b * (1 - factor))))
+        for x in range(width):
+            img.putpixel((x, y), (final_r, final_g, final_b))
+    return img
+
+
+@pytest.mark.parametrize("base_color", [
+    (0, 0, 0),
+    (255, 255, 255),
+    (200, 30, 60),
+    (12, 140, 220),
+    (128, 128, 0),
+])
+@pytest.mark.parametrize("size", [(1, 1), (37, 91), (120, 210)])
+def test_gradient_matches_per_pixel_reference(yamusic_share, base_color, size):
+    width, height = size
+    image = yamusic_share.YaMusicShare._create_gradient_background(None, width, height, base_color)
+
+    assert image.mode == 'RGB'
+    assert image.size == size
+    assert image.tobytes() == reference_gradient(width, height, base_color).tobytes()
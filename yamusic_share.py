@@ -18,27 +18,288 @@
 # Name: YaMusicShare
 # Description: Поделиться текущим треком как в Яндекс.Музыке (дополнение к YaMusic)
 # meta developer: @LoLpryvet
-# requires: aiohttp pillow yandex-music requests
+# requires: aiohttp pillow yandex-music
 
 import asyncio
+import concurrent.futures
+import functools
+import hashlib
 import logging
-import tempfile
 import aiohttp
 import os
 import re
+from collections import OrderedDict
 from io import BytesIO
 
 from PIL import Image, ImageDraw, ImageFont, ImageStat
 import colorsys
 import yandex_music
-import requests
 
 from telethon import types
+from telethon.errors import FileReferenceExpiredError, MediaEmptyError
 
 from .. import loader, utils
 
 logger = logging.getLogger(__name__)
 
+# одновременных загрузок (обложки, тексты) и потоков отрисовки карточек
+MAX_PARALLEL_DOWNLOADS = 6
+RENDER_WORKERS = 4
+
+# Telegram не собирает в один альбом больше 10 файлов
+MAX_BATCH_SIZE = 10
+
+ALBUM_LINK = re.compile(r"music\.yandex\.\w+/album/(\d+)(?!\d|/track)")
+PLAYLIST_LINK = re.compile(r"music\.yandex\.\w+/users/([^/\s]+)/playlists/(\d+)")
+
+
+def plain_track_id(track_id):
+    """id трека без альбома («123:456» → «123») — один ключ кэша для всех путей"""
+    return str(track_id).split(':', 1)[0]
+
+
+FONT_CANDIDATES = [
+    
+    ("/System/Library/Fonts/Helvetica.ttc", "/System/Library/Fonts/Helvetica.ttc"),
+    ("/System/Library/Fonts/Arial.ttf", "/System/Library/Fonts/Arial Bold.ttf"),
+    
+    ("arial.ttf", "arialbd.ttf"),
+    ("calibri.ttf", "calibrib.ttf"),
+    
+    ("DejaVuSans.ttf", "DejaVuSans-Bold.ttf"),
+    ("LiberationSans-Regular.ttf", "LiberationSans-Bold.ttf"),
+]
+
+# символы, которые шрифт обязан уметь рисовать
+FONT_COVERAGE_TEXT = "Test Тест ЯНДЕКС МУЗЫКА"
+
+
+def _glyph(font, char):
+    image = Image.new('L', (64, 64))
+    ImageDraw.Draw(image).text((4, 4), char, font=font, fill=255)
+    return image.tobytes()
+
+
+def font_covers(font_path, text=FONT_COVERAGE_TEXT):
+    """Есть ли в шрифте глифы для всех символов text (а не только «пустой» квадрат .notdef)"""
+    font = ImageFont.truetype(font_path, 18)
+    missing = _glyph(font, '\U0010FFFF')
+    return all(_glyph(font, char) != missing for char in set(text) if not char.isspace())
+
+
+def _file_stamp(path):
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def discover_fonts():
+    """Ищет первую пару (обычный, жирный) с кириллицей; пути — уже разрешённые файлы"""
+    coverage = {}
+    for regular, bold in FONT_CANDIDATES:
+        try:
+            regular_path = ImageFont.truetype(regular, 18).path
+        except Exception:
+            continue
+
+        if regular_path not in coverage:
+            coverage[regular_path] = font_covers(regular_path)
+        if not coverage[regular_path]:
+            continue
+
+        try:
+            bold_path = ImageFont.truetype(bold, 18).path
+            if bold_path not in coverage:
+                coverage[bold_path] = font_covers(bold_path)
+            if not coverage[bold_path]:
+                bold_path = regular_path
+        except Exception:
+            bold_path = regular_path
+
+        return {
+            'regular': regular_path,
+            'bold': bold_path,
+            'coverage': coverage,
+            'files': {path: _file_stamp(path) for path in {regular_path, bold_path}},
+        }
+
+    return {'regular': None, 'bold': None, 'coverage': coverage, 'files': {}}
+
+
+def fonts_still_valid(fonts):
+    """Сохранённый результат годится, пока файлы шрифтов не менялись; «шрифтов нет» всегда ищется заново"""
+    if not fonts or not fonts.get('regular') or 'files' not in fonts:
+        return False
+    try:
+        return all(_file_stamp(path) == stamp for path, stamp in fonts['files'].items())
+    except OSError:
+        return False
+
+
+@functools.lru_cache(maxsize=128)
+def load_font(font_path, size):
+    """FreeTypeFont по (путь, размер) из кэша; без пути или при ошибке — шрифт по умолчанию"""
+    if font_path:
+        try:
+            return ImageFont.truetype(font_path, size)
+        except Exception:
+            pass
+    return ImageFont.load_default()
+
+
+_measure_draw = ImageDraw.Draw(Image.new('RGB', (1, 1)), "RGBA")
+
+
+@functools.lru_cache(maxsize=4096)
+def measure_text(font, text):
+    """Ширина и высота текста; шрифты берутся из load_font, так что ключ кэша стабилен"""
+    bbox = _measure_draw.textbbox((0, 0), text, font=font)
+    return bbox[2] - bbox[0], bbox[3] - bbox[1]
+
+
+def fit_font(text, max_width, max_height, font_path, initial_size=28, min_size=12):
+    """Наибольший размер от min_size до initial_size, при котором текст влезает, — бинарным поиском"""
+    low, high = min_size, initial_size
+    best = None
+    while low <= high:
+        size = (low + high) // 2
+        font = load_font(font_path, size)
+        try:
+            width, height = measure_text(font, text)
+            fits = width <= max_width and height <= max_height
+        except Exception:
+            fits = False
+        if fits:
+            best = font
+            low = size + 1
+        else:
+            high = size - 1
+    return best if best is not None else load_font(None, 0)
+
+
+class ShareCache:
+    """Строчки текста и готовые карточки по track_id, обложки по URL: LRU-индекс в базе, файлы на диске"""
+
+    def __init__(self, directory, get_limit, load_index, save_index):
+        self._directory = directory
+        self._get_limit = get_limit
+        self._save_index = save_index
+        self._index = OrderedDict(load_index() or {})
+        os.makedirs(directory, exist_ok=True)
+
+    def _entry(self, track_id, create=False):
+        track_id = str(track_id)
+        entry = self._index.get(track_id)
+        if entry is None and create:
+            entry = self._index[track_id] = {}
+        if entry is not None:
+            self._index.move_to_end(track_id)
+        return entry
+
+    def _path(self, name):
+        return os.path.join(self._directory, name)
+
+    def _read(self, name):
+        try:
+            with open(self._path(name), 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _write(self, name, data):
+        with open(self._path(name), 'wb') as f:
+            f.write(data)
+
+    def _remove(self, entry):
+        for name in (entry.get('cover'), entry.get('card')):
+            if name:
+                try:
+                    os.remove(self._path(name))
+                except OSError:
+                    pass
+
+    def _commit(self):
+        while len(self._index) > max(1, self._get_limit()):
+            _, entry = self._index.popitem(last=False)
+            self._remove(entry)
+        self._save_index(dict(self._index))
+
+    def lyrics(self, track_id):
+        """(есть ли запись, строчки); None в записи — текста у трека нет"""
+        entry = self._entry(track_id)
+        if entry is None or 'lyrics' not in entry:
+            return False, None
+        return True, entry['lyrics']
+
+    def set_lyrics(self, track_id, lines):
+        self._entry(track_id, create=True)['lyrics'] = lines
+        self._commit()
+
+    @staticmethod
+    def _cover_id(url):
+        # у треков одного альбома одна обложка — храним её один раз
+        return "cover:" + hashlib.blake2b(url.encode(), digest_size=12).hexdigest()
+
+    def cover(self, url):
+        entry = self._entry(self._cover_id(url))
+        if entry is None or not entry.get('cover'):
+            return None
+        return self._read(entry['cover'])
+
+    def set_cover(self, url, data):
+        cover_id = self._cover_id(url)
+        entry = self._entry(cover_id, create=True)
+        entry['cover'] = f"{cover_id.split(':', 1)[1]}.cover"
+        self._write(entry['cover'], data)
+        self._commit()
+
+    def card(self, track_id, key):
+        """Готовая карточка, если она отрисована с теми же настройками"""
+        entry = self._entry(track_id)
+        if entry is None or entry.get('key') != key or not entry.get('card'):
+            return None
+        data = self._read(entry['card'])
+        if data is None:
+            return None
+        card_file = BytesIO(data)
+        card_file.name = entry['card'].split('.', 1)[1]
+        return card_file
+
+    def set_card(self, track_id, key, card_file):
+        entry = self._entry(track_id, create=True)
+        if entry.get('card'):
+            self._remove({'card': entry['card']})
+        entry['key'] = key
+        entry['card'] = f"{track_id}.{card_file.name}"
+        entry.pop('media', None)
+        self._write(entry['card'], card_file.getvalue())
+        self._commit()
+
+    def media(self, track_id, key):
+        """Уже загруженная в Telegram карточка — её можно переслать без загрузки"""
+        entry = self._entry(track_id)
+        if entry is None or entry.get('key') != key or not entry.get('media'):
+            return None
+        kind, media_id, access_hash, file_reference = entry['media']
+        media_type = types.InputPhoto if kind == 'photo' else types.InputDocument
+        return media_type(id=media_id, access_hash=access_hash, file_reference=bytes.fromhex(file_reference))
+
+    def remember_media(self, track_id, key, message):
+        entry = self._entry(track_id)
+        if entry is None or entry.get('key') != key:
+            return
+        for kind in ('photo', 'document'):
+            media = getattr(message, kind, None)
+            if media is not None:
+                entry['media'] = [kind, media.id, media.access_hash, media.file_reference.hex()]
+                self._save_index(dict(self._index))
+                return
+
+    def forget_media(self, track_id):
+        entry = self._entry(track_id)
+        if entry is not None and entry.pop('media', None) is not None:
+            self._save_index(dict(self._index))
+
+
 @loader.tds
 class YaMusicShare(loader.Module):
     """Поделиться текущим треком как в Яндекс.Музыке (дополнение к YaMusic)"""
@@ -51,11 +312,162 @@ class YaMusicShare(loader.Module):
         "track_loading": "<emoji document_id=5334768819548200731>💻</emoji> <b>Создаю карточку...</b>",
         "auth_error": "<emoji document_id=5854929766146118183>❌</emoji> <b>Ошибка авторизации:</b> <code>{}</code>",
         "unexpected_error": "<emoji document_id=5854929766146118183>❌</emoji> <b>Произошла ошибка:</b> <code>{}</code>",
+        "batch_loading": "<emoji document_id=5334768819548200731>💻</emoji> <b>Создаю карточки для {} треков...</b>",
+        "batch_not_found": "<emoji document_id=5854929766146118183>❌</emoji> <b>Не удалось получить треки по ссылке.</b>\n\n<i>Поддерживаются ссылки на альбомы и плейлисты Яндекс.Музыки</i>",
     }
 
+    def __init__(self):
+        self.config = loader.ModuleConfig(
+            loader.ConfigValue(
+                "card_format",
+                "jpeg",
+                lambda: "Формат карточки: jpeg (быстро и легко), png или webp (уходит документом)",
+                validator=loader.validators.Choice(["jpeg", "png", "webp"]),
+            ),
+            loader.ConfigValue(
+                "card_quality",
+                90,
+                lambda: "Качество JPEG/WebP карточки (1-100)",
+                validator=loader.validators.Integer(minimum=1, maximum=100),
+            ),
+            loader.ConfigValue(
+                "png_compress_level",
+                6,
+                lambda: "Уровень сжатия PNG карточки (0 — быстрее, 9 — меньше)",
+                validator=loader.validators.Integer(minimum=0, maximum=9),
+            ),
+            loader.ConfigValue(
+                "share_cache_size",
+                200,
+                lambda: "Сколько треков хранить в кэше карточек (обложка, текст, карточка)",
+                validator=loader.validators.Integer(minimum=1),
+            ),
+            loader.ConfigValue(
+                "batch_size",
+                6,
+                lambda: "Сколько треков альбома или плейлиста делить по умолчанию (до 10)",
+                validator=loader.validators.Integer(minimum=1, maximum=MAX_BATCH_SIZE),
+            ),
+        )
+
     async def client_ready(self, client, db):
         self.db = db
         self._client = client
+        self._session = None
+        self._ym_client = None
+        self._ym_sync_client = None
+        self._ym_token = None
+        self._ym_lock = asyncio.Lock()
+        self._download_semaphore = asyncio.Semaphore(MAX_PARALLEL_DOWNLOADS)
+        self._cover_tasks = {}
+        self._render_pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=RENDER_WORKERS, thread_name_prefix="yamusic_share"
+        )
+        self._fonts = None
+        self._fonts_task = asyncio.ensure_future(self._load_fonts())
+        self.share_cache = ShareCache(
+            os.path.join(utils.get_base_dir(), "yamusic_share_cache"),
+            lambda: self.config['share_cache_size'],
+            lambda: self.get("share_cache", {}),
+            lambda index: self.set("share_cache", index),
+        )
+
+    async def _load_fonts(self):
+        """Шрифты из базы; поиск заново, только если файлы шрифтов изменились"""
+        fonts = self.get("fonts")
+        try:
+            if not await asyncio.to_thread(fonts_still_valid, fonts):
+                fonts = await asyncio.to_thread(discover_fonts)
+                self.set("fonts", fonts)
+                logger.debug(f"Fonts discovered: {fonts['regular']} / {fonts['bold']}")
+        except Exception as e:
+            logger.error(f"Font discovery error: {e}")
+            fonts = {'regular': None, 'bold': None, 'coverage': {}, 'files': {}}
+        self._fonts = fonts
+        return fonts
+
+    async def _get_fonts(self):
+        if self._fonts is None:
+            await asyncio.shield(self._fonts_task)
+        return self._fonts
+
+    async def on_unload(self):
+        if self._session and not self._session.closed:
+            await self._session.close()
+        self._render_pool.shutdown(wait=False)
+
+    @property
+    def session(self):
+        """Общая aiohttp-сессия для обложек и текстов"""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=10, keepalive_timeout=60),
+                timeout=aiohttp.ClientTimeout(total=20),
+            )
+        return self._session
+
+    async def _get_ym_client(self, token):
+        """Один ClientAsync на токен: инициализируется при первом вызове и пересоздаётся при смене токена"""
+        async with self._ym_lock:
+            if self._ym_token != token:
+                self._reset_ym_client()
+            if self._ym_client is None:
+                client = yandex_music.ClientAsync(token)
+                await client.init()
+                self._ym_client, self._ym_token = client, token
+            return self._ym_client
+
+    async def _get_ym_sync_client(self, token):
+        """Синхронный Client для модуля YaMusic — ему всегда передавался именно он; init() уходит в поток"""
+        async with self._ym_lock:
+            if self._ym_token != token:
+                self._reset_ym_client()
+            if self._ym_sync_client is None:
+                self._ym_sync_client = await asyncio.to_thread(lambda: yandex_music.Client(token).init())
+                self._ym_token = token
+            return self._ym_sync_client
+
+    def _reset_ym_client(self):
+        self._ym_client = None
+        self._ym_sync_client = None
+        self._ym_token = None
+
+    async def _download(self, url):
+        async with self._download_semaphore:
+            async with self.session.get(url) as response:
+                response.raise_for_status()
+                return await response.read()
+
+    async def _render(self, func, *args):
+        """Отрисовка в пуле потоков, чтобы несколько карточек рисовались параллельно и не держали цикл событий"""
+        return await asyncio.get_running_loop().run_in_executor(self._render_pool, func, *args)
+
+    async def _get_cover(self, url):
+        """Обложка из кэша; одновременные запросы одного URL ждут одну загрузку"""
+        data = self.share_cache.cover(url)
+        if data is not None:
+            return data
+        task = self._cover_tasks.get(url)
+        if task is None:
+            task = self._cover_tasks[url] = asyncio.ensure_future(self._fetch_cover(url))
+            task.add_done_callback(lambda _: self._cover_tasks.pop(url, None))
+        return await asyncio.shield(task)
+
+    async def _fetch_cover(self, url):
+        data = await self._download(url)
+        self.share_cache.set_cover(url, data)
+        return data
+
+    def _card_key(self):
+        """От чего зависит готовая карточка, кроме самого трека"""
+        fonts = self._fonts or {}
+        return "|".join(str(part) for part in (
+            self.config['card_format'],
+            self.config['card_quality'],
+            self.config['png_compress_level'],
+            fonts.get('regular'),
+            fonts.get('bold'),
+        ))
 
     def _get_yamusic_module(self):
         """Получает модуль YaMusic если он установлен"""
@@ -81,18 +493,26 @@ class YaMusicShare(loader.Module):
             return None
 
     async def _get_lyrics_from_yamusic(self, client, track_id):
-        """Получает текст песни через Яндекс.Музыку API"""
+        """Получает текст песни через Яндекс.Музыку API: (строчки, получен ли окончательный ответ)"""
+        found, lines = self.share_cache.lyrics(track_id)
+        if found:
+            return lines, True
+        
         try:
-            lyrics = client.tracks_lyrics(track_id)
+            lyrics = await client.tracks_lyrics(track_id)
+            lines = None
             if lyrics and lyrics.download_url:
-                lyrics_text = requests.get(lyrics.download_url).text
+                lyrics_text = (await self._download(lyrics.download_url)).decode('utf-8', errors='replace')
                 
-                lines = [line.strip() for line in lyrics_text.split('\n') if line.strip()]
-                return lines[:3] if lines else None
-            return None
+                lines = [line.strip() for line in lyrics_text.split('\n') if line.strip()][:3] or None
+            self.share_cache.set_lyrics(track_id, lines)
+            return lines, True
+        except yandex_music.exceptions.NotFoundError:
+            self.share_cache.set_lyrics(track_id, None)
+            return None, True
         except Exception as e:
             logger.debug(f"No lyrics found for track {track_id}: {e}")
-            return None
+            return None, False
 
     def _get_dominant_color(self, image):
         """Получает доминирующий цвет изображения"""
@@ -113,9 +533,7 @@ class YaMusicShare(loader.Module):
         dark_r, dark_g, dark_b = int(dark_r * 255), int(dark_g * 255), int(dark_b * 255)
         
         
-        img = Image.new('RGB', (width, height))
-        
-        
+        rows = []
         for y in range(height):
             
             factor = 1 - (y / height) * 0.8  
@@ -129,47 +547,20 @@ class YaMusicShare(loader.Module):
             final_g = max(0, min(255, final_g))
             final_b = max(0, min(255, final_b))
             
-            for x in range(width):
-                img.putpixel((x, y), (final_r, final_g, final_b))
+            rows.append((final_r, final_g, final_b))
+        
+        
+        strip = Image.new('RGB', (1, height))
+        strip.putdata(rows)
         
-        return img
+        return strip.resize((width, height), Image.Resampling.NEAREST)
 
     def _get_optimal_font_size(self, text, max_width, max_height, font_path, initial_size=28):
         """Находит оптимальный размер шрифта для помещения текста в заданные границы"""
         if isinstance(text, bytes):
             text = text.decode('utf-8', errors='ignore')
         
-        font_size = initial_size
-        min_size = 12
-        
-        while font_size >= min_size:
-            try:
-                if font_path:
-                    try:
-                        font = ImageFont.truetype(font_path, font_size)
-                    except:
-                        font = ImageFont.load_default()
-                else:
-                    font = ImageFont.load_default()
-                
-                temp_img = Image.new('RGB', (1, 1))
-                temp_draw = ImageDraw.Draw(temp_img, "RGBA")
-                
-                try:
-                    bbox = temp_draw.textbbox((0, 0), str(text), font=font)
-                    text_width = bbox[2] - bbox[0]
-                    text_height = bbox[3] - bbox[1]
-                    
-                    if text_width <= max_width and text_height <= max_height:
-                        return font
-                except:
-                    pass
-                
-                font_size -= 1
-            except:
-                font_size -= 1
-        
-        return ImageFont.load_default()
+        return fit_font(str(text), max_width, max_height, font_path, initial_size)
 
     def _wrap_text(self, text, max_width, font, draw):
         """Переносит текст на новые строки если он не помещается"""
@@ -184,8 +575,7 @@ class YaMusicShare(loader.Module):
         for word in words:
             test_line = ' '.join(current_line + [word])
             try:
-                bbox = draw.textbbox((0, 0), test_line, font=font)
-                test_width = bbox[2] - bbox[0]
+                test_width, _ = measure_text(font, test_line)
                 
                 if test_width <= max_width:
                     current_line.append(word)
@@ -204,8 +594,37 @@ class YaMusicShare(loader.Module):
         
         return lines if lines else [text[:20] + "..." if len(text) > 20 else text]
 
+    def _encode_card(self, card, name):
+        """Кодирует карточку в памяти в формате из конфига"""
+        card_format = self.config['card_format']
+        card_file = BytesIO()
+        if card_format == "png":
+            card.save(card_file, "PNG", compress_level=self.config['png_compress_level'])
+            extension = "png"
+        elif card_format == "webp":
+            card.save(card_file, "WEBP", quality=self.config['card_quality'], method=0)
+            extension = "webp"
+        else:
+            card.save(card_file, "JPEG", quality=self.config['card_quality'], optimize=True)
+            extension = "jpg"
+        
+        card_file.name = f"{name}.{extension}"
+        card_file.seek(0)
+        return card_file
+
     async def _create_yamusic_share_card(self, track_info, lyrics_lines=None):
         """Создает карточку в стиле Яндекс.Музыки с тремя строчками текста"""
+        try:
+            art_data = await self._get_cover(track_info['album_art'])
+        except Exception as e:
+            logger.error(f"Error downloading album art: {e}")
+            return None
+        
+        font_paths = await self._get_fonts()
+        return await self._render(self._render_yamusic_share_card, track_info, art_data, font_paths, lyrics_lines)
+
+    def _render_yamusic_share_card(self, track_info, art_data, font_paths, lyrics_lines=None):
+        """Рисует карточку по уже скачанной обложке (выполняется в пуле отрисовки)"""
         try:
             
             card_width = 600
@@ -213,11 +632,7 @@ class YaMusicShare(loader.Module):
             margin = 30
             
             
-            album_art_url = track_info['album_art']
-            async with aiohttp.ClientSession() as session:
-                async with session.get(album_art_url) as response:
-                    art_data = await response.read()
-                    album_art_original = Image.open(BytesIO(art_data))
+            album_art_original = Image.open(BytesIO(art_data))
             
             
             dominant_color = self._get_dominant_color(album_art_original)
@@ -243,40 +658,6 @@ class YaMusicShare(loader.Module):
             draw = ImageDraw.Draw(card, "RGBA")
             
             
-            font_paths = {
-                'bold': None,
-                'regular': None
-            }
-            
-            font_candidates = [
-                
-                ("/System/Library/Fonts/Helvetica.ttc", "/System/Library/Fonts/Helvetica.ttc"),
-                ("/System/Library/Fonts/Arial.ttf", "/System/Library/Fonts/Arial Bold.ttf"),
-                
-                ("arial.ttf", "arialbd.ttf"),
-                ("calibri.ttf", "calibrib.ttf"),
-                
-                ("DejaVuSans.ttf", "DejaVuSans-Bold.ttf"),
-                ("Liberation Sans", "Liberation Sans Bold"),
-                
-                (None, None)
-            ]
-            
-            for regular, bold in font_candidates:
-                try:
-                    if regular:
-                        test_font = ImageFont.truetype(regular, 18)
-                        temp_img = Image.new('RGB', (10, 10))
-                        temp_draw = ImageDraw.Draw(temp_img)
-                        temp_draw.text((0, 0), "Test Тест", font=test_font, fill='white')
-                        
-                        font_paths['regular'] = regular
-                        font_paths['bold'] = bold if bold else regular
-                        break
-                except:
-                    continue
-            
-            
             track_name = str(track_info['track_name'])
             track_name = track_name.encode('utf-8', errors='ignore').decode('utf-8')
             
@@ -393,18 +774,182 @@ class YaMusicShare(loader.Module):
                 draw.text((card_width//2 - 60, card_height - 75), yamusic_text, font=small_font, fill='#FFCC00')
             
             
-            card_path = os.path.join(tempfile.gettempdir(), f"yamusic_share_{track_info['track_id']}.png")
-            card.save(card_path, "PNG", optimize=True, quality=95)
-            
-            return card_path
+            return self._encode_card(card, f"yamusic_share_{track_info['track_id']}")
             
         except Exception as e:
             logger.error(f"Error creating Яндекс.Музыка share card: {e}")
             return None
 
+    def _draw_centered(self, draw, text, y, font, fill, width):
+        text_width, _ = measure_text(font, text)
+        draw.text(((width - text_width) // 2, y), text, font=font, fill=fill)
+
+    def _render_collage(self, title, subtitle, covers, font_paths):
+        """Одна карточка-коллаж из обложек альбома или плейлиста (выполняется в пуле отрисовки)"""
+        images = []
+        for data in covers:
+            try:
+                images.append(Image.open(BytesIO(data)).convert('RGB'))
+            except Exception as e:
+                logger.debug(f"Skipping broken cover in collage: {e}")
+        if not images:
+            return None
+        
+        columns = 2 if len(images) <= 4 else 3
+        rows = -(-len(images) // columns)
+        cell = 260 if columns == 2 else 180
+        gap = 20
+        margin = 30
+        header = 110
+        
+        card_width = max(600, columns * cell + (columns - 1) * gap + margin * 2)
+        grid_x = (card_width - (columns * cell + (columns - 1) * gap)) // 2
+        grid_bottom = header + rows * (cell + gap) - gap
+        card_height = grid_bottom + 170
+        
+        card = self._create_gradient_background(card_width, card_height, self._get_dominant_color(images[0]))
+        
+        mask = Image.new('L', (cell, cell), 0)
+        ImageDraw.Draw(mask).rounded_rectangle([0, 0, cell, cell], radius=16, fill=255)
+        for i, image in enumerate(images):
+            x = grid_x + (i % columns) * (cell + gap)
+            y = header + (i // columns) * (cell + gap)
+            card.paste(image.resize((cell, cell), Image.Resampling.LANCZOS), (x, y), mask)
+        
+        draw = ImageDraw.Draw(card, "RGBA")
+        max_text_width = card_width - margin * 2
+        
+        title_font = fit_font(title, max_text_width, 50, font_paths['bold'], 36)
+        title_line = (self._wrap_text(title, max_text_width, title_font, draw) or [title])[0]
+        self._draw_centered(draw, title_line, 40, title_font, 'white', card_width)
+        
+        if subtitle:
+            subtitle_font = fit_font(subtitle, max_text_width, 40, font_paths['regular'], 26)
+            subtitle_line = (self._wrap_text(subtitle, max_text_width, subtitle_font, draw) or [subtitle])[0]
+            self._draw_centered(draw, subtitle_line, grid_bottom + 30, subtitle_font, '#B8B8B8', card_width)
+        
+        yamusic_text = "ЯНДЕКС МУЗЫКА"
+        small_font = fit_font(yamusic_text, card_width - margin * 4, 30, font_paths['regular'], 22)
+        self._draw_centered(draw, yamusic_text, card_height - 75, small_font, '#FFCC00', card_width)
+        
+        return self._encode_card(card, "yamusic_share_collage")
+
+    def _track_card_info(self, track):
+        return {
+            'track_name': track.title,
+            'artist_name': ", ".join(track.artists_name()),
+            'album_art': track.get_cover_url('400x400'),
+            'track_id': plain_track_id(track.id),
+        }
+
+    async def _get_batch_tracks(self, client, link, count):
+        """Название, подпись и треки альбома или плейлиста по ссылке"""
+        album_match = ALBUM_LINK.search(link)
+        playlist_match = PLAYLIST_LINK.search(link)
+        
+        if album_match:
+            album = await client.albums_with_tracks(album_match.group(1))
+            if not album:
+                return None, None, []
+            title = album.title
+            subtitle = ", ".join(artist.name for artist in album.artists or [])
+            tracks = [track for volume in album.volumes or [] for track in volume]
+        elif playlist_match:
+            user, kind = playlist_match.groups()
+            playlist = await client.users_playlists(int(kind), user)
+            if not playlist:
+                return None, None, []
+            title = playlist.title
+            subtitle = getattr(playlist.owner, 'name', None) or user
+            shorts = (playlist.tracks or [])[:count * 2]
+            tracks = [short.track for short in shorts if short.track]
+            if len(tracks) < len(shorts):
+                tracks = await client.tracks([short.track_id for short in shorts])
+        else:
+            return None, None, []
+        
+        tracks = [track for track in tracks if track.available is not False and track.cover_uri]
+        return title, subtitle, [self._track_card_info(track) for track in tracks[:count]]
+
+    async def _get_share_card(self, client, track_info, card_key, use_media=True):
+        """Карточка трека для отправки: загруженное в Telegram медиа, файл из кэша или новая отрисовка.
+        Второе значение — можно ли кэшировать результат (текст получен окончательно)"""
+        track_id = track_info['track_id']
+        if use_media:
+            media = self.share_cache.media(track_id, card_key)
+            if media:
+                return media, True
+        
+        card_file = self.share_cache.card(track_id, card_key)
+        if card_file is not None:
+            return card_file, True
+        
+        lyrics_lines, lyrics_resolved = await self._get_lyrics_from_yamusic(client, track_id)
+        card_file = await self._create_yamusic_share_card(track_info, lyrics_lines)
+        if card_file and lyrics_resolved:
+            self.share_cache.set_card(track_id, card_key, card_file)
+        return card_file, lyrics_resolved
+
+    async def _share_batch(self, message, client, args):
+        """Карточки для нескольких треков альбома/плейлиста одним альбомом или одной карточкой-коллажем"""
+        link = next((arg for arg in args if "music.yandex" in arg), None)
+        count = next((int(arg) for arg in args if arg.isdigit()), self.config['batch_size'])
+        count = max(1, min(count, MAX_BATCH_SIZE))
+        collage = any(arg.lower() in ("collage", "коллаж") for arg in args)
+        
+        title, subtitle, tracks = await self._get_batch_tracks(client, link, count) if link else (None, None, [])
+        if not tracks:
+            return await utils.answer(message, self.strings['batch_not_found'])
+        
+        await utils.answer(message, self.strings['batch_loading'].format(len(tracks)))
+        reply_to = message.reply_to_msg_id if message.is_reply else getattr(message, "top_id", None)
+        
+        if collage:
+            # в альбоме у всех треков одна обложка — в коллаж идут только разные
+            urls = list(dict.fromkeys(track['album_art'] for track in tracks if track['album_art']))
+            covers = await asyncio.gather(*(self._get_cover(url) for url in urls), return_exceptions=True)
+            font_paths = await self._get_fonts()
+            card_file = await self._render(
+                self._render_collage, title, subtitle, [cover for cover in covers if isinstance(cover, bytes)], font_paths
+            )
+            if not card_file:
+                return await utils.answer(message, self.strings['batch_not_found'])
+            await self._client.send_file(message.chat_id, card_file, reply_to=reply_to)
+            await message.delete()
+            return
+        
+        await self._get_fonts()
+        card_key = self._card_key()
+        for use_media in (True, False):
+            cards = await asyncio.gather(
+                *(self._get_share_card(client, track, card_key, use_media) for track in tracks)
+            )
+            ready = [(track['track_id'], card, cacheable) for track, (card, cacheable) in zip(tracks, cards) if card]
+            if not ready:
+                return await utils.answer(message, self.strings['batch_not_found'])
+            try:
+                sent = await self._client.send_file(
+                    message.chat_id,
+                    [card for _, card, _ in ready],
+                    reply_to=reply_to
+                )
+                break
+            except (FileReferenceExpiredError, MediaEmptyError) as e:
+                if not use_media:
+                    raise
+                logger.debug(f"Cached share cards are no longer valid: {e}")
+                for track_id, _, _ in ready:
+                    self.share_cache.forget_media(track_id)
+        
+        for (track_id, _, cacheable), sent_message in zip(ready, sent if isinstance(sent, list) else [sent]):
+            if cacheable:
+                self.share_cache.remember_media(track_id, card_key, sent_message)
+        
+        await message.delete()
+
     @loader.command()
     async def yshare(self, message):
-        """Поделиться текущим треком в стиле Яндекс.Музыки"""
+        """[ссылка на альбом/плейлист] [кол-во] [collage] — поделиться текущим треком или подборкой в стиле Яндекс.Музыки"""
         
         yamusic_module = self._get_yamusic_module()
         if not yamusic_module:
@@ -416,23 +961,41 @@ class YaMusicShare(loader.Module):
             return await utils.answer(message, self.strings['no_auth_token'])
 
         try:
-            client = yandex_music.Client(token).init()
+            client = await self._get_ym_client(token)
             
+            args = utils.get_args_raw(message).split()
+            if args:
+                return await self._share_batch(message, client, args)
             
-            now = await yamusic_module._YaMusicMod__get_now_playing(token, client)
+            sync_client = await self._get_ym_sync_client(token)
+            now = await yamusic_module._YaMusicMod__get_now_playing(token, sync_client)
             
             if not now or now.get('paused', True):
                 return await utils.answer(message, self.strings['no_song_playing'])
 
-            await utils.answer(message, self.strings['track_loading'])
-
             track_info = now['track']
             track_name = track_info['title']
             artist_name = ", ".join(track_info['artist'])
-            track_id = track_info['track_id']
+            track_id = plain_track_id(track_info['track_id'])
+            reply_to = message.reply_to_msg_id if message.is_reply else getattr(message, "top_id", None)
 
             
-            lyrics_lines = await self._get_lyrics_from_yamusic(client, track_id)
+            await self._get_fonts()
+            card_key = self._card_key()
+            media = self.share_cache.media(track_id, card_key)
+            if media:
+                try:
+                    await self._client.send_file(message.chat_id, media, reply_to=reply_to)
+                    await message.delete()
+                    return
+                except (FileReferenceExpiredError, MediaEmptyError) as e:
+                    logger.debug(f"Cached share card is no longer valid: {e}")
+                    self.share_cache.forget_media(track_id)
+
+            await utils.answer(message, self.strings['track_loading'])
+
+            
+            lyrics_lines, lyrics_resolved = await self._get_lyrics_from_yamusic(client, track_id)
 
             
             card_track_info = {
@@ -443,25 +1006,25 @@ class YaMusicShare(loader.Module):
             }
 
             
-            card_path = await self._create_yamusic_share_card(card_track_info, lyrics_lines)
+            # без окончательного ответа о тексте карточку не кэшируем — иначе она навсегда останется без строк
+            card_file = self.share_cache.card(track_id, card_key)
+            cacheable = card_file is not None or lyrics_resolved
+            if card_file is None:
+                card_file = await self._create_yamusic_share_card(card_track_info, lyrics_lines)
+                if card_file and cacheable:
+                    self.share_cache.set_card(track_id, card_key, card_file)
 
-            if card_path:
-                await self._client.send_file(
+            if card_file:
+                sent = await self._client.send_file(
                     message.chat_id,
-                    card_path,
-                    reply_to=message.reply_to_msg_id if message.is_reply else getattr(message, "top_id", None)
+                    card_file,
+                    reply_to=reply_to
                 )
-                
-                
-                try:
-                    os.remove(card_path)
-                except:
-                    pass
+                if cacheable:
+                    self.share_cache.remember_media(track_id, card_key, sent)
             else:
                 
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(track_info['img']) as response:
-                        art_data = await response.read()
+                art_data = await self._get_cover(track_info['img'])
                 
                 caption = f"🎵 <b>{track_name}</b>\n👤 <b>{artist_name}</b>"
                 if lyrics_lines and lyrics_lines[0]:
@@ -471,12 +1034,13 @@ class YaMusicShare(loader.Module):
                     message.chat_id,
                     art_data,
                     caption=caption,
-                    reply_to=message.reply_to_msg_id if message.is_reply else getattr(message, "top_id", None)
+                    reply_to=reply_to
                 )
 
             await message.delete()
 
         except yandex_music.exceptions.UnauthorizedError:
+            self._reset_ym_client()
             return await utils.answer(message, self.strings['no_auth_token'])
         except Exception as e:
             logger.error(f"Error in yshare: {e}")